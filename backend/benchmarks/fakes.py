@@ -0,0 +1,482 @@
+"""
+Local stand-ins for the external services the backend talks to, used by the offline
+benchmark harness (benchmarks/run_benchmark.py):
+
+- OpenAI: chat completions (text and vision), audio speech (TTS) and realtime sessions
+- Google Vision: images:annotate over REST
+- Supabase: storage object uploads and a small in-memory PostgREST
+
+Each fake sleeps for a latency drawn from a configurable log-normal distribution and
+fails a configurable fraction of requests, so provider slowdowns and error bursts can be
+reproduced without network access.
+"""
+
+import asyncio
+import json
+import math
+import random
+import re
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FAKE_OCR_TEXT = """Universitätsklinikum Musterstadt - Klinik für Innere Medizin
+Arztbrief
+Patientin: Erika Mustermann, geb. 12.08.1941
+Datum: 03.02.2025
+
+Anamnese: Seit zwei Wochen zunehmende Belastungsdyspnoe und Beinödeme beidseits.
+Befund: RR 145/85 mmHg, HF 88/min, feinblasige Rasselgeräusche basal.
+Labor: Hämoglobin 11.8 g/dL (12.0-16.0), Kreatinin 1.4 mg/dL (0.5-1.0), NT-proBNP 2400 pg/mL.
+Diagnosen: Dekompensierte Herzinsuffizienz (I50.01), arterielle Hypertonie (I10).
+Procedere: Torasemid 10 mg 1-0-0, Ramipril 5 mg 1-0-0, Gewichtskontrolle täglich.
+Folgetermin: Kontrolle beim Hausarzt in 2 Wochen.
+Dr. med. M. Beispiel, Oberarzt"""
+
+FAKE_KEYPOINTS = json.dumps({"keypoints": [
+    {"key": "Patient Name", "value": "Erika Mustermann", "category": "patient"},
+    {"key": "Date", "value": "03.02.2025", "category": "date"},
+    {"key": "Diagnosis", "value": "Decompensated heart failure (I50.01)", "category": "diagnosis"},
+    {"key": "Medication", "value": "Torasemid 10 mg 1-0-0", "category": "medication"},
+    {"key": "Medication", "value": "Ramipril 5 mg 1-0-0", "category": "medication"},
+    {"key": "Follow-up", "value": "GP check-up in 2 weeks", "category": "recommendation"},
+]})
+
+FAKE_LAB_VALUES = json.dumps({"values": [
+    {"analyte": "Hämoglobin", "value": 11.8, "unit": "g/dL", "reference_low": 12.0,
+     "reference_high": 16.0, "collected_on": "2025-02-03"},
+    {"analyte": "Kreatinin", "value": 1.4, "unit": "mg/dL", "reference_low": 0.5,
+     "reference_high": 1.0, "collected_on": "2025-02-03"},
+    {"analyte": "NT-proBNP", "value": 2400, "unit": "pg/mL", "reference_low": None,
+     "reference_high": None, "collected_on": "2025-02-03"},
+]})
+
+FAKE_REPORT = """```markdown
+# Comprehensive Medical Report
+
+## Anamnese
+- Progressive exertional dyspnoea and bilateral leg oedema for two weeks [(1)](url)
+
+## Befund
+- BP **145/85 mmHg**, HR 88/min, basal crackles [(1)](url)
+
+## Procedere
+- Torasemid 10 mg and Ramipril 5 mg once daily, daily weight checks [(1)](url)
+
+## Folgetermin
+- GP follow-up in 2 weeks [(1)](url)
+
+## Diagnosen
+- Decompensated heart failure (I50.01), arterial hypertension (I10) [(1)](url)
+
+## Leistung
+Information not found for this section.
+
+## Referenzen
+- (1) Arztbrief
+```"""
+
+
+@dataclass
+class LatencyProfile:
+    """Log-normal latency distribution given by its median and p95 (seconds), plus an error rate."""
+    median: float = 0.05
+    p95: float = 0.15
+    error_rate: float = 0.0
+    rng: random.Random = field(default_factory=random.Random, repr=False)
+
+    @classmethod
+    def parse(cls, spec: str, seed: Optional[int] = None) -> "LatencyProfile":
+        """Parses "median:p95[:error_rate]", e.g. "0.4:1.2:0.01"."""
+        parts = [float(p) for p in spec.split(":")]
+        median, p95 = parts[0], parts[1] if len(parts) > 1 else parts[0]
+        error_rate = parts[2] if len(parts) > 2 else 0.0
+        return cls(median, max(p95, median), error_rate, random.Random(seed))
+
+    def sample(self) -> float:
+        if self.median <= 0:
+            return 0.0
+        sigma = math.log(self.p95 / self.median) / 1.645 if self.p95 > self.median else 0.0
+        return self.rng.lognormvariate(math.log(self.median), sigma)
+
+    def should_fail(self) -> bool:
+        return self.rng.random() < self.error_rate
+
+    async def wait(self):
+        await asyncio.sleep(self.sample())
+
+
+def _approx_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _message_text(messages: list) -> tuple[str, bool]:
+    """Flattens chat messages into text and reports whether an image was attached."""
+    parts, has_image = [], False
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            for item in content:
+                if item.get("type") == "text":
+                    parts.append(item.get("text", ""))
+                elif item.get("type") == "image_url":
+                    has_image = True
+    return "\n".join(parts), has_image
+
+
+def fake_completion_text(prompt: str, has_image: bool) -> str:
+    """Picks a plausible answer for the prompts used by the backend."""
+    if has_image:
+        return FAKE_OCR_TEXT
+    if "Respond with only 'yes' or 'no'" in prompt:
+        return "yes"
+    if "'recent', 'not recent', or 'unknown'" in prompt:
+        return "recent"
+    if "numerical score" in prompt:
+        return "0.93"
+    if "numeric lab measurement" in prompt:
+        return FAKE_LAB_VALUES
+    document_ids = re.findall(r'<document id="([^"]+)">', prompt)
+    if document_ids:
+        keypoints = json.loads(FAKE_KEYPOINTS)["keypoints"]
+        return json.dumps({"documents": [{"document_id": document_id, "keypoints": keypoints}
+                                         for document_id in document_ids]})
+    if "key-value pairs" in prompt:
+        return FAKE_KEYPOINTS
+    if "Comprehensive Medical Summary" in prompt:
+        return FAKE_REPORT
+    if "could not be accepted" in prompt:
+        return "The text in the document is hard to read. Could you please try uploading a clearer photo?"
+    return "According to the Anamnese and Diagnosen sections, the patient has decompensated heart failure."
+
+
+def _fake_logprobs(text: str, probability: float = 0.98) -> dict:
+    """Log-probs of an answer (by default a confident one, p = 0.98 per token), one token per word."""
+    return {"content": [{"token": token, "logprob": math.log(probability), "bytes": None, "top_logprobs": []}
+                        for token in re.findall(r"\s*\S+", text)]}
+
+
+def create_openai_app(profile: LatencyProfile) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+    # Per-token probability of the answers of a model, e.g. to make a cheap tier unsure
+    app.state.answer_confidence = {}
+    app.state.models = []
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await profile.wait()
+        if profile.should_fail():
+            return JSONResponse({"error": {"message": "Rate limit reached", "type": "requests"}},
+                                status_code=429, headers={"retry-after": "0.2"})
+        prompt, has_image = _message_text(body.get("messages", []))
+        model = body.get("model", "gpt-4o-mini")
+        app.state.models.append(model)
+        text = fake_completion_text(prompt, has_image)
+        usage = {"prompt_tokens": _approx_tokens(prompt) + (85 if has_image else 0),
+                 "completion_tokens": _approx_tokens(text)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        if body.get("stream"):
+            async def events():
+                for i in range(0, len(text), 40):
+                    chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                             "model": model, "choices": [{"index": 0, "delta": {"content": text[i:i + 40]},
+                                                          "finish_reason": None}]}
+                    yield f"data: {json.dumps(chunk)}\n\n"
+                    await asyncio.sleep(0)
+                final = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                         "model": model, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+                         "usage": usage}
+                yield f"data: {json.dumps(final)}\n\n"
+                yield "data: [DONE]\n\n"
+            return StreamingResponse(events(), media_type="text/event-stream")
+
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": text},
+                         "logprobs": _fake_logprobs(text, app.state.answer_confidence.get(model, 0.98))
+                         if body.get("logprobs") else None}],
+            "usage": usage,
+        }
+
+    @app.post("/v1/audio/speech")
+    async def speech(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await profile.wait()
+        if profile.should_fail():
+            return JSONResponse({"error": {"message": "Server error"}}, status_code=500)
+        # Roughly 1 KB of "audio" per 20 characters of input
+        return Response(b"\xff\xf3" * (len(body.get("input", "")) * 25), media_type="audio/mpeg")
+
+    @app.post("/v1/realtime/sessions")
+    async def realtime_sessions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await profile.wait()
+        if profile.should_fail():
+            return JSONResponse({"error": {"message": "Server error"}}, status_code=500)
+        return {"id": f"sess_{uuid.uuid4().hex[:12]}", "object": "realtime.session",
+                "model": body.get("model"), "voice": body.get("voice"),
+                "client_secret": {"value": f"ek_{uuid.uuid4().hex}", "expires_at": int(time.time()) + 60}}
+
+    return app
+
+
+def _fake_page(text: str) -> dict:
+    """A Vision page laying out the text line by line in a fixed-width font, one paragraph per line."""
+    blocks = []
+    for row, line in enumerate(text.splitlines()):
+        words, column = [], 0
+        for word in line.split(" "):
+            if word:
+                box = [{"x": 20 + 10 * column, "y": 20 + 30 * row}, {"x": 20 + 10 * (column + len(word)), "y": 20 + 30 * row},
+                       {"x": 20 + 10 * (column + len(word)), "y": 40 + 30 * row}, {"x": 20 + 10 * column, "y": 40 + 30 * row}]
+                words.append({"boundingBox": {"vertices": box}, "symbols": [{"text": char} for char in word]})
+            column += len(word) + 1
+        if words:
+            blocks.append({"paragraphs": [{"words": words}]})
+    return {"width": 1000, "height": 40 + 30 * len(text.splitlines()), "confidence": 0.95, "blocks": blocks}
+
+
+def create_vision_app(profile: LatencyProfile) -> FastAPI:
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/v1/images:annotate")
+    async def annotate(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        await profile.wait()
+        if profile.should_fail():
+            return JSONResponse({"error": {"code": 503, "message": "Service unavailable"}}, status_code=503)
+        responses = [{"textAnnotations": [{"description": FAKE_OCR_TEXT}],
+                      "fullTextAnnotation": {"text": FAKE_OCR_TEXT, "pages": [_fake_page(FAKE_OCR_TEXT)]}}
+                     for _ in body.get("requests", [])]
+        return {"responses": responses}
+
+    return app
+
+
+_FILTER_RE = re.compile(r"^(eq|neq|gt|gte|lt|lte|in|is|cs)\.(.*)$", re.S)
+
+
+def _matches(row: dict, column: str, op: str, raw: str) -> bool:
+    value = row.get(column)
+    if op == "is":
+        return value is None if raw == "null" else str(value).lower() == raw
+    if op == "in":
+        options = [v.strip().strip('"') for v in raw.strip("()").split(",")]
+        return str(value) in options
+    if op == "cs":
+        needle = json.loads(raw)
+        if isinstance(needle, list):
+            # JSONB containment: every needle element is contained in some element
+            return isinstance(value, list) and all(
+                any(item == v or (isinstance(item, dict) and isinstance(v, dict)
+                                  and all(v.get(k) == w for k, w in item.items()))
+                    for v in value)
+                for item in needle)
+        return isinstance(value, dict) and all(value.get(k) == v for k, v in needle.items())
+    if value is None:
+        return False
+    if op == "eq":
+        return str(value) == raw
+    if op == "neq":
+        return str(value) != raw
+    try:
+        left, right = float(value), float(raw)
+    except (TypeError, ValueError):
+        left, right = str(value), raw
+    return {"gt": left > right, "gte": left >= right, "lt": left < right, "lte": left <= right}[op]
+
+
+class FakePostgrest:
+    """In-memory table store understanding the subset of PostgREST the backend uses."""
+
+    def __init__(self):
+        self.tables: dict[str, list[dict]] = {}
+        self.lock = threading.Lock()
+
+    def rows(self, table: str) -> list[dict]:
+        with self.lock:
+            return [dict(row) for row in self.tables.get(table, [])]
+
+    def _filtered(self, table: str, params) -> list[dict]:
+        rows = self.tables.setdefault(table, [])
+        for column, raw in params.multi_items():
+            if column in ("select", "order", "limit", "offset", "on_conflict", "columns"):
+                continue
+            match = _FILTER_RE.match(raw)
+            if match:
+                rows = [row for row in rows if _matches(row, column, match.group(1), match.group(2))]
+        return rows
+
+    @staticmethod
+    def _project(rows: list[dict], select: Optional[str]) -> list[dict]:
+        if not select or select == "*":
+            return [dict(row) for row in rows]
+        columns = [c.strip() for c in select.split(",")]
+        return [{c: row.get(c) for c in columns} for row in rows]
+
+    def select(self, table: str, params) -> list[dict]:
+        with self.lock:
+            rows = list(self._filtered(table, params))
+        order = params.get("order")
+        if order:
+            for clause in reversed(order.split(",")):
+                column, _, direction = clause.partition(".")
+                rows.sort(key=lambda r: (r.get(column) is None, r.get(column) or ""),
+                          reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", 0))
+        limit = params.get("limit")
+        rows = rows[offset:offset + int(limit)] if limit else rows[offset:]
+        return self._project(rows, params.get("select"))
+
+    def insert(self, table: str, payload, upsert: bool, on_conflict: str) -> list[dict]:
+        records = payload if isinstance(payload, list) else [payload]
+        now = datetime.now(timezone.utc).isoformat()
+        inserted = []
+        with self.lock:
+            rows = self.tables.setdefault(table, [])
+            for record in records:
+                record = dict(record)
+                record.setdefault("id", str(uuid.uuid4()))
+                record.setdefault("created_at", now)
+                existing = next((r for r in rows if r.get(on_conflict) == record.get(on_conflict)), None)
+                if existing is not None and upsert:
+                    existing.update(record)
+                    inserted.append(dict(existing))
+                    continue
+                rows.append(record)
+                inserted.append(dict(record))
+        return inserted
+
+    def update(self, table: str, params, changes: dict) -> list[dict]:
+        with self.lock:
+            rows = self._filtered(table, params)
+            for row in rows:
+                row.update(changes)
+            return [dict(row) for row in rows]
+
+    def delete(self, table: str, params) -> list[dict]:
+        with self.lock:
+            doomed = self._filtered(table, params)
+            self.tables[table] = [r for r in self.tables.get(table, []) if r not in doomed]
+            return [dict(row) for row in doomed]
+
+
+def create_supabase_app(storage_profile: LatencyProfile, db_profile: LatencyProfile) -> FastAPI:
+    app = FastAPI()
+    app.state.db = FakePostgrest()
+    app.state.objects = {}
+
+    @app.post("/storage/v1/object/{bucket}/{path:path}")
+    @app.put("/storage/v1/object/{bucket}/{path:path}")
+    async def upload_object(bucket: str, path: str, request: Request):
+        body = await request.body()
+        await storage_profile.wait()
+        if storage_profile.should_fail():
+            return JSONResponse({"statusCode": "500", "error": "Internal", "message": "Storage error"},
+                                status_code=500)
+        app.state.objects[f"{bucket}/{path}"] = len(body)
+        return {"Key": f"{bucket}/{path}", "Id": str(uuid.uuid4())}
+
+    @app.delete("/storage/v1/object/{bucket}")
+    async def remove_objects(bucket: str, request: Request):
+        body = await request.json()
+        await storage_profile.wait()
+        removed = [p for p in body.get("prefixes", []) if app.state.objects.pop(f"{bucket}/{p}", None) is not None]
+        return [{"name": p} for p in removed]
+
+    @app.post("/rest/v1/rpc/update_grandma_files")
+    async def update_grandma_files(request: Request):
+        # database/migrations/007_write_behind.sql
+        body = await request.json()
+        await db_profile.wait()
+        if db_profile.should_fail():
+            return JSONResponse({"code": "XX000", "message": "database error"}, status_code=500)
+        db: FakePostgrest = app.state.db
+        updated = 0
+        with db.lock:
+            for change in body.get("updates", []):
+                key = {column: change[column] for column in ("id", "tenant_id", "patient_id")}
+                for row in db.tables.get("grandma_files", []):
+                    if all(row.get(column) == value for column, value in key.items()):
+                        row.update({column: value for column, value in change.items() if column not in key})
+                        updated += 1
+        return updated
+
+    @app.api_route("/rest/v1/{table}", methods=["GET", "POST", "PATCH", "DELETE"])
+    async def rest(table: str, request: Request):
+        await db_profile.wait()
+        if db_profile.should_fail():
+            return JSONResponse({"code": "XX000", "message": "database error"}, status_code=500)
+        params = request.query_params
+        db: FakePostgrest = app.state.db
+        if request.method == "GET":
+            return db.select(table, params)
+        if request.method == "POST":
+            prefer = request.headers.get("prefer", "")
+            rows = db.insert(table, await request.json(),
+                             upsert="merge-duplicates" in prefer,
+                             on_conflict=params.get("on_conflict", "id"))
+            return JSONResponse(rows, status_code=201)
+        if request.method == "PATCH":
+            return db.update(table, params, await request.json())
+        return db.delete(table, params)
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class ServerThread:
+    """Runs an ASGI app with uvicorn on a background thread bound to 127.0.0.1."""
+
+    def __init__(self, app: FastAPI, port: Optional[int] = None):
+        self.app = app
+        self.port = port or free_port()
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=self.port, log_level="warning", access_log=False))
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self) -> "ServerThread":
+        self.thread.start()
+        deadline = time.time() + 10
+        while not self.server.started:
+            if time.time() > deadline:
+                raise RuntimeError(f"Fake server on port {self.port} did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
@@ -0,0 +1,279 @@
+"""
+End-to-end offline benchmark for the backend.
+
+Starts local fakes for OpenAI, Google Vision and Supabase (see benchmarks/fakes.py),
+launches the API with uvicorn in a subprocess pointed at them, and drives it through
+the patient-intake flow:
+
+    1. /upload-image at the configured concurrency
+    2. background processing (waits until no process_image job is in flight)
+    3. /trigger-report-generation (waits until no report job is in flight)
+    4. /chat at the configured concurrency
+
+and reports throughput, latency percentiles and the peak RSS of the API process.
+No network access or credentials are needed:
+
+    cd backend
+    python -m benchmarks.run_benchmark --uploads 50 --concurrency 8 --openai-latency 0.3:0.9
+
+With --storage local the API uses the embedded storage backend (database/local_storage.py)
+in a temporary directory instead of the Supabase fake.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+import httpx
+
+from benchmarks.fakes import (
+    LatencyProfile,
+    ServerThread,
+    create_openai_app,
+    create_supabase_app,
+    create_vision_app,
+    free_port,
+)
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+DOC_TYPES = ["Doctor's Letter", "Lab Report", "Insurance Card", "Vaccination Card", "Anything else?"]
+
+
+@dataclass
+class PhaseResult:
+    name: str
+    latencies: list = field(default_factory=list)
+    errors: int = 0
+    wall_time: float = 0.0
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))
+        return ordered[index]
+
+    def summary(self) -> dict:
+        count = len(self.latencies) + self.errors
+        return {
+            "phase": self.name,
+            "requests": count,
+            "errors": self.errors,
+            "wall_time_s": round(self.wall_time, 3),
+            "throughput_rps": round(count / self.wall_time, 2) if self.wall_time else None,
+            "p50_s": self.percentile(50),
+            "p95_s": self.percentile(95),
+            "p99_s": self.percentile(99),
+            "max_s": max(self.latencies) if self.latencies else None,
+        }
+
+
+async def run_concurrently(name: str, count: int, concurrency: int, make_request) -> PhaseResult:
+    """Issues `count` requests with at most `concurrency` in flight and records their latency."""
+    result = PhaseResult(name)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                response = await make_request(i)
+                ok = response.status_code < 400
+            except httpx.HTTPError:
+                ok = False
+            if ok:
+                result.latencies.append(time.perf_counter() - start)
+            else:
+                result.errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(count)))
+    result.wall_time = time.perf_counter() - start
+    return result
+
+
+async def wait_for_background(client: httpx.AsyncClient, job: str, name: str, timeout: float) -> PhaseResult:
+    """Polls the API's /metrics until no background job of the given kind is in flight."""
+    result = PhaseResult(name)
+    pattern = re.compile(rf'^background_jobs_inflight{{job="{job}"}} (\S+)$', re.M)
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        response = await client.get("/metrics")
+        match = pattern.search(response.text)
+        if not match or float(match.group(1)) == 0:
+            break
+        await asyncio.sleep(0.05)
+    else:
+        result.errors += 1
+    result.wall_time = time.perf_counter() - start
+    result.latencies.append(result.wall_time)
+    return result
+
+
+def peak_rss_mb(pid: int) -> Optional[float]:
+    """Peak resident set size (VmHWM) of a process, in MB."""
+    try:
+        with open(f"/proc/{pid}/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def start_api(port: int, env: dict) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env)
+
+
+async def wait_until_ready(client: httpx.AsyncClient, process: subprocess.Popen, timeout: float = 30) -> float:
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError(f"API process exited with code {process.returncode}")
+        try:
+            if (await client.get("/metrics")).status_code == 200:
+                return time.perf_counter() - start
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.05)
+    raise RuntimeError("API did not become ready in time")
+
+
+async def drive(args, api_url: str, process: subprocess.Popen) -> list[PhaseResult]:
+    image_bytes = Path(args.image).read_bytes()
+    params = {"patient_id": args.patient_id}
+    async with httpx.AsyncClient(base_url=api_url, timeout=args.timeout) as client:
+        startup = PhaseResult("startup")
+        startup.wall_time = await wait_until_ready(client, process)
+        startup.latencies.append(startup.wall_time)
+        phases = [startup]
+
+        phases.append(await run_concurrently(
+            "upload-image", args.uploads, args.concurrency,
+            lambda i: client.post("/upload-image", params=params,
+                                  files={"file": (f"doc-{i}.png", image_bytes, "image/png")},
+                                  data={"doc_type": DOC_TYPES[i % len(DOC_TYPES)]})))
+        phases.append(await wait_for_background(client, "process_image", "background-processing", args.timeout))
+
+        phases.append(await run_concurrently(
+            "trigger-report-generation", args.reports, args.concurrency,
+            lambda i: client.get("/trigger-report-generation", params=params)))
+        phases.append(await wait_for_background(client, "generate_report", "report-generation", args.timeout))
+
+        phases.append(await run_concurrently(
+            "chat", args.chats, args.concurrency,
+            lambda i: client.post("/chat", params=params,
+                                  json={"userText": "What medication is the patient taking?"})))
+        return phases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uploads", type=int, default=20)
+    parser.add_argument("--reports", type=int, default=3)
+    parser.add_argument("--chats", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--patient-id", default="bench-patient")
+    parser.add_argument("--image", default=str(BACKEND_DIR / "test.png"))
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--openai-latency", default="0.3:0.9",
+                        help="median:p95[:error_rate] in seconds for the OpenAI fake")
+    parser.add_argument("--vision-latency", default="0.2:0.5")
+    parser.add_argument("--storage-latency", default="0.05:0.15")
+    parser.add_argument("--db-latency", default="0.02:0.06")
+    parser.add_argument("--storage", choices=("supabase", "local"), default="supabase",
+                        help="STORAGE_BACKEND for the API")
+    parser.add_argument("--llm-cache-mode", default="off",
+                        help="LLM_CACHE_MODE for the API; the cache file is private to the run")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    openai_fake = ServerThread(create_openai_app(LatencyProfile.parse(args.openai_latency, args.seed))).start()
+    vision_fake = ServerThread(create_vision_app(LatencyProfile.parse(args.vision_latency, args.seed + 1))).start()
+    fakes = [openai_fake, vision_fake]
+    if args.storage == "supabase":
+        supabase_fake = ServerThread(create_supabase_app(
+            LatencyProfile.parse(args.storage_latency, args.seed + 2),
+            LatencyProfile.parse(args.db_latency, args.seed + 3))).start()
+        fakes.append(supabase_fake)
+
+    api_port = free_port()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{openai_fake.url}/v1",
+        "GOOGLE_VISION_ENDPOINT": vision_fake.url,
+        "PRODUCTION": "0",
+        "NO_PROXY": "127.0.0.1,localhost",
+        "LLM_CACHE_MODE": args.llm_cache_mode,
+        "LLM_CACHE_PATH": str(Path(tempfile.mkdtemp(prefix="bench-llm-cache-")) / "llm_cache.sqlite3"),
+    }
+    env.pop("OPENAI_API_BASE", None)
+    if args.storage == "local":
+        storage_path = Path(tempfile.mkdtemp(prefix="bench-storage-"))
+        env.update({"STORAGE_BACKEND": "local", "LOCAL_STORAGE_PATH": str(storage_path),
+                    "LOCAL_STORAGE_URL": f"http://127.0.0.1:{api_port}/files"})
+    else:
+        env.update({"STORAGE_BACKEND": "supabase", "SUPABASE_URL": supabase_fake.url,
+                    "SUPABASE_KEY": "benchmark-key"})
+
+    process = start_api(api_port, env)
+    try:
+        phases = asyncio.run(drive(args, f"http://127.0.0.1:{api_port}", process))
+        api_peak_rss = peak_rss_mb(process.pid)
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+        for fake in fakes:
+            fake.stop()
+
+    if args.storage == "local":
+        with sqlite3.connect(storage_path / "storage.sqlite3") as db:
+            stored = {table: db.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+                      for table in ("grandma_files", "grandma_reports")}
+    else:
+        stored = {table: len(supabase_fake.app.state.db.rows(table)) for table in ("grandma_files", "grandma_reports")}
+
+    results = {
+        "phases": [phase.summary() for phase in phases],
+        "api_peak_rss_mb": api_peak_rss,
+        "harness_peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "fake_requests": {"openai": openai_fake.app.state.requests,
+                          "vision": vision_fake.app.state.requests},
+        "documents_stored": stored["grandma_files"],
+        "reports_stored": stored["grandma_reports"],
+    }
+
+    def fmt(value):
+        return "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
+
+    print(f"{'phase':<28}{'requests':>9}{'errors':>8}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for phase in results["phases"]:
+        print(f"{phase['phase']:<28}{phase['requests']:>9}{phase['errors']:>8}{fmt(phase['throughput_rps']):>9}"
+              f"{fmt(phase['p50_s']):>9}{fmt(phase['p95_s']):>9}{fmt(phase['p99_s']):>9}{fmt(phase['max_s']):>9}")
+    print(f"API peak RSS: {fmt(results['api_peak_rss_mb'])} MB, "
+          f"documents stored: {results['documents_stored']}, reports stored: {results['reports_stored']}, "
+          f"fake OpenAI calls: {results['fake_requests']['openai']}")
+
+    if args.json:
+        Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
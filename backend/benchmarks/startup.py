@@ -0,0 +1,112 @@
+"""
+Startup benchmark for the backend.
+
+Reports how long importing the app takes, broken down per backend module (from
+`python -X importtime`), and the time until the API answers its first request when
+started with uvicorn against the local fakes of benchmarks/fakes.py:
+
+    cd backend
+    python -m benchmarks.startup
+"""
+
+import argparse
+import asyncio
+import os
+import re
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.fakes import (
+    LatencyProfile,
+    ServerThread,
+    create_openai_app,
+    create_supabase_app,
+    create_vision_app,
+    free_port,
+)
+from benchmarks.run_benchmark import BACKEND_DIR, start_api
+
+BACKEND_MODULES = re.compile(r"^(main|routers(\..+)?|utils(\..+)?|database(\..+)?)$")
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)$")
+
+
+def import_times(env: dict) -> list[tuple[str, float, float]]:
+    """(module, self seconds, cumulative seconds) of every backend module imported by `import main`."""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True).stderr
+    modules = []
+    for line in output.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and BACKEND_MODULES.match(match.group(4)):
+            modules.append((match.group(4), int(match.group(1)) / 1e6, int(match.group(2)) / 1e6))
+    return sorted(modules, key=lambda module: module[2], reverse=True)
+
+
+async def time_to_first_requests(api_url: str, process: subprocess.Popen, start: float,
+                                 patient_id: str, timeout: float = 60) -> dict:
+    timings = {}
+    async with httpx.AsyncClient(base_url=api_url, timeout=timeout) as client:
+        while time.perf_counter() - start < timeout:
+            if process.poll() is not None:
+                raise RuntimeError(f"API process exited with code {process.returncode}")
+            try:
+                if (await client.get("/metrics")).status_code == 200:
+                    break
+            except httpx.TransportError:
+                await asyncio.sleep(0.01)
+        timings["first /metrics"] = time.perf_counter() - start
+        await client.get("/get-report", params={"patient_id": patient_id})
+        timings["first /get-report"] = time.perf_counter() - start
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--patient-id", default="bench-patient")
+    parser.add_argument("--top", type=int, default=15, help="number of modules to list")
+    args = parser.parse_args()
+
+    openai_fake = ServerThread(create_openai_app(LatencyProfile.parse("0.01:0.02"))).start()
+    vision_fake = ServerThread(create_vision_app(LatencyProfile.parse("0.01:0.02"))).start()
+    supabase_fake = ServerThread(create_supabase_app(
+        LatencyProfile.parse("0.01:0.02"), LatencyProfile.parse("0.01:0.02"))).start()
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "sk-benchmark",
+        "OPENAI_BASE_URL": f"{openai_fake.url}/v1",
+        "SUPABASE_URL": supabase_fake.url,
+        "SUPABASE_KEY": "benchmark-key",
+        "GOOGLE_VISION_ENDPOINT": vision_fake.url,
+        "PRODUCTION": "0",
+        "NO_PROXY": "127.0.0.1,localhost",
+        "LLM_CACHE_MODE": "off",
+    }
+
+    try:
+        modules = import_times(env)
+        api_port = free_port()
+        start = time.perf_counter()
+        process = start_api(api_port, env)
+        try:
+            timings = asyncio.run(time_to_first_requests(
+                f"http://127.0.0.1:{api_port}", process, start, args.patient_id))
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+    finally:
+        for fake in (openai_fake, vision_fake, supabase_fake):
+            fake.stop()
+
+    print(f"{'module':<40}{'self_s':>9}{'cumulative_s':>14}")
+    for name, self_time, cumulative in modules[:args.top]:
+        print(f"{name:<40}{self_time:>9.3f}{cumulative:>14.3f}")
+    for name, seconds in timings.items():
+        print(f"time to {name}: {seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+"""
+Embedded storage backend (STORAGE_BACKEND=local): SQLite plus a content-addressed file store.
+
+All data lives under LOCAL_STORAGE_PATH (default backend/.cache/local_storage):
+
+    storage.sqlite3       grandma_files, grandma_reports and grandma_lab_values with the
+                          indexes of database/migrations, plus storage_objects, which maps
+                          object paths to blobs. WAL mode, so readers (several worker
+                          processes included) never wait for the writer.
+    objects/ab/abcd...    object contents, named by their SHA-256. Uploading the same bytes
+                          twice stores them once; a blob is deleted with its last path.
+
+Objects are served by GET /files/{path} (routers/files.py) under LOCAL_STORAGE_URL
+(default http://localhost:8000/files), which is what preview_url and the derivative URLs
+point at. Metadata reads are single indexed queries on a local file, well under a
+millisecond for a patient's documents.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+from database.storage import FILE_COLUMNS, REPORT_COMPLETE, REPORT_FAILED, StorageBackend
+from utils.metrics import timed
+
+DEFAULT_STORAGE_PATH = Path(__file__).resolve().parent.parent / ".cache" / "local_storage"
+DEFAULT_STORAGE_URL = "http://localhost:8000/files"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS grandma_files (
+    id            TEXT PRIMARY KEY,
+    tenant_id     TEXT NOT NULL DEFAULT 'default',
+    patient_id    TEXT NOT NULL DEFAULT 'grandma',
+    file_name     TEXT,
+    file_path     TEXT,
+    file_type     TEXT,
+    file_size     INTEGER,
+    upload_date   TEXT,
+    preview_url   TEXT,
+    text          TEXT,
+    keypoints     TEXT,
+    doc_type      TEXT,
+    minhash       TEXT,
+    clarity_score REAL,
+    thumbnail_url TEXT,
+    screen_url    TEXT
+);
+CREATE INDEX IF NOT EXISTS grandma_files_patient_upload_date_idx
+    ON grandma_files (tenant_id, patient_id, upload_date);
+
+CREATE TABLE IF NOT EXISTS grandma_reports (
+    id         TEXT PRIMARY KEY,
+    tenant_id  TEXT NOT NULL DEFAULT 'default',
+    patient_id TEXT NOT NULL DEFAULT 'grandma',
+    text       TEXT,
+    created_at TEXT NOT NULL,
+    status     TEXT NOT NULL DEFAULT 'complete'
+);
+CREATE INDEX IF NOT EXISTS grandma_reports_patient_created_at_idx
+    ON grandma_reports (tenant_id, patient_id, created_at DESC);
+
+CREATE TABLE IF NOT EXISTS grandma_lab_values (
+    id             TEXT PRIMARY KEY,
+    tenant_id      TEXT NOT NULL DEFAULT 'default',
+    patient_id     TEXT NOT NULL DEFAULT 'grandma',
+    file_id        TEXT NOT NULL REFERENCES grandma_files (id) ON DELETE CASCADE,
+    analyte        TEXT NOT NULL,
+    value          REAL NOT NULL,
+    unit           TEXT NOT NULL DEFAULT '',
+    reference_low  REAL,
+    reference_high REAL,
+    collected_on   TEXT NOT NULL,
+    created_at     TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS grandma_lab_values_patient_idx
+    ON grandma_lab_values (tenant_id, patient_id, file_id);
+
+CREATE TABLE IF NOT EXISTS storage_objects (
+    path          TEXT PRIMARY KEY,
+    sha256        TEXT NOT NULL,
+    content_type  TEXT,
+    cache_control TEXT,
+    size          INTEGER NOT NULL,
+    created_at    TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS storage_objects_sha256_idx ON storage_objects (sha256);
+"""
+
+# Stored as JSON text, returned as lists like the jsonb/array columns in Supabase
+JSON_COLUMNS = ("keypoints", "minhash")
+
+
+def _encode(column: str, value):
+    return json.dumps(value) if column in JSON_COLUMNS and value is not None else value
+
+
+def _decode(row: sqlite3.Row) -> dict:
+    return {column: json.loads(row[column]) if column in JSON_COLUMNS and row[column] is not None else row[column]
+            for column in row.keys()}
+
+
+def _check_columns(columns) -> list[str]:
+    columns = list(columns)
+    unknown = [column for column in columns if column not in FILE_COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown grandma_files columns: {', '.join(unknown)}")
+    return columns
+
+
+class LocalStorage(StorageBackend):
+    name = "local"
+    remote = False
+
+    def __init__(self, root: Optional[str] = None, public_url: Optional[str] = None):
+        self.root = Path(root or os.getenv("LOCAL_STORAGE_PATH") or DEFAULT_STORAGE_PATH)
+        self.public_url = (public_url or os.getenv("LOCAL_STORAGE_URL", DEFAULT_STORAGE_URL)).rstrip("/")
+        self.objects_dir = self.root / "objects"
+        self.objects_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # A blob is not collected while another path is being pointed at it
+        self._objects_lock = threading.Lock()
+        self._conn = sqlite3.connect(self.root / "storage.sqlite3", check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA foreign_keys=ON")
+        # Other worker processes may hold the write lock for a moment
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(SCHEMA)
+
+    def _transaction(self, statements: list[tuple[str, tuple]]):
+        """Runs the statements atomically."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for sql, params in statements:
+                    self._conn.execute(sql, params)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _query(self, sql: str, params: tuple) -> list[sqlite3.Row]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # Objects
+
+    def _blob_path(self, sha256: str) -> Path:
+        return self.objects_dir / sha256[:2] / sha256
+
+    def put_object(self, path: str, data: bytes, content_type: str,
+                   cache_control: Optional[str] = None) -> str:
+        sha256 = hashlib.sha256(data).hexdigest()
+        blob = self._blob_path(sha256)
+        with timed("local.storage_upload", provider="local"), self._objects_lock:
+            if not blob.exists():
+                blob.parent.mkdir(exist_ok=True)
+                # Written under a temporary name and renamed, so a blob is never seen half written
+                temporary = blob.with_name(f"{sha256}.{uuid.uuid4().hex}.tmp")
+                temporary.write_bytes(data)
+                os.replace(temporary, blob)
+            replaced = self._query("SELECT sha256 FROM storage_objects WHERE path = ?", (path,))
+            self._transaction([(
+                "INSERT INTO storage_objects (path, sha256, content_type, cache_control, size, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (path) DO UPDATE SET sha256 = excluded.sha256, "
+                "content_type = excluded.content_type, cache_control = excluded.cache_control, "
+                "size = excluded.size, created_at = excluded.created_at",
+                (path, sha256, content_type, cache_control, len(data), datetime.now(timezone.utc).isoformat()))])
+            if replaced and replaced[0]["sha256"] != sha256:
+                self._collect(replaced[0]["sha256"])
+        return f"{self.public_url}/{quote(path)}"
+
+    def remove_object(self, path: str):
+        with timed("local.storage_remove", provider="local"), self._objects_lock:
+            removed = self._query("SELECT sha256 FROM storage_objects WHERE path = ?", (path,))
+            self._transaction([("DELETE FROM storage_objects WHERE path = ?", (path,))])
+            if removed:
+                self._collect(removed[0]["sha256"])
+
+    def _collect(self, sha256: str):
+        """Deletes the blob once no path refers to it any more."""
+        if not self._query("SELECT 1 FROM storage_objects WHERE sha256 = ? LIMIT 1", (sha256,)):
+            self._blob_path(sha256).unlink(missing_ok=True)
+
+    def object_file(self, path: str) -> Optional[tuple[str, str, Optional[str]]]:
+        rows = self._query("SELECT sha256, content_type, cache_control FROM storage_objects WHERE path = ?", (path,))
+        if not rows:
+            return None
+        return str(self._blob_path(rows[0]["sha256"])), rows[0]["content_type"], rows[0]["cache_control"]
+
+    # grandma_files
+
+    def _insert_statement(self, row: dict, upsert: bool) -> tuple[str, tuple]:
+        columns = ["id", "tenant_id", "patient_id"] + _check_columns(
+            column for column in row if column not in ("id", "tenant_id", "patient_id"))
+        sql = (f"INSERT INTO grandma_files ({', '.join(columns)}) "
+               f"VALUES ({', '.join('?' for _ in columns)})")
+        if upsert:
+            sql += " ON CONFLICT (id) DO UPDATE SET " + ", ".join(
+                f"{column} = excluded.{column}" for column in columns[1:])
+        return sql, tuple(_encode(column, row.get(column)) for column in columns)
+
+    def insert_file(self, row: dict):
+        with timed("local.insert", provider="local"):
+            self._transaction([self._insert_statement(row, upsert=False)])
+
+    def upsert_files(self, rows: list[dict]):
+        with timed("local.insert", provider="local"):
+            self._transaction([self._insert_statement(row, upsert=True) for row in rows])
+
+    def update_files(self, updates: list[dict]):
+        statements = []
+        for update in updates:
+            columns = _check_columns(column for column in update if column not in ("id", "tenant_id", "patient_id"))
+            if not columns:
+                continue
+            statements.append((
+                f"UPDATE grandma_files SET {', '.join(f'{column} = ?' for column in columns)} "
+                "WHERE tenant_id = ? AND patient_id = ? AND id = ?",
+                tuple(_encode(column, update[column]) for column in columns)
+                + (update["tenant_id"], update["patient_id"], update["id"])))
+        with timed("local.update", provider="local"):
+            self._transaction(statements)
+
+    def select_files(self, tenant_id: str, patient_id: str, columns: tuple,
+                     keypoint: Optional[dict] = None, stage: str = "select_files") -> list[dict]:
+        sql = (f"SELECT {', '.join(['id'] + _check_columns(c for c in columns if c != 'id'))} FROM grandma_files "
+               "WHERE tenant_id = ? AND patient_id = ?")
+        params = (tenant_id, patient_id)
+        if keypoint:
+            # keypoints @> '[{...}]': some keypoint has all of the given fields
+            sql += " AND EXISTS (SELECT 1 FROM json_each(grandma_files.keypoints) AS k WHERE " + " AND ".join(
+                "json_extract(k.value, ?) = ?" for _ in keypoint) + ")"
+            for field, wanted in keypoint.items():
+                params += (f"$.{field}", wanted)
+        with timed(f"local.{stage}", provider="local"):
+            rows = self._query(sql + " ORDER BY upload_date", params)
+        return [{column: value for column, value in _decode(row).items() if column in columns} for row in rows]
+
+    # grandma_lab_values
+
+    def replace_lab_values(self, tenant_id: str, patient_id: str, file_id: str, rows: list[dict]):
+        created_at = datetime.now(timezone.utc).isoformat()
+        statements = [("DELETE FROM grandma_lab_values WHERE tenant_id = ? AND patient_id = ? AND file_id = ?",
+                       (tenant_id, patient_id, file_id))]
+        for row in rows:
+            statements.append((
+                "INSERT INTO grandma_lab_values (id, tenant_id, patient_id, file_id, analyte, value, unit, "
+                "reference_low, reference_high, collected_on, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(uuid.uuid4()), row["tenant_id"], row["patient_id"], row["file_id"], row["analyte"],
+                 row["value"], row["unit"], row["reference_low"], row["reference_high"], row["collected_on"],
+                 created_at)))
+        with timed("local.replace_lab_values", provider="local"):
+            self._transaction(statements)
+
+    def select_lab_values(self, tenant_id: str, patient_id: str, columns: tuple) -> list[dict]:
+        allowed = ("file_id", "analyte", "value", "unit", "reference_low", "reference_high", "collected_on")
+        with timed("local.select_lab_values", provider="local"):
+            rows = self._query(
+                f"SELECT {', '.join(column for column in columns if column in allowed)} FROM grandma_lab_values "
+                "WHERE tenant_id = ? AND patient_id = ?", (tenant_id, patient_id))
+        return [dict(row) for row in rows]
+
+    # grandma_reports
+
+    def upsert_report(self, row: dict):
+        with timed("local.insert_report", provider="local"):
+            self._transaction([(
+                "INSERT INTO grandma_reports (id, tenant_id, patient_id, text, created_at, status) "
+                "VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO UPDATE SET tenant_id = excluded.tenant_id, "
+                "patient_id = excluded.patient_id, text = excluded.text, created_at = excluded.created_at, "
+                "status = excluded.status",
+                (row["id"], row["tenant_id"], row["patient_id"], row["text"], row["created_at"], row["status"]))])
+
+    def latest_report(self, tenant_id: str, patient_id: str, include_partial: bool) -> Optional[dict]:
+        condition, status = ("status != ?", REPORT_FAILED) if include_partial else ("status = ?", REPORT_COMPLETE)
+        with timed("local.select_report", provider="local"):
+            rows = self._query(
+                "SELECT id, text, created_at, status FROM grandma_reports WHERE tenant_id = ? AND patient_id = ? "
+                f"AND {condition} ORDER BY created_at DESC LIMIT 1", (tenant_id, patient_id, status))
+        return dict(rows[0]) if rows else None
@@ -0,0 +1,21 @@
+-- Adds a tenant/patient dimension to grandma_files and grandma_reports so that
+-- every backend query is scoped to a single patient and served from an index.
+-- Existing rows are assigned to the default tenant/patient used by the backend
+-- (DEFAULT_TENANT_ID / DEFAULT_PATIENT_ID, "default" / "grandma").
+
+ALTER TABLE grandma_files
+    ADD COLUMN IF NOT EXISTS tenant_id  text NOT NULL DEFAULT 'default',
+    ADD COLUMN IF NOT EXISTS patient_id text NOT NULL DEFAULT 'grandma';
+
+ALTER TABLE grandma_reports
+    ADD COLUMN IF NOT EXISTS tenant_id  text NOT NULL DEFAULT 'default',
+    ADD COLUMN IF NOT EXISTS patient_id text NOT NULL DEFAULT 'grandma';
+
+-- Document listing for report generation: WHERE tenant_id AND patient_id ORDER BY upload_date
+CREATE INDEX IF NOT EXISTS grandma_files_patient_upload_date_idx
+    ON grandma_files (tenant_id, patient_id, upload_date);
+
+-- Latest report lookup for /get-report, /chat and /session:
+-- WHERE tenant_id AND patient_id ORDER BY created_at DESC LIMIT 1
+CREATE INDEX IF NOT EXISTS grandma_reports_patient_created_at_idx
+    ON grandma_reports (tenant_id, patient_id, created_at DESC);
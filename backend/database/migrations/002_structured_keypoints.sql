@@ -0,0 +1,37 @@
+-- Stores grandma_files.keypoints as structured JSONB instead of a markdown bullet string:
+--   [{"key": "Medication", "value": "Ramipril 5 mg 1-0-0", "category": "medication"}, ...]
+-- Existing "- Key: Value" bullet lists are converted with category "other".
+
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'grandma_files' AND column_name = 'keypoints') = 'text' THEN
+
+        ALTER TABLE grandma_files ADD COLUMN keypoints_structured jsonb;
+
+        UPDATE grandma_files f
+        SET keypoints_structured = parsed.keypoints
+        FROM (
+            SELECT id,
+                   coalesce(jsonb_agg(jsonb_build_object(
+                                'key',      btrim(split_part(item, ':', 1)),
+                                'value',    btrim(substr(item, strpos(item, ':') + 1)),
+                                'category', 'other') ORDER BY ord)
+                            FILTER (WHERE strpos(item, ':') > 0), '[]'::jsonb) AS keypoints
+            FROM grandma_files,
+                 LATERAL regexp_split_to_table(keypoints, E'\n') WITH ORDINALITY AS lines(line, ord),
+                 LATERAL (SELECT btrim(regexp_replace(line, '^\s*-\s*', ''))) AS cleaned(item)
+            WHERE keypoints IS NOT NULL
+            GROUP BY id
+        ) parsed
+        WHERE f.id = parsed.id;
+
+        ALTER TABLE grandma_files DROP COLUMN keypoints;
+        ALTER TABLE grandma_files RENAME COLUMN keypoints_structured TO keypoints;
+    END IF;
+END $$;
+
+-- Containment filters such as keypoints @> '[{"category": "medication"}]'
+-- (find_files_by_keypoint / GET /keypoints)
+CREATE INDEX IF NOT EXISTS grandma_files_keypoints_idx
+    ON grandma_files USING gin (keypoints jsonb_path_ops);
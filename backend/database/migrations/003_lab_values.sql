@@ -0,0 +1,21 @@
+-- Numeric lab results extracted from Lab Report documents, one row per measurement.
+-- The backend loads a patient's rows into per-analyte NumPy columns (utils/lab_values.py)
+-- to serve the /labs/{analyte} trend endpoint.
+
+CREATE TABLE IF NOT EXISTS grandma_lab_values (
+    id             uuid PRIMARY KEY DEFAULT gen_random_uuid(),
+    tenant_id      text NOT NULL DEFAULT 'default',
+    patient_id     text NOT NULL DEFAULT 'grandma',
+    file_id        uuid NOT NULL REFERENCES grandma_files (id) ON DELETE CASCADE,
+    analyte        text NOT NULL,
+    value          double precision NOT NULL,
+    unit           text NOT NULL DEFAULT '',
+    reference_low  double precision,
+    reference_high double precision,
+    collected_on   date NOT NULL,
+    created_at     timestamptz NOT NULL DEFAULT now()
+);
+
+-- All values of a patient (column store load) and re-extraction of one document
+CREATE INDEX IF NOT EXISTS grandma_lab_values_patient_idx
+    ON grandma_lab_values (tenant_id, patient_id, file_id);
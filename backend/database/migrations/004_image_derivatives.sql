@@ -0,0 +1,6 @@
+-- URLs of the WebP derivatives rendered at ingest (utils/image_derivatives.py), stored in
+-- the uploads bucket next to the original. NULL for documents stored before derivatives
+-- existed or whose rendering failed; readers fall back to preview_url (the original).
+
+ALTER TABLE grandma_files ADD COLUMN IF NOT EXISTS thumbnail_url text;
+ALTER TABLE grandma_files ADD COLUMN IF NOT EXISTS screen_url text;
@@ -0,0 +1,7 @@
+-- Near-duplicate detection (utils/near_duplicates.py): the MinHash signature of each
+-- document's text, computed at ingest, and the clarity score from its acceptance check,
+-- used to keep the best of several uploads of the same document in the report.
+-- Rows stored before this migration keep NULL and are fingerprinted when a report is built.
+
+ALTER TABLE grandma_files ADD COLUMN IF NOT EXISTS minhash integer[];
+ALTER TABLE grandma_files ADD COLUMN IF NOT EXISTS clarity_score real;
@@ -0,0 +1,6 @@
+-- Streaming report generation: a report is saved as a 'partial' draft after each
+-- completed section and updated in place until it is 'complete' (or 'failed').
+-- /get-report shows the newest non-failed version; /chat, /session and the report.version
+-- event only use complete ones. Existing reports are complete.
+
+ALTER TABLE grandma_reports ADD COLUMN IF NOT EXISTS status text NOT NULL DEFAULT 'complete';
@@ -0,0 +1,33 @@
+-- Write-behind batching (database/write_behind.py): applies many partial grandma_files
+-- updates in one request. `updates` is a JSON array of objects with "id", "tenant_id",
+-- "patient_id" and the columns to change; columns missing from an object keep their
+-- value. Applying the same updates twice gives the same result, so the backend can
+-- replay its journal after a crash.
+
+CREATE OR REPLACE FUNCTION update_grandma_files(updates jsonb)
+RETURNS integer
+LANGUAGE sql
+AS $$
+    WITH changes AS (
+        SELECT value AS change FROM jsonb_array_elements(updates)
+    ), updated AS (
+        UPDATE grandma_files f SET
+            text          = CASE WHEN c.change ? 'text' THEN c.change->>'text' ELSE f.text END,
+            keypoints     = CASE WHEN c.change ? 'keypoints'
+                                 THEN NULLIF(c.change->'keypoints', 'null'::jsonb) ELSE f.keypoints END,
+            minhash       = CASE WHEN NOT c.change ? 'minhash' THEN f.minhash
+                                 WHEN jsonb_typeof(c.change->'minhash') = 'array'
+                                 THEN ARRAY(SELECT jsonb_array_elements_text(c.change->'minhash')::integer)
+                                 ELSE NULL END,
+            clarity_score = CASE WHEN c.change ? 'clarity_score'
+                                 THEN (c.change->>'clarity_score')::real ELSE f.clarity_score END,
+            thumbnail_url = CASE WHEN c.change ? 'thumbnail_url' THEN c.change->>'thumbnail_url' ELSE f.thumbnail_url END,
+            screen_url    = CASE WHEN c.change ? 'screen_url' THEN c.change->>'screen_url' ELSE f.screen_url END
+        FROM changes c
+        WHERE f.tenant_id = c.change->>'tenant_id'
+          AND f.patient_id = c.change->>'patient_id'
+          AND f.id::text = c.change->>'id'
+        RETURNING 1
+    )
+    SELECT count(*)::integer FROM updated;
+$$;
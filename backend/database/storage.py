@@ -0,0 +1,98 @@
+"""
+Storage backends behind database/supabase_client.py.
+
+The functions in supabase_client.py (save_to_supabase, update_file_data, the report and
+document queries, ...) implement the application's semantics once, on top of the few
+primitives below. STORAGE_BACKEND selects who stores the data:
+
+    supabase  hosted Supabase tables and the `uploads` bucket (default)
+    local     an embedded SQLite database in WAL mode and a content-addressed file store
+              on local disk (database/local_storage.py), for single-node deployments
+
+Rows are plain dicts with the columns of the Supabase tables; JSON columns (keypoints,
+minhash) hold lists, timestamps ISO 8601 strings.
+"""
+
+import os
+from abc import ABC, abstractmethod
+from typing import Optional
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")
+STORAGE_BACKENDS = ("supabase", "local")
+
+# Columns of grandma_files a write may set, besides id, tenant_id and patient_id
+FILE_COLUMNS = ("file_name", "file_path", "file_type", "file_size", "upload_date", "preview_url", "text",
+                "keypoints", "doc_type", "minhash", "clarity_score", "thumbnail_url", "screen_url")
+
+# grandma_reports.status: drafts are saved section by section while the report streams in
+REPORT_PARTIAL, REPORT_COMPLETE, REPORT_FAILED = "partial", "complete", "failed"
+
+
+class StorageBackend(ABC):
+    name = ""
+    # Whether each call is a network round trip: remote backends get write-behind
+    # batching and the report cache, the local one is fast enough without
+    remote = True
+
+    # Objects ("uploads" bucket)
+
+    @abstractmethod
+    def put_object(self, path: str, data: bytes, content_type: str,
+                   cache_control: Optional[str] = None) -> str:
+        """Stores (or replaces) the object at `path` and returns its public URL."""
+
+    @abstractmethod
+    def remove_object(self, path: str):
+        ...
+
+    def object_file(self, path: str) -> Optional[tuple[str, str, Optional[str]]]:
+        """(file on disk, content type, cache control) of an object served by /files, if any."""
+        return None
+
+    # grandma_files
+
+    @abstractmethod
+    def insert_file(self, row: dict):
+        """Inserts one complete row; raises if it cannot be inserted (e.g. the id exists)."""
+
+    @abstractmethod
+    def upsert_files(self, rows: list[dict]):
+        """Inserts complete rows, replacing rows with the same id."""
+
+    @abstractmethod
+    def update_files(self, updates: list[dict]):
+        """
+        Applies partial updates ({"id", "tenant_id", "patient_id", <columns>}); columns
+        missing from an update keep their value. Rows of other patients are never touched.
+        """
+
+    @abstractmethod
+    def select_files(self, tenant_id: str, patient_id: str, columns: tuple,
+                     keypoint: Optional[dict] = None, stage: str = "select_files") -> list[dict]:
+        """
+        The patient's rows, oldest upload first. With `keypoint`, only rows having a
+        keypoint that contains all of its fields.
+        """
+
+    # grandma_lab_values
+
+    @abstractmethod
+    def replace_lab_values(self, tenant_id: str, patient_id: str, file_id: str, rows: list[dict]):
+        """Deletes the values of the document and inserts `rows` in their place."""
+
+    @abstractmethod
+    def select_lab_values(self, tenant_id: str, patient_id: str, columns: tuple) -> list[dict]:
+        ...
+
+    # grandma_reports
+
+    @abstractmethod
+    def upsert_report(self, row: dict):
+        ...
+
+    @abstractmethod
+    def latest_report(self, tenant_id: str, patient_id: str, include_partial: bool) -> Optional[dict]:
+        """
+        The newest complete report ('id', 'text', 'created_at', 'status'), or with
+        include_partial the newest one that did not fail.
+        """
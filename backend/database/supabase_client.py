@@ -1,17 +1,49 @@
+import json
 import uuid
 import os
+from functools import lru_cache
 from starlette.datastructures import UploadFile
-from supabase import create_client, Client
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from datetime import datetime, timezone
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import dotenv
+from database.storage import (
+    REPORT_COMPLETE, REPORT_FAILED, REPORT_PARTIAL, STORAGE_BACKEND, STORAGE_BACKENDS, StorageBackend,
+)
+from database.write_behind import INSERT, JOURNAL_PATH, UPDATE, WRITE_BEHIND_ENABLED, FileWriteBuffer
+from database.write_behind import WAIT_SECONDS as WRITE_BEHIND_WAIT_SECONDS
+from utils.env import load_env
+from utils.metrics import timed
 
-dotenv.load_dotenv()
+if TYPE_CHECKING:
+    from supabase import Client
 
+# Every row in grandma_files / grandma_reports belongs to one patient of one tenant (clinic).
+# Requests that do not name a patient fall back to these, which is also what the
+# migration in database/migrations/001_patient_partitioning.sql assigns to existing rows.
+DEFAULT_TENANT_ID = os.environ.get("DEFAULT_TENANT_ID", "default")
+DEFAULT_PATIENT_ID = os.environ.get("DEFAULT_PATIENT_ID", "grandma")
 
-def get_supabase_client() -> Client:
-    """Initializes and returns a Supabase client using environment variables."""
+# Latest report per (tenant_id, patient_id). /chat and /session read the report on every
+# request, so it is cached per patient and invalidated whenever that patient gets a new
+# report. The TTL bounds staleness when another worker process saved the report. The
+# embedded storage backend answers these reads locally and is not cached.
+# Cached separately for readers of complete reports only and for /get-report, which also
+# shows the draft of a report that is still being generated.
+REPORT_CACHE_TTL_SECONDS = float(os.environ.get("REPORT_CACHE_TTL_SECONDS", "30"))
+_report_cache: dict[tuple[str, str, bool], tuple[float, Optional[dict]]] = {}
+
+
+@lru_cache(maxsize=1)
+def get_supabase_client() -> "Client":
+    """
+    Initializes and returns the process-wide Supabase client using environment variables.
+    The SDK is imported and the client built on first use rather than at import time.
+    """
+    from supabase import create_client
+
+    load_env()
     supabase_url = os.environ.get("SUPABASE_URL")
     supabase_key = os.environ.get("SUPABASE_KEY")
     if not supabase_url or not supabase_key:
@@ -24,118 +56,442 @@ def get_supabase_client() -> Client:
     return create_client(supabase_url, supabase_key)
 
 
-def save_to_supabase(
-    image_bytes: bytes,
-    image: UploadFile,
-    text: Optional[str],
-    keypoints: Optional[str],
-    doc_type: str,
-):
+class SupabaseStorage(StorageBackend):
+    """Hosted Supabase: PostgREST tables and the `uploads` storage bucket."""
+    name = "supabase"
+
+    def put_object(self, path: str, data: bytes, content_type: str,
+                   cache_control: Optional[str] = None) -> str:
+        supabase = get_supabase_client()
+        file_options = {"content-type": content_type, "x-upsert": "true"}
+        if cache_control:
+            file_options["cache-control"] = cache_control
+        with timed("supabase.storage_upload", provider="supabase"):
+            supabase.storage.from_("uploads").upload(path=path, file=data, file_options=file_options)
+        return supabase.storage.from_("uploads").get_public_url(path)
+
+    def remove_object(self, path: str):
+        supabase = get_supabase_client()
+        with timed("supabase.storage_remove", provider="supabase"):
+            supabase.storage.from_("uploads").remove([path])
+
+    def insert_file(self, row: dict):
+        supabase = get_supabase_client()
+        with timed("supabase.insert", provider="supabase"):
+            insert_response = supabase.table("grandma_files").insert(row).execute()
+        # Check if the insert was successful, often Supabase client might not raise an error
+        # but the response will indicate failure (e.g., empty data array or specific error structure)
+        if not insert_response.data and not (hasattr(insert_response, 'error') and insert_response.error is None):
+            # Attempt to get more specific error info if available
+            error_info = getattr(insert_response, 'error', 'Unknown error')
+            print(
+                f"Failed to insert metadata into database. Response: {insert_response}")
+            raise Exception(
+                f"Failed to insert metadata into database: {error_info}"
+            )
+
+    def upsert_files(self, rows: list[dict]):
+        supabase = get_supabase_client()
+        with timed("supabase.insert", provider="supabase"):
+            supabase.table("grandma_files").upsert(rows).execute()
+
+    def update_files(self, updates: list[dict]):
+        supabase = get_supabase_client()
+        with timed("supabase.update", provider="supabase"):
+            if len(updates) == 1:
+                # A single row does not need update_grandma_files (migration 007)
+                update = updates[0]
+                columns = {column: value for column, value in update.items()
+                           if column not in ("id", "tenant_id", "patient_id")}
+                supabase.table("grandma_files").update(columns).eq("tenant_id", update["tenant_id"]).eq(
+                    "patient_id", update["patient_id"]).eq("id", update["id"]).execute()
+            else:
+                supabase.rpc("update_grandma_files", {"updates": updates}).execute()
+
+    def select_files(self, tenant_id: str, patient_id: str, columns: tuple,
+                     keypoint: Optional[dict] = None, stage: str = "select_files") -> list[dict]:
+        supabase = get_supabase_client()
+        query = supabase.table("grandma_files").select(*columns).eq(
+            "tenant_id", tenant_id).eq("patient_id", patient_id)
+        if keypoint:
+            query = query.contains("keypoints", json.dumps([keypoint]))
+        with timed(f"supabase.{stage}", provider="supabase"):
+            response = query.order("upload_date").execute()
+        return response.data or []
+
+    def replace_lab_values(self, tenant_id: str, patient_id: str, file_id: str, rows: list[dict]):
+        supabase = get_supabase_client()
+        with timed("supabase.delete_lab_values", provider="supabase"):
+            supabase.table("grandma_lab_values").delete().eq("tenant_id", tenant_id).eq(
+                "patient_id", patient_id).eq("file_id", file_id).execute()
+        if rows:
+            with timed("supabase.insert_lab_values", provider="supabase"):
+                supabase.table("grandma_lab_values").insert(rows).execute()
+
+    def select_lab_values(self, tenant_id: str, patient_id: str, columns: tuple) -> list[dict]:
+        supabase = get_supabase_client()
+        with timed("supabase.select_lab_values", provider="supabase"):
+            response = supabase.table("grandma_lab_values").select(*columns).eq(
+                "tenant_id", tenant_id).eq("patient_id", patient_id).execute()
+        return response.data or []
+
+    def upsert_report(self, row: dict):
+        supabase = get_supabase_client()
+        with timed("supabase.insert_report", provider="supabase"):
+            supabase.table("grandma_reports").upsert(row).execute()
+
+    def latest_report(self, tenant_id: str, patient_id: str, include_partial: bool) -> Optional[dict]:
+        supabase = get_supabase_client()
+        with timed("supabase.select_report", provider="supabase"):
+            query = supabase.table("grandma_reports").select(
+                "id", "text", "created_at", "status").eq("tenant_id", tenant_id).eq("patient_id", patient_id)
+            if include_partial:
+                query = query.neq("status", REPORT_FAILED)
+            else:
+                query = query.eq("status", REPORT_COMPLETE)
+            response = query.order("created_at", desc=True).limit(1).execute()
+        return response.data[0] if response.data else None
+
+
+@lru_cache(maxsize=1)
+def get_storage() -> StorageBackend:
+    """The process-wide storage backend selected by STORAGE_BACKEND (database/storage.py)."""
+    if STORAGE_BACKEND not in STORAGE_BACKENDS:
+        raise EnvironmentError(
+            f"STORAGE_BACKEND must be one of {', '.join(STORAGE_BACKENDS)}, not {STORAGE_BACKEND!r}")
+    if STORAGE_BACKEND == "local":
+        from database.local_storage import LocalStorage
+        return LocalStorage()
+    return SupabaseStorage()
+
+
+@lru_cache(maxsize=1)
+def get_file_write_buffer() -> Optional[FileWriteBuffer]:
     """
-    Uploads the image to Supabase Storage and saves file metadata to the grandma_files table.
-    Handles cases where image_bytes and image might be None (e.g., "Not Available" document).
+    The process-wide write-behind buffer for grandma_files, None with WRITE_BEHIND=0 or
+    the embedded storage backend (whose writes are local anyway).
     """
-    supabase = get_supabase_client()
-    image_id = str(uuid.uuid4())
+    storage = get_storage()
+    if not WRITE_BEHIND_ENABLED or not storage.remote:
+        return None
+    return FileWriteBuffer(storage.upsert_files, storage.update_files)
+
 
-    file_path = f"{image_id}_{image.filename}"
+def _write_file_row(kind: str, image_id: str, columns: dict, patient_id: str, tenant_id: str,
+                    wait: bool = False):
+    """
+    Writes (or buffers) one grandma_files row. With `wait`, a buffered write is waited for
+    and raises if the database rejects it or it is not written within WRITE_BEHIND_WAIT_SECONDS.
+    """
+    buffer = get_file_write_buffer()
+    if buffer is not None:
+        waiter = buffer.write(kind, image_id, columns, tenant_id=tenant_id, patient_id=patient_id, wait=wait)
+        if waiter is not None:
+            try:
+                waiter.result(timeout=WRITE_BEHIND_WAIT_SECONDS)
+            except FutureTimeoutError:
+                raise Exception(f"grandma_files row {image_id} was not written within {WRITE_BEHIND_WAIT_SECONDS:.0f}s; "
+                                "it stays journaled and is retried")
+        return
+    row = {"id": image_id, "tenant_id": tenant_id, "patient_id": patient_id, **columns}
+    if kind == INSERT:
+        get_storage().insert_file(row)
+    else:
+        get_storage().update_files([row])
+
+
+def flush_file_writes(patient_id: Optional[str] = None, tenant_id: Optional[str] = None,
+                      image_id: Optional[str] = None):
+    """
+    Writes the buffered grandma_files changes of the patient (or row) before it is read,
+    so readers see their own writes. A failed flush is logged; the changes stay buffered.
+    """
+    if not get_file_write_buffer.cache_info().currsize or get_file_write_buffer() is None:
+        return
     try:
-        supabase.storage.from_("uploads").upload(
-            path=file_path,
-            file=image_bytes,
-            file_options={
-                "content-type": image.content_type,
-                "x-upsert": "true",
-            },
-        )
+        get_file_write_buffer().flush(tenant_id=tenant_id, patient_id=patient_id, image_id=image_id)
     except Exception as e:
-        raise Exception(f"Failed to upload image to Supabase: {str(e)}")
+        print(f"Could not flush buffered grandma_files writes: {str(e)}")
 
-    preview_url = supabase.storage.from_(
-        "uploads").get_public_url(file_path)
-    file_name = image.filename
-    file_type = image.content_type
-    # Use getattr for size for compatibility with our MinimalUploadFileEmulator and real UploadFile
-    file_size = getattr(image, "size", len(
-        image_bytes) if image_bytes else 0)
 
-    # ---------- 3. insert a row either way ----------
+def replay_file_writes():
+    """Starts the write-behind buffer at startup if a journal of unflushed writes was left behind."""
+    if WRITE_BEHIND_ENABLED and os.path.exists(JOURNAL_PATH) and os.path.getsize(JOURNAL_PATH):
+        get_file_write_buffer()
+
+
+def shutdown_file_writes():
+    """Writes everything still buffered; what cannot be written stays in the journal."""
+    if get_file_write_buffer.cache_info().currsize and get_file_write_buffer() is not None:
+        get_file_write_buffer().close()
+        get_file_write_buffer.cache_clear()
+
+
+def upload_file_to_storage(
+    image_id: str,
+    image_bytes: bytes,
+    file_name: str,
+    content_type: str,
+    patient_id: str = DEFAULT_PATIENT_ID,
+    tenant_id: str = DEFAULT_TENANT_ID,
+) -> dict:
+    """
+    Uploads the image to the `uploads` bucket (or the local file store) under a
+    per-patient prefix.
+
+    Returns:
+        dict: 'file_path' of the stored object and its public 'preview_url'.
+    """
+    file_path = f"{tenant_id}/{patient_id}/{image_id}_{file_name}"
+    try:
+        preview_url = get_storage().put_object(file_path, image_bytes, content_type)
+    except Exception as e:
+        raise Exception(f"Failed to upload image to {get_storage().name}: {str(e)}")
+
+    return {"file_path": file_path, "preview_url": preview_url}
+
+
+def upload_derivatives(
+    image_id: str,
+    file_name: str,
+    derivatives: dict[str, bytes],
+    content_type: str,
+    patient_id: str = DEFAULT_PATIENT_ID,
+    tenant_id: str = DEFAULT_TENANT_ID,
+) -> dict[str, str]:
+    """
+    Stores the derivatives of an upload (utils/image_derivatives.py) next to the original,
+    e.g. {tenant}/{patient}/{image_id}_scan.thumbnail.webp.
+
+    Returns:
+        dict: public URL per derivative tier.
+    """
+    stem = os.path.splitext(file_name or "upload")[0]
+    urls = {}
+    for tier, data in derivatives.items():
+        file_path = f"{tenant_id}/{patient_id}/{image_id}_{stem}.{tier}.webp"
+        # Derivatives are never rewritten under the same path
+        urls[tier] = get_storage().put_object(file_path, data, content_type, cache_control="31536000")
+    return urls
+
+
+def update_file_previews(image_id: str, thumbnail_url: Optional[str], screen_url: Optional[str],
+                         patient_id: str = DEFAULT_PATIENT_ID, tenant_id: str = DEFAULT_TENANT_ID):
+    """Records the derivative URLs of a stored file in grandma_files."""
+    _write_file_row(UPDATE, image_id, {
+        "thumbnail_url": thumbnail_url,
+        "screen_url": screen_url,
+    }, patient_id=patient_id, tenant_id=tenant_id)
+
+
+def remove_file_from_storage(file_path: str):
+    """Deletes an uploaded object, e.g. one uploaded speculatively for a rejected document."""
+    get_storage().remove_object(file_path)
+
+
+def insert_file_record(
+    image_id: str,
+    stored_file: dict,
+    file_name: str,
+    file_type: str,
+    file_size: int,
+    text: Optional[str],
+    keypoints: Optional[list],
+    doc_type: str,
+    patient_id: str = DEFAULT_PATIENT_ID,
+    tenant_id: str = DEFAULT_TENANT_ID,
+):
+    """
+    Saves the metadata of a stored file (as returned by upload_file_to_storage)
+    to the grandma_files table, tagged with the patient. With write-behind the row is
+    journaled and this waits for the flush that inserts it; raises if the row is rejected.
+    """
     data = {
-        "id":            image_id,
         "file_name":     file_name,
-        "file_path":     file_path,
+        "file_path":     stored_file["file_path"],
         "file_type":     file_type,
         "file_size":     file_size,
         "upload_date":   datetime.now(timezone.utc).isoformat(),
-        "preview_url":   preview_url,
+        "preview_url":   stored_file["preview_url"],
         "text":          text,
         "keypoints":     keypoints,
         "doc_type":      doc_type,
     }
 
-    insert_response = supabase.table("grandma_files").insert(data).execute()
-
-    # Check if the insert was successful, often Supabase client might not raise an error
-    # but the response will indicate failure (e.g., empty data array or specific error structure)
-    if not insert_response.data and not (hasattr(insert_response, 'error') and insert_response.error is None):
-        # Attempt to get more specific error info if available
-        error_info = getattr(insert_response, 'error', 'Unknown error')
-        print(
-            f"Failed to insert metadata into database. Response: {insert_response}")
-        raise Exception(
-            f"Failed to insert metadata into database: {error_info}"
-        )
+    _write_file_row(INSERT, image_id, data, patient_id=patient_id, tenant_id=tenant_id, wait=True)
 
-    return {"image_id": image_id, "preview_url": preview_url}
+    return {"image_id": image_id, "preview_url": stored_file["preview_url"]}
 
 
-def update_file_data(image_id: str, text: str, keypoints: list):
+def save_to_supabase(
+    image_bytes: bytes,
+    image: UploadFile,
+    text: Optional[str],
+    keypoints: Optional[list],
+    doc_type: str,
+    patient_id: str = DEFAULT_PATIENT_ID,
+    tenant_id: str = DEFAULT_TENANT_ID,
+):
+    """
+    Uploads the image to storage and saves file metadata to the grandma_files table.
+    Handles cases where image_bytes and image might be None (e.g., "Not Available" document).
+    The object is stored under a per-patient prefix and the row is tagged with the patient.
+    """
+    image_id = str(uuid.uuid4())
+    stored_file = upload_file_to_storage(
+        image_id, image_bytes, image.filename, image.content_type,
+        patient_id=patient_id, tenant_id=tenant_id)
+    # Use getattr for size for compatibility with our MinimalUploadFileEmulator and real UploadFile
+    file_size = getattr(image, "size", len(
+        image_bytes) if image_bytes else 0)
+    return insert_file_record(
+        image_id, stored_file, image.filename, image.content_type, file_size,
+        text, keypoints, doc_type, patient_id=patient_id, tenant_id=tenant_id)
+
+
+def update_file_data(image_id: str, text: str, keypoints: list,
+                     minhash: Optional[list] = None, clarity_score: Optional[float] = None,
+                     patient_id: str = DEFAULT_PATIENT_ID, tenant_id: str = DEFAULT_TENANT_ID):
     """
-    Updates the file data in the database.
+    Updates the file data in the database. `keypoints` is the list of structured
+    {"key", "value", "category"} records stored in the JSONB keypoints column;
+    `minhash` is the text's near-duplicate fingerprint (utils/near_duplicates.py).
+    The update is scoped to the patient so a job can never overwrite another patient's row.
     """
-    supabase = get_supabase_client()
-    supabase.table("grandma_files").update({
+    _write_file_row(UPDATE, image_id, {
         "text": text,
-        "keypoints": keypoints
-    }).eq("id", image_id).execute()
+        "keypoints": keypoints,
+        "minhash": minhash,
+        "clarity_score": clarity_score,
+    }, patient_id=patient_id, tenant_id=tenant_id)
 
     return {"success": True}
 
 
-def get_all_image_data_for_reprocessing() -> str:
+def find_files_by_keypoint(
+    category: Optional[str] = None,
+    key: Optional[str] = None,
+    value: Optional[str] = None,
+    patient_id: str = DEFAULT_PATIENT_ID,
+    tenant_id: str = DEFAULT_TENANT_ID,
+) -> list[dict]:
+    """
+    Returns the patient's documents having a keypoint that matches all of the given fields
+    (e.g. category="medication"), oldest first. The filter is a JSONB containment query
+    (keypoints @> '[{...}]') served by the GIN index on grandma_files.keypoints (with the
+    embedded backend, a json_each() scan of the patient's rows).
+    """
+    needle = {field: wanted for field, wanted in
+              (("category", category), ("key", key), ("value", value)) if wanted is not None}
+    flush_file_writes(patient_id=patient_id, tenant_id=tenant_id)
+    return get_storage().select_files(
+        tenant_id, patient_id, ("id", "file_name", "doc_type", "upload_date", "keypoints"),
+        keypoint=needle or None, stage="select_keypoints")
+
+
+def get_patient_keypoints(
+    category: Optional[str] = None,
+    key: Optional[str] = None,
+    patient_id: str = DEFAULT_PATIENT_ID,
+    tenant_id: str = DEFAULT_TENANT_ID,
+) -> list[dict]:
     """
-    Fetches all records from the grandma_files table and downloads the associated image bytes.
+    Aggregates the patient's keypoints across documents, e.g. every medication with the
+    documents mentioning it. Keys are compared case-insensitively.
 
     Returns:
-        A string containing all the text from the documents.
+        list[dict]: One entry per distinct (key, value) with 'category', 'count' and
+        'documents' (id, file_name, doc_type, upload_date), most recently seen first.
+    """
+    aggregated: dict[tuple[str, str], dict] = {}
+    for row in find_files_by_keypoint(category=category, patient_id=patient_id, tenant_id=tenant_id):
+        for keypoint in row.get("keypoints") or []:
+            if not isinstance(keypoint, dict):
+                continue
+            if category is not None and keypoint.get("category") != category:
+                continue
+            if key is not None and keypoint.get("key", "").lower() != key.lower():
+                continue
+            group = aggregated.setdefault(
+                (keypoint.get("key", "").lower(), keypoint.get("value", "").strip()),
+                {"key": keypoint.get("key"), "value": keypoint.get("value"),
+                 "category": keypoint.get("category"), "count": 0, "documents": []})
+            group["count"] += 1
+            group["documents"].append({column: row.get(column) for column in
+                                       ("id", "file_name", "doc_type", "upload_date")})
+    return sorted(aggregated.values(),
+                  key=lambda group: group["documents"][-1]["upload_date"] or "", reverse=True)
+
+
+def replace_lab_values(file_id: str, values: list[dict], default_date: str,
+                       patient_id: str = DEFAULT_PATIENT_ID, tenant_id: str = DEFAULT_TENANT_ID):
+    """
+    Stores the lab values extracted from one document in grandma_lab_values, replacing
+    the values of an earlier extraction of the same document. Values without a date
+    get `default_date` (YYYY-MM-DD).
     """
-    supabase = get_supabase_client()
+    # The values reference the document's row, which may still be buffered
+    flush_file_writes(patient_id=patient_id, tenant_id=tenant_id, image_id=file_id)
+    rows = [{
+        "tenant_id":      tenant_id,
+        "patient_id":     patient_id,
+        "file_id":        file_id,
+        "analyte":        value["analyte"],
+        "value":          value["value"],
+        "unit":           value.get("unit") or "",
+        "reference_low":  value.get("reference_low"),
+        "reference_high": value.get("reference_high"),
+        "collected_on":   value.get("collected_on") or default_date,
+    } for value in values]
+    get_storage().replace_lab_values(tenant_id, patient_id, file_id, rows)
+
+
+def get_lab_value_rows(patient_id: str = DEFAULT_PATIENT_ID,
+                       tenant_id: str = DEFAULT_TENANT_ID) -> list[dict]:
+    """Fetches all lab values of the patient (served by the (tenant_id, patient_id) index)."""
+    return get_storage().select_lab_values(tenant_id, patient_id, (
+        "file_id", "analyte", "value", "unit", "reference_low", "reference_high", "collected_on"))
+
+
+def get_all_image_data_for_reprocessing(patient_id: str = DEFAULT_PATIENT_ID,
+                                        tenant_id: str = DEFAULT_TENANT_ID) -> str:
+    """
+    Fetches the patient's records from the grandma_files table (served by the
+    (tenant_id, patient_id, upload_date) index) and joins their texts for the report.
+    Of several uploads of the same document only the best copy is included.
+
+    Returns:
+        A string containing all the text from the patient's documents.
+    """
+    flush_file_writes(patient_id=patient_id, tenant_id=tenant_id)
     processed_documents = []
 
     try:
-        # Fetch all records from the 'grandma_files' table
-        response = supabase.table("grandma_files").select(
-            "doc_type", "text", "preview_url", "file_name").execute()
+        # Fetch only this patient's records from the 'grandma_files' table
+        rows = get_storage().select_files(tenant_id, patient_id, (
+            "doc_type", "text", "preview_url", "screen_url", "file_name", "minhash", "clarity_score"))
 
-        if not response.data:
-            print("No documents found in grandma_files table.")
+        if not rows:
+            print(f"No documents found in grandma_files table for patient {patient_id}.")
             return [], ["No documents found in grandma_files table."]
 
+        from utils.near_duplicates import select_distinct_documents  # NumPy is imported on first use
+
         text_list = []
-        raw_texts = set()
         ref_number = 1
         references = []
-        for record in response.data:
+        records = [record for record in rows if record.get("text")]
+        with timed("report.near_duplicates"):
+            distinct_records = select_distinct_documents(records)
+        if len(distinct_records) < len(records):
+            print(f"Skipping {len(records) - len(distinct_records)} near-duplicate documents of patient {patient_id}.")
+        for record in distinct_records:
             text = record.get("text")
             doc_type = record.get("doc_type")
-            url = record.get("preview_url")
+            # Link the screen-sized derivative; documents stored before derivatives
+            # existed (or whose derivatives failed) fall back to the original
+            url = record.get("screen_url") or record.get("preview_url")
             file_name = record.get("file_name")
-            if not text:
-                continue
-
-            if text in raw_texts:
-                continue
-            raw_texts.add(text)
 
             if not doc_type:
                 doc_type = "Unknown"
@@ -151,28 +507,74 @@ def get_all_image_data_for_reprocessing() -> str:
         return text.strip()
 
     except Exception as e:
-        print(f"Error fetching records from Supabase: {str(e)}")
+        print(f"Error fetching records from {get_storage().name}: {str(e)}")
 
     # Return the list of successfully processed documents and any accumulated errors
     return processed_documents
 
 
-def save_grandma_report(report: str):
+def save_grandma_report(report: str, patient_id: str = DEFAULT_PATIENT_ID,
+                        tenant_id: str = DEFAULT_TENANT_ID, status: str = REPORT_COMPLETE,
+                        version_id: Optional[str] = None, created_at: Optional[str] = None) -> dict:
+    """
+    Saves the comprehensive report to the grandma_reports table. A report generated in
+    streaming mode is saved repeatedly under one version_id and created_at: as a partial
+    draft after each completed section, then as complete (or failed).
+
+    Returns:
+        dict: The report version ('id', 'text', 'created_at', 'status').
+    """
+    version = {
+        "id": version_id or str(uuid.uuid4()),
+        "text": report,
+        "created_at": created_at or datetime.now(timezone.utc).isoformat(),
+        "status": status,
+    }
+    get_storage().upsert_report({
+        "id": version["id"],
+        "tenant_id": tenant_id,
+        "patient_id": patient_id,
+        "text": report,
+        "created_at": version["created_at"],
+        "status": status,
+    })
+    if not get_storage().remote:
+        return version
+    now = time.monotonic()
+    if status == REPORT_COMPLETE:
+        _report_cache[(tenant_id, patient_id, False)] = (now, version)
+    if status == REPORT_FAILED:
+        _report_cache.pop((tenant_id, patient_id, True), None)
+    else:
+        _report_cache[(tenant_id, patient_id, True)] = (now, version)
+    return version
+
+
+def get_latest_report(patient_id: str = DEFAULT_PATIENT_ID,
+                      tenant_id: str = DEFAULT_TENANT_ID, include_partial: bool = False) -> Optional[dict]:
     """
-    Saves the comprehensive report to the grandma_reports table.
+    Fetches the patient's latest complete report version ('id', 'text', 'created_at',
+    'status') from the grandma_reports table, or None. With include_partial, the draft of
+    a report still being generated is returned if it is newer. With a remote backend,
+    served from the per-patient cache while it is fresh.
     """
-    supabase = get_supabase_client()
-    supabase.table("grandma_reports").insert(
-        {"id": str(uuid.uuid4()), "text": report}).execute()
+    storage = get_storage()
+    if not storage.remote:
+        return storage.latest_report(tenant_id, patient_id, include_partial)
+    key = (tenant_id, patient_id, include_partial)
+    cached = _report_cache.get(key)
+    if cached and time.monotonic() - cached[0] < REPORT_CACHE_TTL_SECONDS:
+        return cached[1]
+
+    version = storage.latest_report(tenant_id, patient_id, include_partial)
+    _report_cache[key] = (time.monotonic(), version)
+    return version
 
 
-def get_grandma_report_db() -> str:
+def get_grandma_report_db(patient_id: str = DEFAULT_PATIENT_ID,
+                          tenant_id: str = DEFAULT_TENANT_ID) -> Optional[str]:
     """
-    Fetches the comprehensive report from the grandma_reports table.
+    Fetches the text of the patient's latest comprehensive report.
     """
-    supabase = get_supabase_client()
-    response = supabase.table("grandma_reports").select(
-        "text").order("created_at", desc=True).limit(1).execute()
-    if not response.data:
-        return None
-    return response.data[0]["text"]
+    version = get_latest_report(patient_id=patient_id, tenant_id=tenant_id)
+    return version["text"] if version else None
@@ -0,0 +1,419 @@
+"""
+Write-behind buffer for grandma_files inserts and updates.
+
+Uploads insert a row and every background job updates it (text and keypoints, then the
+derivative URLs), each as its own PostgREST round trip. With the buffer, a write only
+merges the new columns into the pending change of its row and returns; a flusher thread
+writes all pending changes every WRITE_BEHIND_INTERVAL_SECONDS (default 0.25), or as soon
+as WRITE_BEHIND_MAX_ROWS (default 50) rows are pending:
+
+    new rows      one bulk upsert per set of columns
+    updated rows  one call of the update_grandma_files function (migration 007), which
+                  applies a JSON array of partial row updates
+
+Several writes to one row before a flush become a single write, so the number of
+requests per flush is constant instead of growing with the upload rate.
+
+Inserts of uploads are waited for (`write(..., wait=True)`): they start a flush right away
+(group commit; inserts arriving during a flush share the next one), so /upload-image only
+reports success for a stored row and fails for a rejected one.
+
+Failures: a bulk request the database rejects is retried row by row, so one bad row
+(constraint violation, bad type, oversized value) does not hold back the others. A row
+rejected WRITE_BEHIND_MAX_ATTEMPTS (default 3) times is moved to the dead-letter journal
+(WRITE_BEHIND_DEAD_LETTER) and counted in write_behind_dead_letter_rows_total. Transient
+errors (network, timeouts, 5xx) keep everything pending and are retried after
+RETRY_SECONDS, however long they last.
+
+Durability: every write is appended to a local journal (WRITE_BEHIND_JOURNAL) and
+fsynced before it is acknowledged; flushed writes are acknowledged in the journal and
+the journal is truncated whenever nothing is pending. After a crash the unacknowledged
+writes are replayed on startup. Both kinds of writes are idempotent, so a write that
+reached the database just before the crash is simply applied again.
+
+Read-your-writes: readers call `flush(...)` for the patient (or row) they are about to
+read, which writes that patient's pending changes first and waits for a flush that is
+already in flight. The dashboard, which reads grandma_files directly, sees changes at
+most one flush interval late.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Callable, Optional
+
+from utils.metrics import REGISTRY
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND", "1") == "1"
+FLUSH_INTERVAL_SECONDS = float(os.getenv("WRITE_BEHIND_INTERVAL_SECONDS", "0.25"))
+MAX_PENDING_ROWS = int(os.getenv("WRITE_BEHIND_MAX_ROWS", "50"))
+# One journal per server process: give every worker its own path
+JOURNAL_PATH = os.getenv("WRITE_BEHIND_JOURNAL", str(
+    Path(__file__).resolve().parent.parent / ".cache" / "write_behind_grandma_files.jsonl"))
+DEAD_LETTER_PATH = os.getenv("WRITE_BEHIND_DEAD_LETTER", str(
+    Path(__file__).resolve().parent.parent / ".cache" / "write_behind_dead_letter.jsonl"))
+MAX_ATTEMPTS = int(os.getenv("WRITE_BEHIND_MAX_ATTEMPTS", "3"))
+# How long an upload waits for its row to be inserted
+WAIT_SECONDS = float(os.getenv("WRITE_BEHIND_WAIT_SECONDS", "30"))
+# The journal is rewritten with just the pending writes once it has this many lines
+JOURNAL_COMPACT_LINES = 1000
+# Backoff after a failed flush; the changes stay pending (and journaled) until they are written
+RETRY_SECONDS = 2.0
+
+WRITES = REGISTRY.counter(
+    "write_behind_writes_total", "Row writes handed to the write-behind buffer, by kind.", ("kind",))
+FLUSHED_ROWS = REGISTRY.counter(
+    "write_behind_flushed_rows_total", "Rows written by write-behind flushes, by kind.", ("kind",))
+FLUSH_REQUESTS = REGISTRY.counter(
+    "write_behind_requests_total", "Database requests made by write-behind flushes, by kind.", ("kind",))
+FLUSH_FAILURES = REGISTRY.counter(
+    "write_behind_flush_failures_total", "Write-behind flushes that failed and were retried.")
+REJECTED_ROWS = REGISTRY.counter(
+    "write_behind_rejected_rows_total", "Row writes the database rejected (retried until WRITE_BEHIND_MAX_ATTEMPTS).")
+DEAD_LETTER_ROWS = REGISTRY.counter(
+    "write_behind_dead_letter_rows_total", "Rows moved to the dead-letter journal after being rejected repeatedly.")
+PENDING_ROWS = REGISTRY.gauge(
+    "write_behind_pending_rows", "Rows with changes waiting for the next write-behind flush.")
+
+INSERT, UPDATE = "insert", "update"
+
+
+class WriteRejected(Exception):
+    """A row the database rejected MAX_ATTEMPTS times; it was moved to the dead-letter journal."""
+
+
+def is_permanent_error(error: BaseException) -> bool:
+    """
+    Whether the database rejected the rows themselves, so retrying the same write cannot
+    succeed: SQLSTATE data exceptions (22), constraint violations (23), unknown columns
+    or types (42) and size limits (54), PostgREST request errors, other 4xx responses, and
+    rows that cannot be serialized. Everything else counts as transient.
+    """
+    if isinstance(error, (ValueError, TypeError, sqlite3.IntegrityError, sqlite3.DataError)):
+        return True
+    code = str(getattr(error, "code", "") or "")
+    if code[:2] in ("22", "23", "42", "54") or (code.startswith("PGRST") and not code.startswith("PGRST0")):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    return isinstance(status, int) and 400 <= status < 500 and status not in (408, 429)
+
+
+@dataclass
+class PendingWrite:
+    kind: str                 # INSERT (a complete new row) or UPDATE (some columns of an existing row)
+    tenant_id: str
+    patient_id: str
+    columns: dict
+    seqs: list = field(default_factory=list)   # journal entries covered by this write
+    attempts: int = 0                          # times the database rejected this write
+    waiters: list = field(default_factory=list)   # Futures resolved once the write is done
+
+    def merge(self, newer: "PendingWrite") -> "PendingWrite":
+        """This write followed by `newer` as one write."""
+        kind = INSERT if INSERT in (self.kind, newer.kind) else UPDATE
+        return PendingWrite(kind, newer.tenant_id, newer.patient_id,
+                            {**self.columns, **newer.columns}, self.seqs + newer.seqs,
+                            max(self.attempts, newer.attempts), self.waiters + newer.waiters)
+
+
+class FileWriteBuffer:
+    """
+    `insert_rows(rows)` and `update_rows(updates)` write a batch to the database; they
+    are given by database/supabase_client.py.
+    """
+
+    def __init__(self, insert_rows: Callable[[list[dict]], None], update_rows: Callable[[list[dict]], None],
+                 journal_path: Optional[str] = JOURNAL_PATH, interval: float = FLUSH_INTERVAL_SECONDS,
+                 max_rows: int = MAX_PENDING_ROWS, dead_letter_path: Optional[str] = DEAD_LETTER_PATH,
+                 max_attempts: int = MAX_ATTEMPTS, retry_seconds: float = RETRY_SECONDS):
+        self._insert_rows = insert_rows
+        self._update_rows = update_rows
+        self.journal_path = journal_path
+        self.dead_letter_path = dead_letter_path
+        self.max_attempts = max_attempts
+        self.retry_seconds = retry_seconds
+        self.interval = interval
+        self.max_rows = max_rows
+        self._pending: dict[str, PendingWrite] = {}
+        self._lock = threading.Lock()          # guards _pending, the journal and _seq
+        self._flush_lock = threading.Lock()    # one flush at a time, so readers can wait for it
+        self._wakeup = threading.Condition(self._lock)
+        self._seq = 0
+        self._journal = None
+        self._journal_lines = 0
+        self._closed = False
+        self._retry_at = 0.0
+        self._replay()
+        self._thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+
+    # Journal
+
+    def _replay(self):
+        if not self.journal_path:
+            return
+        os.makedirs(os.path.dirname(self.journal_path) or ".", exist_ok=True)
+        entries, acked = {}, set()
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, encoding="utf-8") as journal:
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-append was never acknowledged
+                        continue
+                    if entry.get("ack"):
+                        acked.update(entry["ack"])
+                    else:
+                        entries[entry["seq"]] = entry
+        replayed = [entry for seq, entry in sorted(entries.items()) if seq not in acked]
+        self._seq = max(entries, default=0)
+        for entry in replayed:
+            self._add(PendingWrite(entry["kind"], entry["tenant_id"], entry["patient_id"],
+                                   entry["columns"], [entry["seq"]]), entry["image_id"], journal=False)
+        # Start a fresh journal holding only the writes still to be done
+        self._rewrite_journal()
+        if replayed:
+            print(f"Replaying {len(replayed)} unflushed grandma_files writes from {self.journal_path}.")
+
+    def _sync(self):
+        if self._journal is not None:
+            self._journal.flush()
+            os.fsync(self._journal.fileno())
+
+    def _add(self, write: PendingWrite, image_id: str, journal: bool):
+        if journal:
+            self._journal_write(image_id, write)
+        existing = self._pending.get(image_id)
+        self._pending[image_id] = existing.merge(write) if existing else write
+        PENDING_ROWS.set(len(self._pending))
+
+    def _journal_write(self, image_id: str, write: PendingWrite):
+        if self._journal is not None:
+            self._journal.write(json.dumps({
+                "seq": write.seqs[-1], "image_id": image_id, "kind": write.kind, "tenant_id": write.tenant_id,
+                "patient_id": write.patient_id, "columns": write.columns}, default=str) + "\n")
+            self._journal_lines += 1
+
+    def _rewrite_journal(self):
+        """
+        Replaces the journal by one entry per pending row (called with nothing in flight).
+        The new journal is written next to the old one and renamed over it, so a crash
+        leaves either of them intact.
+        """
+        if self._journal is not None:
+            self._journal.close()
+        temporary = f"{self.journal_path}.tmp"
+        self._journal = open(temporary, "w", encoding="utf-8")
+        self._journal_lines = 0
+        for image_id, write in self._pending.items():
+            write.seqs = write.seqs[-1:]
+            self._journal_write(image_id, write)
+        self._sync()
+        self._journal.close()
+        os.replace(temporary, self.journal_path)
+        self._journal = open(self.journal_path, "a", encoding="utf-8")
+
+    # Writes
+
+    def write(self, kind: str, image_id: str, columns: dict, tenant_id: str, patient_id: str,
+              wait: bool = False) -> Optional[Future]:
+        """
+        Queues an insert (the complete row) or update (changed columns) of one row. With
+        `wait`, returns a Future that is resolved once the row is written, or fails with
+        WriteRejected once it is dead-lettered; the write is flushed right away.
+        """
+        WRITES.inc(kind=kind)
+        waiter = Future() if wait else None
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("write-behind buffer is closed")
+            self._seq += 1
+            self._add(PendingWrite(kind, tenant_id, patient_id, dict(columns), [self._seq],
+                                   waiters=[waiter] if waiter else []), image_id, journal=True)
+            # Durable before the caller is told the write succeeded
+            self._sync()
+            if wait or len(self._pending) >= self.max_rows:
+                self._wakeup.notify()
+        return waiter
+
+    def pending(self, image_id: str) -> Optional[dict]:
+        """The pending (not yet flushed) columns of a row, if any."""
+        with self._lock:
+            write = self._pending.get(image_id)
+            return dict(write.columns) if write else None
+
+    # Flushing
+
+    def flush(self, tenant_id: Optional[str] = None, patient_id: Optional[str] = None,
+              image_id: Optional[str] = None):
+        """
+        Writes the pending changes (all of them, or those of one patient or row) and waits
+        for a flush in flight. Raises if some of them could not be written; those stay
+        pending (or are dead-lettered after MAX_ATTEMPTS rejections) and the rest is written.
+        """
+        def selected(key: str, write: PendingWrite) -> bool:
+            return ((image_id is None or key == image_id)
+                    and (patient_id is None or (write.tenant_id, write.patient_id) == (tenant_id, patient_id)))
+
+        with self._flush_lock:
+            with self._lock:
+                batch = {key: write for key, write in self._pending.items() if selected(key, write)}
+                for key in batch:
+                    del self._pending[key]
+                PENDING_ROWS.set(len(self._pending))
+            if batch:
+                self._write(batch)
+
+    def _write_rows(self, batch: dict[str, PendingWrite]):
+        inserts: dict[tuple, list[dict]] = {}
+        updates = []
+        for image_id, write in batch.items():
+            row = {**write.columns, "id": image_id, "tenant_id": write.tenant_id, "patient_id": write.patient_id}
+            if write.kind == INSERT:
+                # Rows of one bulk request must have the same columns
+                inserts.setdefault(tuple(sorted(row)), []).append(row)
+            else:
+                updates.append(row)
+        for rows in inserts.values():
+            FLUSH_REQUESTS.inc(kind=INSERT)
+            self._insert_rows(rows)
+            FLUSHED_ROWS.inc(len(rows), kind=INSERT)
+        if updates:
+            FLUSH_REQUESTS.inc(kind=UPDATE)
+            self._update_rows(updates)
+            FLUSHED_ROWS.inc(len(updates), kind=UPDATE)
+
+    def _write(self, batch: dict[str, PendingWrite]):
+        # Rows rejected before are written one by one, the rest in bulk
+        single = {image_id: write for image_id, write in batch.items() if write.attempts}
+        bulk = {image_id: write for image_id, write in batch.items() if not write.attempts}
+        written: dict[str, PendingWrite] = {}
+        rejected: dict[str, tuple[PendingWrite, BaseException]] = {}
+        error: Optional[BaseException] = None   # transient error that stopped the flush
+        try:
+            if bulk:
+                try:
+                    self._write_rows(bulk)
+                    written.update(bulk)
+                except Exception as e:
+                    FLUSH_FAILURES.inc()
+                    if not is_permanent_error(e):
+                        error = e
+                    elif len(bulk) > 1:
+                        # Find the rows the database rejects
+                        single.update(bulk)
+                    else:
+                        rejected.update({image_id: (write, e) for image_id, write in bulk.items()})
+            for image_id, write in single.items():
+                if error is not None:
+                    break
+                try:
+                    self._write_rows({image_id: write})
+                    written[image_id] = write
+                except Exception as e:
+                    if is_permanent_error(e):
+                        rejected[image_id] = (write, e)
+                    else:
+                        error = e
+        finally:
+            # Also reached when interrupted: whatever is not known to be written stays pending
+            retry = {image_id: write for image_id, write in batch.items()
+                     if image_id not in written and image_id not in rejected}
+            dead = {}
+            for image_id, (write, e) in rejected.items():
+                REJECTED_ROWS.inc()
+                write.attempts += 1
+                if write.attempts >= self.max_attempts:
+                    dead[image_id] = (write, e)
+                else:
+                    retry[image_id] = write
+                    error = error or e
+            self._settle(written, dead, retry)
+        if error is not None:
+            raise error
+
+    def _settle(self, written: dict[str, PendingWrite], dead: dict[str, tuple[PendingWrite, BaseException]],
+                retry: dict[str, PendingWrite]):
+        """Puts back the writes to retry, dead-letters and acknowledges the rest and wakes their waiters."""
+        with self._lock:
+            # Put the changes back under anything written to the rows since
+            for image_id, write in retry.items():
+                newer = self._pending.get(image_id)
+                self._pending[image_id] = write.merge(newer) if newer else write
+            PENDING_ROWS.set(len(self._pending))
+            if dead:
+                self._dead_letter(dead)
+            done = [write for write in written.values()] + [write for write, _ in dead.values()]
+            if self._journal is not None and done:
+                if not self._pending or self._journal_lines >= JOURNAL_COMPACT_LINES:
+                    # Only the pending rows are left to replay (none, or a compacted copy)
+                    self._rewrite_journal()
+                else:
+                    self._journal.write(json.dumps({"ack": [seq for write in done for seq in write.seqs]}) + "\n")
+                    self._journal_lines += 1
+                    self._sync()
+        for write in written.values():
+            for waiter in write.waiters:
+                waiter.set_result(None)
+        for image_id, (write, e) in dead.items():
+            for waiter in write.waiters:
+                waiter.set_exception(WriteRejected(f"Row {image_id} was rejected: {str(e)}"))
+
+    def _dead_letter(self, dead: dict[str, tuple[PendingWrite, BaseException]]):
+        DEAD_LETTER_ROWS.inc(len(dead))
+        for image_id, (write, e) in dead.items():
+            print(f"Write-behind gave up on {write.kind} of {image_id} after {write.attempts} attempts: {str(e)}")
+        if not self.dead_letter_path:
+            return
+        os.makedirs(os.path.dirname(self.dead_letter_path) or ".", exist_ok=True)
+        with open(self.dead_letter_path, "a", encoding="utf-8") as dead_letter:
+            for image_id, (write, e) in dead.items():
+                dead_letter.write(json.dumps({
+                    "image_id": image_id, "kind": write.kind, "tenant_id": write.tenant_id,
+                    "patient_id": write.patient_id, "columns": write.columns, "attempts": write.attempts,
+                    "error": str(e), "at": datetime.now(timezone.utc).isoformat()}, default=str) + "\n")
+            dead_letter.flush()
+            os.fsync(dead_letter.fileno())
+
+    def _due(self) -> bool:
+        """Whether to flush before the interval is over: enough rows, or a caller waiting for its write."""
+        return (len(self._pending) >= self.max_rows or any(write.waiters for write in self._pending.values())) \
+            and time.monotonic() >= self._retry_at
+
+    def _run(self):
+        while True:
+            with self._lock:
+                # After a failed flush, retry once the backoff is over
+                timeout = min(self.interval, max(self._retry_at - time.monotonic(), 0) or self.interval)
+                self._wakeup.wait_for(lambda: self._closed or self._due(), timeout=timeout)
+                if self._closed:
+                    return
+                if not self._pending or time.monotonic() < self._retry_at:
+                    continue
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed, retrying in {self.retry_seconds:.0f}s: {str(e)}")
+                self._retry_at = time.monotonic() + self.retry_seconds
+
+    def close(self):
+        """Stops the flusher after writing everything still pending (what fails stays in the journal)."""
+        with self._lock:
+            self._closed = True
+            self._wakeup.notify()
+        self._thread.join()
+        try:
+            self.flush()
+        except Exception as e:
+            print(f"Write-behind flush at shutdown failed; {len(self._pending)} rows stay journaled: {str(e)}")
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
@@ -1,9 +1,56 @@
+import asyncio
+import os
+from contextlib import asynccontextmanager
+
+from utils.env import load_env
+
+# Load .env before the routers read their configuration
+load_env()
+
 from fastapi import FastAPI
 from routers.process_image import router as process_image_router
 from routers.chat_speak import chat_router
+from routers.metrics import metrics_router
+from routers.labs import labs_router
+from routers.events import events_router
+from routers.files import files_router
+from routers.profiles import profiles_router
+from utils.tracing import trace_middleware, spawn_background
+from utils.prewarm import prewarm_clients
+from utils.image_derivatives import shutdown_derivative_pool
+from utils.ocr import shutdown_ocr_router
+from utils.loop_monitor import start_loop_monitor, stop_loop_monitor
+from utils.profiling import install_profiler, profile_middleware
+from utils.events import get_event_broker
+from database.supabase_client import replay_file_writes, shutdown_file_writes
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Event loop lag metrics and stacks of callbacks that block the loop
+    start_loop_monitor()
+    # Opt-in request profiling (PROFILING_ADMIN_TOKEN / PROFILE_SAMPLE_RATE)
+    install_profiler()
+    # Provider SDKs and clients are created lazily; optionally warm them up in the
+    # background so startup itself stays fast.
+    if os.getenv("PREWARM_CLIENTS", "1") == "1":
+        spawn_background(prewarm_clients(), job="prewarm")
+    # grandma_files writes buffered before a crash are written again
+    replay_file_writes()
+    # Subscribed before the first request, so upload progress events can be replayed
+    await get_event_broker().start()
+    yield
+    await get_event_broker().close()
+    # Worker processes would otherwise outlive the server
+    shutdown_derivative_pool()
+    shutdown_ocr_router()
+    # Buffered grandma_files writes are flushed before the process exits
+    await asyncio.to_thread(shutdown_file_writes)
+    stop_loop_monitor()
+
+
+app = FastAPI(lifespan=lifespan)
 
 # Configure CORS
 app.add_middleware(
@@ -12,8 +59,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],  # Allows all methods
     allow_headers=["*"],  # Allows all headers
+    expose_headers=["X-Trace-ID", "X-Profile-ID", "ETag"],
 )
 
+# Profile requests that ask for it (runs inside the trace middleware, so it sees the trace ID)
+app.middleware("http")(profile_middleware)
+# Assign a trace ID to every request and record request latency
+app.middleware("http")(trace_middleware)
+
 # Routers will be included here
 app.include_router(process_image_router)
 app.include_router(chat_router)
+app.include_router(metrics_router)
+app.include_router(labs_router)
+app.include_router(events_router)
+app.include_router(files_router)
+app.include_router(profiles_router)
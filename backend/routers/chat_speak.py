@@ -1,5 +1,6 @@
 # main.py or routes/chat.py
-from fastapi import FastAPI, Request, APIRouter
+import asyncio
+from fastapi import FastAPI, Request, APIRouter, Depends
 from pydantic import BaseModel
 import httpx
 import os
@@ -9,10 +10,16 @@ from io import BytesIO
 from routers.process_image import get_all_image_data_for_reprocessing
 from fastapi.responses import JSONResponse
 from database.supabase_client import get_grandma_report_db
+from routers.patient_scope import PatientScope, get_patient_scope
+from utils.metrics import timed
+from utils.token_budget import TokenBudgetExceeded, count_tokens, ensure_budget, record_usage
+from utils.openai_scheduler import get_openai_http_client
+from utils.prewarm import ensure_llm_sdks
 
 chat_router = APIRouter()
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 
 
 class ChatRequest(BaseModel):
@@ -20,12 +27,17 @@ class ChatRequest(BaseModel):
 
 
 @chat_router.post("/chat")
-async def chat(request: ChatRequest):
-    system_prompt = await get_system_prompt()
-
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
-            "https://api.openai.com/v1/chat/completions",
+async def chat(request: ChatRequest, scope: PatientScope = Depends(get_patient_scope)):
+    await ensure_llm_sdks()
+    system_prompt = await get_system_prompt(scope)
+    try:
+        ensure_budget("llm.chat", count_tokens(system_prompt, "gpt-4o") + count_tokens(request.userText, "gpt-4o"))
+    except TokenBudgetExceeded as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+
+    with timed("llm.chat", provider="openai"):
+        response = await get_openai_http_client().post(
+            f"{OPENAI_BASE_URL}/chat/completions",
             headers={
                 "Authorization": f"Bearer {OPENAI_API_KEY}",
                 "Content-Type": "application/json",
@@ -39,6 +51,9 @@ async def chat(request: ChatRequest):
             }
         )
     data = response.json()
+    usage = data.get("usage") or {}
+    record_usage(data.get("model", "gpt-4o-mini"),
+                 usage.get("prompt_tokens"), usage.get("completion_tokens"), stage="llm.chat")
     reply = data["choices"][0]["message"]["content"]
     return {"reply": reply}
 
@@ -49,9 +64,9 @@ class SpeakRequest(BaseModel):
 
 @chat_router.post("/speak")
 async def speak(request: SpeakRequest):
-    async with httpx.AsyncClient(timeout=60.0) as client:
-        response = await client.post(
-            "https://api.openai.com/v1/audio/speech",
+    with timed("tts", provider="openai"):
+        response = await get_openai_http_client().post(
+            f"{OPENAI_BASE_URL}/audio/speech",
             headers={
                 "Authorization": f"Bearer {OPENAI_API_KEY}",
                 "Content-Type": "application/json",
@@ -67,10 +82,14 @@ async def speak(request: SpeakRequest):
 
 
 @chat_router.get("/session")
-async def get_ephemeral_session():
-    system_prompt = await get_system_prompt()
-
-    url = "https://api.openai.com/v1/realtime/sessions"
+async def get_ephemeral_session(scope: PatientScope = Depends(get_patient_scope)):
+    system_prompt = await get_system_prompt(scope)
+    try:
+        ensure_budget("llm.realtime_session", count_tokens(system_prompt, "gpt-4o"))
+    except TokenBudgetExceeded as e:
+        return JSONResponse(status_code=413, content={"error": str(e)})
+
+    url = f"{OPENAI_BASE_URL}/realtime/sessions"
     headers = {
         "Authorization": f"Bearer {OPENAI_API_KEY}",
         "Content-Type": "application/json"
@@ -81,15 +100,17 @@ async def get_ephemeral_session():
         "instructions": system_prompt
     }
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(url, headers=headers, json=body)
+    with timed("llm.realtime_session", provider="openai"):
+        response = await get_openai_http_client().post(url, headers=headers, json=body)
         data = response.json()
 
     return JSONResponse(content=data)
 
 
-async def get_system_prompt():
-    report = get_grandma_report_db()
+async def get_system_prompt(scope: PatientScope):
+    # A cache miss queries the database; keep it off the event loop
+    report = await asyncio.to_thread(
+        get_grandma_report_db, patient_id=scope.patient_id, tenant_id=scope.tenant_id)
 
     if not report:
         report = "No information available"
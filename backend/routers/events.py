@@ -0,0 +1,80 @@
+import asyncio
+import json
+import os
+
+from fastapi import APIRouter, Depends, Request
+from fastapi.responses import StreamingResponse
+
+from database.supabase_client import get_latest_report
+from .patient_scope import PatientScope, get_patient_scope
+from utils.events import UploadProgress, get_event_broker, patient_channel, upload_channel
+
+events_router = APIRouter()
+
+HEARTBEAT_SECONDS = float(os.getenv("EVENTS_HEARTBEAT_SECONDS", "15"))
+
+
+def format_sse(event_type: str, data: dict) -> str:
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+
+@events_router.get("/events")
+async def patient_events(request: Request, scope: PatientScope = Depends(get_patient_scope)):
+    """
+    Server-sent events for one patient:
+        report.progress - {"stage": "queued" | "generating" | "section" | "saving" | "failed", ...};
+                          "section" means a draft with more sections is on /get-report
+        report.version  - {"version_id", "created_at"} of a newly saved report; also sent
+                          once on connect for the current report so clients can sync
+    Clients fetch /get-report only when they see a version they do not have yet.
+    """
+    broker = get_event_broker()
+    channel = patient_channel(scope.patient_id, scope.tenant_id)
+
+    async def stream():
+        # Subscribe before reading the current version so no new version slips in between
+        async with broker.subscribe(channel) as queue:
+            latest = await asyncio.to_thread(
+                get_latest_report, patient_id=scope.patient_id, tenant_id=scope.tenant_id)
+            if latest:
+                yield format_sse("report.version", {
+                    "version_id": latest["id"], "created_at": latest.get("created_at")})
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # Keeps proxies from closing idle connections
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event["type"], event["data"])
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@events_router.get("/uploads/{image_id}/progress")
+async def upload_progress(image_id: str, request: Request):
+    """
+    Server-sent upload.progress events for one upload (the image_id returned by
+    /upload-image): {"stage": "ocr_done" | "analysis_done" | "keypoints_done" |
+    "lab_values_done" | "derivatives_done" | "saved" | "failed", "stage_seconds",
+    "elapsed_seconds", ...}.
+    Stages that happened before the client connected are replayed; the stream ends after
+    "saved" or "failed".
+    """
+    broker = get_event_broker()
+
+    async def stream():
+        async with broker.subscribe(upload_channel(image_id)) as queue:
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event["type"], event["data"])
+                if event["data"].get("stage") in UploadProgress.TERMINAL_STAGES:
+                    return
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -1,21 +1,90 @@
+from __future__ import annotations
+
 import base64
 import os
 from datetime import datetime
-from openai import OpenAI
-from langchain_openai import ChatOpenAI
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from dotenv import load_dotenv
-from pathlib import Path
+from functools import lru_cache
+from typing import TYPE_CHECKING, Literal, Optional
 import asyncio
 
-# Load environment variables from .env file in the project root
-# Script directory: Epoch-CDTM-Hacks/backend/routers
-# Project root: Epoch-CDTM-Hacks
-script_dir = Path(__file__).resolve().parent
-project_root = script_dir.parent.parent
-dotenv_path = project_root / ".env"
-load_dotenv(dotenv_path=dotenv_path)
+from pydantic import BaseModel, Field
+
+from utils.env import load_env
+from utils.metrics import timed
+from utils.model_cascade import answer_confidence, escalate, first_tier, get_policy, record_answer
+from utils.token_budget import count_tokens, fit_prompt, record_usage
+from utils.openai_scheduler import get_openai_http_client
+
+# LangChain and the OpenAI SDK take a large share of the cold start, so they are only
+# imported once a document is actually processed.
+if TYPE_CHECKING:
+    from langchain_openai import ChatOpenAI
+
+# Categories of the structured keypoints stored in grandma_files.keypoints (JSONB).
+# The dashboard filters on them, e.g. all medications of a patient across documents.
+KeyPointCategory = Literal[
+    "patient", "diagnosis", "medication", "lab_result", "vaccination", "procedure",
+    "recommendation", "insurance", "provider", "date", "other",
+]
+
+
+@lru_cache(maxsize=1)
+def get_token_usage_callback():
+    """Returns the LangChain callback that feeds the token usage of every OpenAI call into the token counters."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    class TokenUsageCallbackHandler(BaseCallbackHandler):
+        def on_llm_end(self, response, **kwargs):
+            llm_output = response.llm_output or {}
+            usage = llm_output.get("token_usage") or {}
+            if usage:
+                record_usage(llm_output.get("model_name", "unknown"),
+                             usage.get("prompt_tokens"), usage.get("completion_tokens"))
+                return
+            # Streamed responses carry their usage on the message instead
+            for generations in response.generations:
+                for generation in generations:
+                    message = getattr(generation, "message", None)
+                    usage = getattr(message, "usage_metadata", None)
+                    if usage:
+                        record_usage(message.response_metadata.get("model_name", "unknown"),
+                                     usage.get("input_tokens"), usage.get("output_tokens"))
+
+    return TokenUsageCallbackHandler()
+
+
+async def invoke_chain_timed(stage: str, chain, inputs: dict):
+    """
+    Runs a LangChain chain, recording its latency under the given stage name.
+    The document text is fitted into the stage's token budget first.
+    """
+    if isinstance(inputs.get("text"), str):
+        inputs = {**inputs, "text": await fit_prompt(stage, inputs["text"])}
+    with timed(stage, provider="openai"):
+        return await chain.ainvoke(inputs)
+
+
+async def invoke_cascade(stage: str, prompt, inputs: dict) -> str:
+    """
+    Runs a classifier prompt through the stage's model cascade (utils/model_cascade.py):
+    the cheapest tier first, asking the next tier while the answer's confidence is below
+    the policy's threshold. Returns the answer text.
+    """
+    policy = get_policy(stage, CLASSIFIER_MODEL)
+    text = inputs.get("text")
+    tier = first_tier(stage, policy, count_tokens(text) if isinstance(text, str) else 0)
+    while True:
+        model = policy.tiers[tier]
+        last = tier == len(policy.tiers) - 1
+        llm = get_classifier_llm(model)
+        # Log-probs are only needed to decide whether to ask the next tier
+        message = await invoke_chain_timed(stage, prompt | (llm if last else llm.bind(logprobs=True)), inputs)
+        confidence = answer_confidence(message)
+        if last or confidence is None or confidence >= policy.min_confidence:
+            record_answer(stage, model, confidence)
+            return message.content
+        escalate(stage, model, "low_confidence")
+        tier += 1
 
 
 def encode_image(image_bytes):
@@ -32,48 +101,178 @@ async def extract_text_from_image(image_bytes, content_type="image/png"):
 
     Returns:
         str: The extracted text from the image
+
+    Raises:
+        OcrError: if the API key is missing or the extraction failed
     """
-    try:
-        # Initialize OpenAI client
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            return "Error: OPENAI_API_KEY environment variable not set."
-
-        client = OpenAI(api_key=api_key)
-
-        # Encode the image
-        base64_image = encode_image(image_bytes)
-
-        # Get the image format
-        image_format = content_type.split('/')[1]
-
-        # Create the API request
-        response = client.chat.completions.create(model="gpt-4o-mini",
-                                                         messages=[
-                                                             {
-                                                                 "role": "user",
-                                                                 "content": [
-                                                                     {
-                                                                         "type": "text",
-                                                                         "text": "Extract the text from this image, ensuring all text is captured accurately. Do not include any markdown or code formatting."
-                                                                     },
-                                                                     {
-                                                                         "type": "image_url",
-                                                                         "image_url": {
-                                                                             "url": f"data:image/{image_format};base64,{base64_image}"
-                                                                         },
-                                                                     },
-                                                                 ],
-                                                             }
-                                                         ])
-
-        # Extract the response text
-        extracted_text = response.choices[0].message.content
-
-        return extracted_text
+    from utils.ocr import OcrError, OpenAIVisionBackend
 
+    backend = OpenAIVisionBackend()
+    if not backend.available():
+        raise OcrError("OPENAI_API_KEY environment variable not set.")
+    try:
+        result = await backend.extract(image_bytes, content_type)
     except Exception as e:
-        return f"Error extracting text: {str(e)}"
+        raise OcrError(f"Error extracting text: {str(e)}") from e
+    return result.text
+
+
+# Model of the keyword, lab value and condensing chains, and of the classifier chains whose
+# task has no cascade policy (model_cascade.json)
+CLASSIFIER_MODEL = "gpt-4o-mini"
+
+
+def get_classifier_llm(model_name: str = CLASSIFIER_MODEL) -> ChatOpenAI | None:
+    """
+    Returns the LLM used by the classifier chains, or None if the OpenAI API key is missing.
+    All chains built on it are classifiers: temperature is pinned to 0 so their answers are
+    deterministic and can be served from the persistent response cache.
+    """
+    from langchain_openai import ChatOpenAI
+    from utils.llm_cache import get_llm_cache
+
+    load_env()
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        return None
+    return ChatOpenAI(openai_api_key=api_key, model_name=model_name, temperature=0,
+                      cache=get_llm_cache(), callbacks=[get_token_usage_callback()],
+                      http_async_client=get_openai_http_client())
+
+
+class KeyPoint(BaseModel):
+    """One significant fact of a document, e.g. key 'Medication', value 'Ramipril 5 mg 1-0-0'."""
+    key: str = Field(description="Concise, descriptive label such as 'Patient Name', 'Diagnosis' or 'Medication'")
+    value: str = Field(description="The corresponding value exactly as stated in the text; may contain commas")
+    category: KeyPointCategory = Field(description="The kind of information, used to filter keypoints across documents")
+
+
+class KeyPoints(BaseModel):
+    keypoints: list[KeyPoint]
+
+
+class DocumentKeyPoints(BaseModel):
+    document_id: str = Field(description="The id of the document, exactly as given in its <document> tag")
+    keypoints: list[KeyPoint]
+
+
+class BatchKeyPoints(BaseModel):
+    documents: list[DocumentKeyPoints]
+
+
+KEYWORD_INSTRUCTIONS = """From the following text, extract the most significant pieces of information as key-value pairs.
+For each piece of information, identify a concise, descriptive label (the key) and its corresponding value from the text.
+Examples of potential labels could be 'Patient Name', 'Condition', 'Treatment', 'Finding', 'Recommendation', 'Date', 'Organization', etc., but adapt the labels dynamically based on the text content.
+Give every key-value pair the category that fits it best. List each medication, diagnosis and lab result as its own pair.
+Aim for 5-10 distinct and informative key-value pairs."""
+
+# Keyword jobs of concurrent documents are sent as one request (see get_keyword_batcher)
+KEYWORD_BATCHING = os.getenv("KEYWORD_BATCHING", "1") == "1"
+KEYWORD_BATCH_MAX_DOCUMENTS = int(os.getenv("KEYWORD_BATCH_MAX_DOCUMENTS", "8"))
+KEYWORD_BATCH_WAIT_SECONDS = float(os.getenv("KEYWORD_BATCH_WAIT_MS", "50")) / 1000
+# Stays below the default per-call token budget, so a batch is never truncated
+KEYWORD_BATCH_MAX_TOKENS = int(os.getenv("KEYWORD_BATCH_MAX_TOKENS", "12000"))
+
+
+def _valid_keypoints(keypoints: list[KeyPoint]) -> list[dict]:
+    return [keypoint.model_dump() for keypoint in keypoints if keypoint.key.strip() and keypoint.value.strip()]
+
+
+async def extract_keywords(extracted_text: str, llm: ChatOpenAI) -> list[dict]:
+    """
+    Extracts the document's key facts as typed records
+    ({"key": ..., "value": ..., "category": ...}) using structured output.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    keyword_prompt_text = KEYWORD_INSTRUCTIONS + """
+
+Text:
+{text}"""
+    prompt_keywords = ChatPromptTemplate.from_template(keyword_prompt_text)
+    chain_keywords = prompt_keywords | llm.with_structured_output(KeyPoints, method="json_schema")
+    result = await invoke_chain_timed(
+        "llm.keywords", chain_keywords, {"text": extracted_text})
+    return _valid_keypoints(result.keypoints)
+
+
+async def extract_keywords_batch(jobs: list[tuple[str, ChatOpenAI]]) -> dict[int, list[dict]]:
+    """
+    Extracts the keypoints of several documents with one structured request, returned by
+    the documents' positions in `jobs`. Documents the answer misses, repeats or leaves
+    without a keypoint are left out and retried on their own by the batcher.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+
+    batch_prompt_text = """The following documents are each enclosed in <document id="..."> and </document>.
+Handle every document on its own, as described below, and return its key-value pairs under its id.
+
+""" + KEYWORD_INSTRUCTIONS + """
+
+Documents:
+{text}"""
+    prompt_keywords = ChatPromptTemplate.from_template(batch_prompt_text)
+    # All jobs come from get_classifier_llm() and share its configuration
+    chain_keywords = prompt_keywords | jobs[0][1].with_structured_output(BatchKeyPoints, method="json_schema")
+    documents = "\n\n".join(f'<document id="doc-{i}">\n{text}\n</document>' for i, (text, _) in enumerate(jobs))
+    result = await invoke_chain_timed("llm.keywords_batch", chain_keywords, {"text": documents})
+
+    answers: dict[str, list[list[KeyPoint]]] = {}
+    for document in result.documents:
+        answers.setdefault(document.document_id.strip(), []).append(document.keypoints)
+    keypoints = {}
+    for i in range(len(jobs)):
+        answer = answers.get(f"doc-{i}")
+        if answer is not None and len(answer) == 1 and _valid_keypoints(answer[0]):
+            keypoints[i] = _valid_keypoints(answer[0])
+    return keypoints
+
+
+@lru_cache(maxsize=1)
+def get_keyword_batcher():
+    from utils.micro_batch import MicroBatcher
+
+    return MicroBatcher(
+        "keywords", extract_keywords_batch, lambda job: extract_keywords(*job),
+        max_items=KEYWORD_BATCH_MAX_DOCUMENTS if KEYWORD_BATCHING else 1,
+        max_wait=KEYWORD_BATCH_WAIT_SECONDS, max_cost=KEYWORD_BATCH_MAX_TOKENS,
+        cost=lambda job: count_tokens(job[0]))
+
+
+async def extract_keywords_batched(extracted_text: str, llm: ChatOpenAI) -> list[dict]:
+    """extract_keywords, sent together with the keyword jobs of concurrently processed documents."""
+    return await get_keyword_batcher().submit((extracted_text, llm))
+
+
+class LabValue(BaseModel):
+    """One measured lab parameter of a lab report."""
+    analyte: str = Field(description="Name of the measured parameter as printed, e.g. 'Kreatinin' or 'HbA1c'")
+    value: float = Field(description="The numeric result")
+    unit: str = Field(description="Unit as printed, e.g. 'mg/dL'; empty if none is given")
+    reference_low: Optional[float] = Field(description="Lower bound of the reference range, null if not given")
+    reference_high: Optional[float] = Field(description="Upper bound of the reference range, null if not given")
+    collected_on: Optional[str] = Field(description="Sampling or report date as YYYY-MM-DD, null if unknown")
+
+
+class LabValues(BaseModel):
+    values: list[LabValue]
+
+
+async def extract_lab_values(extracted_text: str, llm: ChatOpenAI) -> list[dict]:
+    """Extracts the numeric lab results of a Lab Report as LabValue records."""
+    from langchain_core.prompts import ChatPromptTemplate
+
+    lab_prompt_text = """The following text is an OCR extraction of a laboratory report.
+List every numeric lab measurement it contains: the analyte, the numeric result, its unit and the reference range bounds.
+For a one-sided range such as '< 5.0' fill in only the matching bound. Skip qualitative results such as 'positive' or 'negative'.
+Use the sampling date, or otherwise the report date, for collected_on.
+
+Text:
+{text}"""
+    prompt_labs = ChatPromptTemplate.from_template(lab_prompt_text)
+    chain_labs = prompt_labs | llm.with_structured_output(LabValues, method="json_schema")
+    result = await invoke_chain_timed("llm.lab_values", chain_labs, {"text": extracted_text})
+    return [value.model_dump() for value in result.values if value.analyte.strip()]
 
 
 async def analyze_document_with_langchain(extracted_text: str, document_type: str = "report"):
@@ -89,12 +288,13 @@ async def analyze_document_with_langchain(extracted_text: str, document_type: st
         tuple: (validation_result, recency_result, clarity_score, llm_instance)
                Returns (error_message, None, None, None) if API key is missing.
     """
-    api_key = os.getenv("OPENAI_API_KEY")
-    if not api_key:
+    from langchain_core.prompts import ChatPromptTemplate
+
+    llm = get_classifier_llm()
+    if llm is None:
         return "Error: OPENAI_API_KEY environment variable not set.", None, None, None
 
     today_date = datetime.now().strftime("%Y-%m-%d")
-    llm = ChatOpenAI(openai_api_key=api_key, model_name="gpt-4o-mini")
 
     # 1. Validate Document Type
     prompt_validate_text = """Based on the content of the following text, determine if it is a '{doc_type}'.
@@ -109,7 +309,6 @@ async def analyze_document_with_langchain(extracted_text: str, document_type: st
 Text:
 {text}"""
     prompt_validate = ChatPromptTemplate.from_template(prompt_validate_text)
-    chain_validate = prompt_validate | llm | StrOutputParser()
 
     # 2. Check Recency (last year)
     prompt_recency_text = """Analyze the following text to determine if the information or events described seem to be from within the last year from today.
@@ -119,7 +318,6 @@ Respond with only 'recent', 'not recent', or 'unknown'. TODAY'S DATE IS {today_d
 Text:
 {text}"""
     prompt_recency = ChatPromptTemplate.from_template(prompt_recency_text)
-    chain_recency = prompt_recency | llm | StrOutputParser()
 
     # 3. Check Clarity and assign a score
     prompt_clarity_text = """Evaluate the clarity and coherence of the following text, which is an OCR extraction from a document.
@@ -131,15 +329,15 @@ Respond only with the numerical score (x.xx).
 Text:
 {text}"""
     prompt_clarity = ChatPromptTemplate.from_template(prompt_clarity_text)
-    chain_clarity = prompt_clarity | llm | StrOutputParser()
 
-    # Run the LLM calls in parallel
+    # Run the LLM calls in parallel, each through its model cascade
     results = await asyncio.gather(
-        chain_validate.ainvoke(
-            {"text": extracted_text, "doc_type": document_type}),
-        chain_recency.ainvoke(
-            {"text": extracted_text, "today_date": today_date}),
-        chain_clarity.ainvoke({"text": extracted_text})
+        invoke_cascade("llm.validate", prompt_validate,
+                       {"text": extracted_text, "doc_type": document_type}),
+        invoke_cascade("llm.recency", prompt_recency,
+                       {"text": extracted_text, "today_date": today_date}),
+        invoke_cascade("llm.clarity", prompt_clarity,
+                       {"text": extracted_text})
     )
     validation_result, recency_result, clarity_score_str = results
 
@@ -163,6 +361,8 @@ async def process_document_acceptance(extracted_text: str, validation_result: st
               If accepted, also includes 'data' (dict with 'text') and
               'get_keywords' (a callable function to extract keywords).
     """
+    from langchain_core.prompts import ChatPromptTemplate
+
     if validation_result == "Error: OPENAI_API_KEY environment variable not set." or llm is None:
         return {"accepted": False, "error": "Critical error: OpenAI API key not set or LLM not available."}
 
@@ -180,8 +380,9 @@ async def process_document_acceptance(extracted_text: str, validation_result: st
         Document Type Context: {doc_type_context}"""
         prompt_medical_relevance = ChatPromptTemplate.from_template(
             prompt_medical_relevance_text)
-        chain_medical_relevance = prompt_medical_relevance | llm | StrOutputParser()
-        medical_relevance_result = await chain_medical_relevance.ainvoke({"text": extracted_text, "doc_type_context": doc_type})
+        medical_relevance_result = await invoke_cascade(
+            "llm.medical_relevance", prompt_medical_relevance,
+            {"text": extracted_text, "doc_type_context": doc_type})
 
         if medical_relevance_result.lower() != 'yes':
             rejection_reasons.append(
@@ -239,8 +440,7 @@ Document Type user tried to upload: {doc_type_for_user}
 Identified issues by the system: {reasons}
 """
         error_prompt = ChatPromptTemplate.from_template(error_prompt_template)
-        error_chain = error_prompt | llm | StrOutputParser()
-        llm_generated_error = await error_chain.ainvoke({
+        llm_generated_error = await invoke_cascade("llm.error_message", error_prompt, {
             "reasons": reasons_string,
             "doc_type_for_user": doc_type  # Pass the actual doc_type for the prompt context
         })
@@ -248,24 +448,7 @@ Identified issues by the system: {reasons}
 
     # If all checks pass (i.e., no rejection_reasons were added that apply to this doc_type)
     async def _extract_keywords_on_demand():
-        keyword_prompt_text = """From the following text, extract the most significant pieces of information as key-value pairs.
-For each piece of information, identify a concise, descriptive label (the key) and its corresponding value from the text.
-Examples of potential labels could be 'Patient Name', 'Condition', 'Treatment', 'Finding', 'Recommendation', 'Date', 'Organization', etc., but adapt the labels dynamically based on the text content.
-List these key-value pairs as a comma-separated string. For example: 'Patient Name: Jane Doe, Condition: Cardiac Health, Recommendation: Continue treatment'.
-Aim for 5-10 distinct and informative key-value pairs.
-
-Text:
-{text}"""
-        prompt_keywords = ChatPromptTemplate.from_template(keyword_prompt_text)
-        chain_keywords = prompt_keywords | llm | StrOutputParser()
-        keywords_str = await chain_keywords.ainvoke({"text": extracted_text})
-        individual_keywords = [
-            keyword.strip() for keyword in keywords_str.split(',') if keyword.strip()]
-        if not individual_keywords:
-            return ""  # Return an empty string if no keywords are found
-        markdown_keywords = "\n".join(
-            [f"- {kw}" for kw in individual_keywords])
-        return markdown_keywords
+        return await extract_keywords_batched(extracted_text, llm)
 
     success_message = ""
     if doc_type in ["Insurance Card", "Doctor's Letter", "Lab Report"]:
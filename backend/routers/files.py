@@ -0,0 +1,23 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import FileResponse
+
+from database.supabase_client import get_storage
+
+files_router = APIRouter()
+
+
+@files_router.get("/files/{file_path:path}")
+async def get_file(file_path: str):
+    """
+    Serves an uploaded object of the embedded storage backend (STORAGE_BACKEND=local);
+    preview_url and the derivative URLs point here. With Supabase the objects are served
+    by the storage bucket and this returns 404.
+    """
+    stored = await asyncio.to_thread(get_storage().object_file, file_path)
+    if stored is None:
+        raise HTTPException(status_code=404, detail="File not found")
+    blob, content_type, cache_control = stored
+    headers = {"Cache-Control": f"max-age={cache_control}"} if cache_control else None
+    return FileResponse(blob, media_type=content_type, headers=headers)
@@ -0,0 +1,51 @@
+import asyncio
+import os
+from datetime import date
+from functools import lru_cache
+from typing import Optional
+
+from fastapi import APIRouter, Depends
+
+from database.supabase_client import get_lab_value_rows
+from .patient_scope import PatientScope, get_patient_scope
+from utils.metrics import timed
+
+labs_router = APIRouter()
+
+
+@lru_cache(maxsize=1)
+def get_lab_store():
+    """Returns the process-wide per-patient lab value column store (NumPy is imported on first use)."""
+    from utils.lab_values import LabStore
+
+    return LabStore(get_lab_value_rows,
+                    ttl_seconds=float(os.getenv("LAB_CACHE_TTL_SECONDS", "30")))
+
+
+@labs_router.get("/labs")
+async def list_lab_analytes(scope: PatientScope = Depends(get_patient_scope)):
+    """Lists the analytes measured for the patient with their unit, count and latest value."""
+    series = await asyncio.to_thread(get_lab_store().get, scope.patient_id, scope.tenant_id)
+    analytes = []
+    for name, lab_series in sorted(series.items()):
+        analytes.append({"analyte": name, "unit": lab_series.unit, "count": len(lab_series.dates),
+                         "latest": lab_series.latest()})
+    return {"success": True, "analytes": analytes}
+
+
+@labs_router.get("/labs/{analyte}")
+async def get_lab_trend(analyte: str, since: Optional[date] = None, until: Optional[date] = None,
+                        scope: PatientScope = Depends(get_patient_scope)):
+    """
+    Returns the patient's values of one analyte (e.g. /labs/creatinine or /labs/Kreatinin)
+    over time, normalized to a single unit and flagged against their reference range.
+    """
+    from utils.lab_values import normalize_analyte
+
+    series = await asyncio.to_thread(get_lab_store().get, scope.patient_id, scope.tenant_id)
+    with timed("labs.trend"):
+        lab_series = series.get(normalize_analyte(analyte))
+        if lab_series is None:
+            return {"success": False, "error": f"No values found for '{analyte}'"}
+        points = lab_series.to_points(since, until)
+    return {"success": True, "analyte": lab_series.analyte, "unit": lab_series.unit, "points": points}
@@ -0,0 +1,26 @@
+from dataclasses import dataclass
+
+from fastapi import Query
+
+from database.supabase_client import DEFAULT_PATIENT_ID, DEFAULT_TENANT_ID
+from utils.token_budget import attribute_patient
+
+
+@dataclass(frozen=True)
+class PatientScope:
+    """The tenant (clinic) and patient a request operates on."""
+    tenant_id: str
+    patient_id: str
+
+
+def get_patient_scope(
+    patient_id: str = Query(DEFAULT_PATIENT_ID),
+    tenant_id: str = Query(DEFAULT_TENANT_ID),
+) -> PatientScope:
+    """
+    FastAPI dependency resolving the patient scope from the query string.
+    Clients that only know a single patient can omit both parameters.
+    """
+    # OpenAI usage of the request (and of the jobs it starts) is accounted to the patient
+    attribute_patient(tenant_id, patient_id)
+    return PatientScope(tenant_id=tenant_id, patient_id=patient_id)
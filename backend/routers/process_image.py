@@ -1,67 +1,142 @@
 import os
 import httpx
 from fastapi import APIRouter, Response, status
-from fastapi import APIRouter, UploadFile, File, Form
+from fastapi import APIRouter, UploadFile, File, Form, Depends, Request
+from fastapi.responses import JSONResponse
 from typing import Optional
-from database.supabase_client import save_to_supabase, update_file_data
+from database.supabase_client import (
+    save_to_supabase,
+    update_file_data,
+    upload_file_to_storage,
+    insert_file_record,
+    remove_file_from_storage,
+    get_patient_keypoints,
+    replace_lab_values,
+    upload_derivatives,
+    update_file_previews,
+)
 # TODO: Implement and uncomment the following import from your supabase_client.py
-from database.supabase_client import get_all_image_data_for_reprocessing, save_grandma_report, get_grandma_report_db
+from database.supabase_client import (
+    REPORT_COMPLETE, REPORT_FAILED, REPORT_PARTIAL, get_all_image_data_for_reprocessing, get_latest_report,
+    save_grandma_report)
 from .extract_text_and_keypoints import (
-    extract_text_from_image,
     analyze_document_with_langchain,
-    process_document_acceptance
+    process_document_acceptance,
+    get_token_usage_callback,
+    get_classifier_llm,
+    extract_keywords_batched,
+    extract_lab_values,
+    invoke_chain_timed,
+    KeyPointCategory,
 )
+from .labs import get_lab_store
 from fastapi import Form
-
-from utils.google_vision import extract_text_from_image_using_google
-import time
+from .patient_scope import PatientScope, get_patient_scope
+
+from utils.ocr import get_ocr_router
+from utils.card_layout import extract_card_keypoints
+from utils.model_cascade import first_tier, get_policy, record_answer
+from utils.env import load_env
+from utils.metrics import timed
+from utils.tracing import current_trace_id, spawn_background
+from utils.events import publish_event, UploadProgress
+from utils.report_scheduler import ReportScheduler
+from utils.image_derivatives import DERIVATIVE_CONTENT_TYPE, create_derivatives
+from utils.openai_scheduler import Priority, get_openai_http_client, openai_priority
+from utils.token_budget import count_tokens, fit_prompt, split_by_tokens
+from utils.report_stream import ReportStream
+from utils.prewarm import ensure_llm_sdks
 import asyncio
+import uuid
+from datetime import date, datetime, timezone
+from functools import lru_cache
 import os  # Added for OPENAI_API_KEY
-from langchain_openai import ChatOpenAI  # Added for LLM call
 
 
 router = APIRouter()
 
+# Speculative mode starts the heavy OpenAI extraction and the storage upload while the
+# quick validation is still running, and discards them if the document is rejected.
+SPECULATIVE_EXTRACTION = os.getenv("SPECULATIVE_EXTRACTION", "1") == "1"
 
-async def extract_text_and_keypoints_properly(image_bytes: bytes, content_type: str, doc_type: str):
-    """Processes an image: extracts text, analyzes it, and extracts keywords if accepted."""
 
-    # Step 1: Extract text from image
-    # The extract_text_from_image function from the other file returns the text or an error string.
-    start_text_extraction = time.time()
-    extracted_text_or_error = await extract_text_from_image(
-        image_bytes, content_type)
-    text_extraction_time = time.time() - start_text_extraction
-    print(f"Time to extract text: {text_extraction_time:.2f} seconds")
+async def _cancel_task(task: Optional[asyncio.Task]):
+    """Cancels a speculative task and waits until it has actually stopped."""
+    if task is None:
+        return
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        # Cancellation (or a failure we no longer care about) is the expected outcome
+        pass
+
 
-    if isinstance(extracted_text_or_error, str) and extracted_text_or_error.startswith("Error:"):
-        return extracted_text_or_error, [f"Text extraction failed: {extracted_text_or_error}"]
+async def extract_text_and_keypoints_properly(image_bytes: bytes, content_type: str, doc_type: str,
+                                              progress: Optional[UploadProgress] = None):
+    """
+    Processes an image: extracts text, analyzes it, and extracts keywords if accepted.
+    Returns (text, keypoints, clarity_score) or, for rejected documents, the acceptance result.
+    Stage transitions (ocr_done, analysis_done, keypoints_done) are published on `progress`.
+    """
 
-    extracted_text = extracted_text_or_error
+    # Step 1: Extract text from image with the OCR backend routed for the final extraction
+    try:
+        with timed("extract.ocr"):
+            ocr_result = await get_ocr_router().extract(image_bytes, content_type, stage="extract", doc_type=doc_type)
+    except Exception as e:
+        # Reported as a failed document: the error must not be stored or analyzed as its text
+        print(f"Text extraction failed: {str(e)}")
+        return {"accepted": False, "error": f"Text extraction failed: {str(e)}"}
+
+    extracted_text = ocr_result.text
+    if progress:
+        await progress.stage("ocr_done", backend=ocr_result.backend)
+
+    # Cards print their fields in fixed places and are read from the OCR layout without an LLM.
+    # process_document_acceptance never rejects these document types, so analysis and acceptance
+    # are skipped as well and the OCR confidence stands in for the clarity score.
+    card_keypoints = extract_card_keypoints(doc_type, ocr_result.words)
+    if card_keypoints is not None:
+        if progress:
+            await progress.stage("analysis_done", accepted=True)
+            await progress.stage("keypoints_done", keypoints=len(card_keypoints))
+        return extracted_text, card_keypoints, ocr_result.confidence
 
     # Step 2: Analyze the document (type, recency, clarity)
     # This returns: validation_result, recency_result, clarity_score, llm_instance
     # Or: error_message, None, None, None (if API key issue)
-    start_document_analysis = time.time()
-    val_res, rec_res, clar_score, llm_instance = await analyze_document_with_langchain(
-        extracted_text,
-        document_type=doc_type  # Use the passed doc_type
-    )
-    document_analysis_time = time.time() - start_document_analysis
-    print(f"Time to analyze document: {document_analysis_time:.2f} seconds")
+    # The keyword chain only needs the text, so it runs alongside analysis and acceptance
+    # and is cancelled if the document ends up rejected.
+    keywords_task = None
+    keyword_llm = get_classifier_llm()
+    if keyword_llm is not None:
+        keywords_task = asyncio.create_task(
+            extract_keywords_batched(extracted_text, keyword_llm))
 
-    if llm_instance is None:  # Indicates API key error from analyze_document_with_langchain
-        return extracted_text, [f"Document analysis failed: {val_res}"]
-
-    # Step 3: Process acceptance and conditionally get keywords
-    # This returns a dict with "accepted", "error", and optionally "data" and "get_keywords"
-    start_acceptance_processing = time.time()
-    acceptance_output = await process_document_acceptance(
-        extracted_text, val_res, rec_res, clar_score, llm_instance, doc_type  # Pass doc_type
-    )
-    acceptance_processing_time = time.time() - start_acceptance_processing
-    print(
-        f"Time to process document acceptance: {acceptance_processing_time:.2f} seconds")
+    try:
+        with timed("extract.analysis"):
+            val_res, rec_res, clar_score, llm_instance = await analyze_document_with_langchain(
+                extracted_text,
+                document_type=doc_type  # Use the passed doc_type
+            )
+
+        if llm_instance is None:  # Indicates API key error from analyze_document_with_langchain
+            await _cancel_task(keywords_task)
+            print(f"Document analysis failed: {val_res}")
+            return extracted_text, [], None
+
+        # Step 3: Process acceptance and conditionally get keywords
+        # This returns a dict with "accepted", "error", and optionally "data" and "get_keywords"
+        with timed("extract.acceptance"):
+            acceptance_output = await process_document_acceptance(
+                extracted_text, val_res, rec_res, clar_score, llm_instance, doc_type  # Pass doc_type
+            )
+        if progress:
+            await progress.stage("analysis_done", accepted=bool(acceptance_output.get("accepted")))
+    except BaseException:
+        await _cancel_task(keywords_task)
+        raise
 
     if acceptance_output.get("accepted"):
         text_to_return = acceptance_output.get(
@@ -69,30 +144,30 @@ async def extract_text_and_keypoints_properly(image_bytes: bytes, content_type:
         get_keywords_func = acceptance_output.get("get_keywords")
 
         keywords_list = []
-        if callable(get_keywords_func):
+        if keywords_task is not None or callable(get_keywords_func):
             try:
-                start_keyword_extraction = time.time()
-                # This makes the LLM call for keywords
-                keywords_list = await get_keywords_func()
-                keyword_extraction_time = time.time() - start_keyword_extraction
-                print(
-                    f"Time to extract keywords: {keyword_extraction_time:.2f} seconds")
+                # Usually already finished: the LLM call for keywords overlapped the checks
+                with timed("extract.keywords"):
+                    keywords_list = await (keywords_task or get_keywords_func())
             except Exception as e:
                 # Log this error, as keyword extraction failed post-acceptance
                 print(f"Error during on-demand keyword extraction: {str(e)}")
-                keywords_list = ["Error during keyword extraction."]
         else:
             # This case should ideally not be reached if accepted and llm_instance was valid
-            keywords_list = ["Keyword extraction function was not available."]
+            print("Keyword extraction function was not available.")
 
-        return text_to_return, keywords_list
+        if progress:
+            await progress.stage("keypoints_done", keypoints=len(keywords_list))
+        return text_to_return, keywords_list, clar_score
     else:
         # Document was not accepted by process_document_acceptance
+        await _cancel_task(keywords_task)
         return acceptance_output
 
 
-async def validate_image_quickly(image_bytes: bytes, doc_type: str) -> tuple[dict, str | None]:
-    """Extract text and validate it using Google Vision."""
+async def validate_image_quickly(image_bytes: bytes, doc_type: str,
+                                content_type: str = "image/png") -> tuple[dict, str | None]:
+    """Extract text with the OCR backend routed for quick validation (see utils/ocr.py) and validate it."""
 
     allowed_doc_types = [
         'Insurance Card',
@@ -106,58 +181,56 @@ async def validate_image_quickly(image_bytes: bytes, doc_type: str) -> tuple[dic
 
     # Step 1: Extract text from image
     try:
-        start_text_extraction = time.time()
-        extracted_text = extract_text_from_image_using_google(image_bytes)
-        text_extraction_time = time.time() - start_text_extraction
-        print(f"Time to extract text: {text_extraction_time:.2f} seconds")
+        with timed("validate.ocr"):
+            ocr_result = await get_ocr_router().extract(image_bytes, content_type, stage="validate", doc_type=doc_type)
+        extracted_text = ocr_result.text
     except Exception as e:
         return {"accepted": False, "error": f"Text extraction failed: {str(e)}"}, None
 
     # Step 2: Analyze the document (type, recency, clarity)
     # This returns: validation_result, recency_result, clarity_score, llm_instance
     # Or: error_message, None, None, None (if API key issue)
-    start_document_analysis = time.time()
-    val_res, rec_res, clar_score, llm_instance = await analyze_document_with_langchain(
-        extracted_text,
-        document_type=doc_type  # Use the passed doc_type
-    )
-    document_analysis_time = time.time() - start_document_analysis
-    print(f"Time to analyze document: {document_analysis_time:.2f} seconds")
+    with timed("validate.analysis"):
+        val_res, rec_res, clar_score, llm_instance = await analyze_document_with_langchain(
+            extracted_text,
+            document_type=doc_type  # Use the passed doc_type
+        )
 
     if llm_instance is None:  # Indicates API key error from analyze_document_with_langchain
         return {"accepted": False, "error": "Document analysis failed: API key error"}, extracted_text
 
     # Step 3: Process acceptance and conditionally get keywords
     # This returns a dict with "accepted", "error", and optionally "data" and "get_keywords"
-    start_acceptance_processing = time.time()
-    acceptance_output = await process_document_acceptance(
-        extracted_text, val_res, rec_res, clar_score, llm_instance, doc_type  # Pass doc_type
-    )
-    acceptance_processing_time = time.time() - start_acceptance_processing
-    print(
-        f"Time to process document acceptance: {acceptance_processing_time:.2f} seconds")
+    with timed("validate.acceptance"):
+        acceptance_output = await process_document_acceptance(
+            extracted_text, val_res, rec_res, clar_score, llm_instance, doc_type  # Pass doc_type
+        )
     return (acceptance_output, extracted_text)
 
 
 @router.post("/upload-image")
-async def upload_image(file: UploadFile, doc_type: str = Form(...)):
+async def upload_image(file: UploadFile, doc_type: str = Form(...),
+                       scope: PatientScope = Depends(get_patient_scope)):
     # Existing code for when a file is uploaded
-    print(f"Received file: {file.filename} of type {doc_type}")
+    print(f"[{current_trace_id()}] Received file: {file.filename} of type {doc_type}")
     image_bytes = await file.read()
+    await ensure_llm_sdks()
 
-    # Measure time for extract_text_and_keypoints
-    start_extract_time = time.time()
-    result, extracted_text = await validate_image_quickly(image_bytes, doc_type)
-    extract_time = time.time() - start_extract_time
-    print(f"Time to validate image: {extract_time:.2f} seconds")
+    if SPECULATIVE_EXTRACTION:
+        return await upload_image_speculatively(file, image_bytes, doc_type, scope)
+
+    with timed("upload.validate"):
+        result, extracted_text = await validate_image_quickly(image_bytes, doc_type, file.content_type)
 
     accepted = result.get("accepted")
     error = result.get("error")
 
     if accepted:
         # Save to Supabase and get the image_id
-        saved_data = save_to_supabase(image_bytes, image=file, text=extracted_text,
-                                      keypoints=None, doc_type=doc_type)
+        saved_data = await asyncio.to_thread(
+            save_to_supabase, image_bytes, image=file, text=extracted_text,
+            keypoints=None, doc_type=doc_type,
+            patient_id=scope.patient_id, tenant_id=scope.tenant_id)
 
         # Start background task for processing the image properly
         image_id = saved_data.get("image_id")
@@ -166,15 +239,106 @@ async def upload_image(file: UploadFile, doc_type: str = Form(...)):
         # Create a copy of image_bytes for the background task
         image_bytes_copy = image_bytes
 
-        # Start background task
-        asyncio.create_task(process_image_properly(
-            image_id, image_bytes_copy, content_type, doc_type=doc_type  # Added doc_type
-        ))
+        # Start background task; it inherits this request's trace ID
+        get_report_scheduler().document_job_started(scope)
+        spawn_background(process_image_properly(
+            image_id, image_bytes_copy, content_type, doc_type=doc_type,  # Added doc_type
+            scope=scope, file_name=file.filename
+        ), job="process_image")
+        # Clients follow the background processing on /uploads/{image_id}/progress
+        return {"success": accepted, "error": error, "image_id": image_id}
 
     return {"success": accepted, "error": error}
 
 
-async def process_image_properly(image_id: str, image_bytes: Optional[bytes], content_type: Optional[str], doc_type: str):
+async def upload_image_speculatively(file: UploadFile, image_bytes: bytes, doc_type: str,
+                                     scope: PatientScope):
+    """
+    /upload-image in speculative mode: the full extraction (OCR, analysis, keywords) and the
+    storage upload start right away, in parallel with the quick validation. Accepted documents
+    only wait for the row insert; rejected ones cancel the extraction and remove the upload.
+    """
+    image_id = str(uuid.uuid4())
+    content_type = file.content_type
+    progress = UploadProgress(image_id)
+
+    with openai_priority(Priority.BACKGROUND):
+        extraction = asyncio.create_task(
+            extract_text_and_keypoints_properly(image_bytes, content_type, doc_type, progress))
+    storage = asyncio.create_task(asyncio.to_thread(
+        upload_file_to_storage, image_id, image_bytes, file.filename, content_type,
+        patient_id=scope.patient_id, tenant_id=scope.tenant_id))
+
+    try:
+        with timed("upload.validate"):
+            result, extracted_text = await validate_image_quickly(image_bytes, doc_type, content_type)
+        accepted = result.get("accepted")
+        error = result.get("error")
+        if not accepted:
+            await _discard_speculation(extraction, storage)
+            return {"success": accepted, "error": error}
+
+        stored_file = await storage
+        file_size = getattr(file, "size", None) or len(image_bytes)
+        await asyncio.to_thread(
+            insert_file_record, image_id, stored_file, file.filename, content_type, file_size,
+            extracted_text, None, doc_type,
+            patient_id=scope.patient_id, tenant_id=scope.tenant_id)
+    except BaseException:
+        await _discard_speculation(extraction, storage)
+        raise
+
+    # The background job picks up the already running extraction
+    get_report_scheduler().document_job_started(scope)
+    spawn_background(process_image_properly(
+        image_id, image_bytes, content_type, doc_type=doc_type, scope=scope,
+        extraction=extraction, progress=progress, file_name=file.filename
+    ), job="process_image")
+    # Clients follow the background processing on /uploads/{image_id}/progress
+    return {"success": accepted, "error": error, "image_id": image_id}
+
+
+async def _discard_speculation(extraction: asyncio.Task, storage: asyncio.Task):
+    """Cancels the speculative extraction and deletes the speculatively uploaded file."""
+    await _cancel_task(extraction)
+    try:
+        # A thread cannot be interrupted: wait for the upload, then delete what it stored
+        stored_file = await storage
+        await asyncio.to_thread(remove_file_from_storage, stored_file["file_path"])
+    except Exception as e:
+        print(f"[{current_trace_id()}] Could not discard speculative upload: {str(e)}")
+
+
+async def process_image_properly(image_id: str, image_bytes: Optional[bytes], content_type: Optional[str], doc_type: str,
+                                 scope: PatientScope, extraction: Optional[asyncio.Task] = None,
+                                 progress: Optional[UploadProgress] = None, file_name: Optional[str] = None):
+    """
+    Background job finishing a stored document: text, keypoints, lab values and the
+    thumbnail/screen-size derivatives of the image. The caller registers the job with
+    get_report_scheduler().document_job_started(scope) before starting it, so report
+    triggers wait for it and a report is generated automatically once the patient's
+    documents are all processed.
+    """
+    result = {"success": False}
+    progress = progress or UploadProgress(image_id)
+    try:
+        with openai_priority(Priority.BACKGROUND):
+            result = await _process_image_properly(image_id, image_bytes, content_type, doc_type, scope,
+                                                   extraction, progress, file_name)
+        if result.get("success"):
+            await progress.stage("saved")
+        else:
+            await progress.stage("failed", error=result.get("error"))
+        return result
+    finally:
+        get_report_scheduler().document_job_finished(scope, changed=bool(result.get("success")))
+
+
+async def _process_image_properly(image_id: str, image_bytes: Optional[bytes], content_type: Optional[str], doc_type: str,
+                                  scope: PatientScope, extraction: Optional[asyncio.Task],
+                                  progress: UploadProgress, file_name: Optional[str] = None):
+    derivatives = None
+    await ensure_llm_sdks()
     try:
         if image_bytes is None:
             # Handle "Not Available" case for the given doc_type
@@ -183,52 +347,159 @@ async def process_image_properly(image_id: str, image_bytes: Optional[bytes], co
 
             print(
                 f"Processing image_id {image_id} ({doc_type}) as 'Not Available' in background.")
-            update_file_data(image_id, not_available_text,
-                             not_available_keypoints)
+            await asyncio.to_thread(update_file_data, image_id, not_available_text,
+                                    not_available_keypoints,
+                                    patient_id=scope.patient_id, tenant_id=scope.tenant_id)
             print(
                 f"Updated image_id {image_id} with 'Not Available' status for {doc_type}.")
             return {"success": True, "message": f"{doc_type} processed as 'Not Available'."}
 
-        # Step 1: Extract text and keypoints
-        start_extract_time = time.time()
-        result = await extract_text_and_keypoints_properly(image_bytes, content_type, doc_type)
-        extract_time = time.time() - start_extract_time
-        print(
-            f"Time to extract text and keypoints: {extract_time:.2f} seconds")
+        # The derivatives render in the process pool while the extraction waits on the APIs
+        derivatives = asyncio.create_task(
+            store_derivatives(image_id, image_bytes, file_name, scope, progress))
+
+        # Step 1: Extract text and keypoints (or finish the speculative extraction started at upload)
+        with timed("background.extract"):
+            if extraction is not None:
+                result = await extraction
+            else:
+                result = await extract_text_and_keypoints_properly(image_bytes, content_type, doc_type, progress)
 
         if isinstance(result, tuple):
-            text, keypoints = result
+            from utils.near_duplicates import minhash_signature  # NumPy is imported on first use
 
-            # Measure time for save_to_supabase
-            start_save_time = time.time()
-            update_file_data(image_id, text, keypoints)
-            save_time = time.time() - start_save_time
-            print(f"Time to save to Supabase: {save_time:.2f} seconds")
+            text, keypoints, clarity_score = result
+            # The fingerprint lets report building drop near-duplicate uploads of this document
+            await asyncio.to_thread(update_file_data, image_id, text, keypoints,
+                                    minhash=minhash_signature(text) if text else None,
+                                    clarity_score=clarity_score,
+                                    patient_id=scope.patient_id, tenant_id=scope.tenant_id)
 
+            if doc_type == "Lab Report" and text:
+                with timed("background.lab_values"):
+                    await extract_and_store_lab_values(image_id, text, scope)
+                await progress.stage("lab_values_done")
+
+            await derivatives
             return {"success": True}
         else:
+            await _cancel_task(derivatives)
             accepted = result.get("accepted")
             error = result.get("error")
             return {"success": accepted, "error": error}
     except Exception as e:
-        print(f"Error in process_image_properly: {str(e)}")
+        await _cancel_task(derivatives)
+        print(f"[{current_trace_id()}] Error in process_image_properly: {str(e)}")
         return {"success": False, "error": str(e)}
 
 
-async def generate_combined_medical_summary_md(all_texts_concatenated: str) -> str:
+async def store_derivatives(image_id: str, image_bytes: bytes, file_name: Optional[str],
+                            scope: PatientScope, progress: UploadProgress):
+    """
+    Renders the thumbnail and screen-size WebP derivatives, stores them next to the
+    original and records their URLs. A failure only costs the smaller previews: the
+    dashboard and the report fall back to the original.
+    """
+    try:
+        rendered = await create_derivatives(image_bytes)
+        urls = await asyncio.to_thread(
+            upload_derivatives, image_id, file_name, rendered, DERIVATIVE_CONTENT_TYPE,
+            patient_id=scope.patient_id, tenant_id=scope.tenant_id)
+        await asyncio.to_thread(
+            update_file_previews, image_id, urls.get("thumbnail"), urls.get("screen"),
+            patient_id=scope.patient_id, tenant_id=scope.tenant_id)
+        await progress.stage("derivatives_done", bytes={tier: len(data) for tier, data in rendered.items()})
+    except Exception as e:
+        print(f"[{current_trace_id()}] Error creating image derivatives for {image_id}: {str(e)}")
+
+
+async def extract_and_store_lab_values(image_id: str, text: str, scope: PatientScope):
+    """Extracts the numeric results of a lab report into the patient's lab value store."""
+    llm = get_classifier_llm()
+    if llm is None:
+        return
+    try:
+        values = await extract_lab_values(text, llm)
+        await asyncio.to_thread(
+            replace_lab_values, image_id, values, date.today().isoformat(),
+            patient_id=scope.patient_id, tenant_id=scope.tenant_id)
+        get_lab_store().invalidate(scope.patient_id, scope.tenant_id)
+        print(f"Stored {len(values)} lab values for image_id {image_id}.")
+    except Exception as e:
+        print(f"[{current_trace_id()}] Error extracting lab values: {str(e)}")
+
+
+# Tokens of the report instructions around the documents
+REPORT_INSTRUCTION_TOKENS = 800
+# Report model when model_cascade.json has no llm.report policy
+REPORT_MODEL = "gpt-4o"
+# Stream the report and save a draft after every completed section (REPORT_STREAMING=0
+# waits for the complete report instead)
+REPORT_STREAMING = os.getenv("REPORT_STREAMING", "1") == "1"
+# Documents are condensed in chunks that fit the classifier chains' default call budget
+CONDENSE_CHUNK_TOKENS = 12000
+
+
+async def condense_medical_texts(all_texts_concatenated: str, max_tokens: int) -> str:
+    """
+    Condenses the combined documents to about `max_tokens` with gpt-4o-mini, chunk by chunk,
+    when they do not fit into the report prompt's token budget.
+    """
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import StrOutputParser
+
+    llm = get_classifier_llm()
+    if llm is None:
+        return all_texts_concatenated
+    chunks = split_by_tokens(all_texts_concatenated, CONDENSE_CHUNK_TOKENS)
+    total = sum(count_tokens(chunk) for chunk in chunks)
+    prompt = ChatPromptTemplate.from_template("""Condense the following medical documents to at most {max_tokens} tokens.
+Keep every diagnosis, medication with dosage, lab value with unit and reference range, procedure, date and recommendation.
+Keep the 'Document type:' and 'Reference: [(<number>)](url)' lines and the reference list exactly as they are.
+Drop repetitions, boilerplate, addresses and OCR noise.
+
+Text:
+{text}""")
+
+    async def condense(chunk: str) -> str:
+        share = max(200, max_tokens * count_tokens(chunk) // max(total, 1))
+        chain = prompt | llm.bind(max_tokens=share) | StrOutputParser()
+        return await invoke_chain_timed("llm.report_condense", chain, {"text": chunk, "max_tokens": share})
+
+    return "\n\n".join(await asyncio.gather(*(condense(chunk) for chunk in chunks)))
+
+
+async def generate_combined_medical_summary_md(all_texts_concatenated: str, on_draft=None) -> str:
     """
     Generates a comprehensive medical summary in Markdown format from combined medical texts
-    using an LLM.
+    using an LLM. Documents that do not fit the llm.report token budget are condensed first.
+    With `on_draft`, the report is streamed and `await on_draft(draft, sections)` is called
+    with the cleaned text of the completed sections whenever another section is complete.
+    Returns the cleaned report.
     """
+    from langchain_openai import ChatOpenAI  # Imported on first use to keep startup fast
+
     # print(
     # f"Generating comprehensive medical summary from: {all_texts_concatenated}")
+    load_env()
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
         print("Warning: OPENAI_API_KEY environment variable not set. LLM calls may fail.")
         # Consider returning an error or using a mock response if the API key is critical and missing.
         # For now, Langchain will raise an error if the key is missing and required by the model.
 
-    llm = ChatOpenAI(model_name="gpt-4o", openai_api_key=api_key)
+    # Short reports over a few documents are written by the cheaper tier of the cascade
+    policy = get_policy("llm.report", REPORT_MODEL)
+    model = policy.tiers[first_tier("llm.report", policy, count_tokens(all_texts_concatenated, REPORT_MODEL),
+                                    documents=all_texts_concatenated.count("Document type:"))]
+    llm = ChatOpenAI(model_name=model, openai_api_key=api_key,
+                     callbacks=[get_token_usage_callback()],
+                     http_async_client=get_openai_http_client(),
+                     stream_usage=True)  # Streamed responses report their token usage too
+
+    all_texts_concatenated = await fit_prompt(
+        "llm.report", all_texts_concatenated, overhead_tokens=REPORT_INSTRUCTION_TOKENS,
+        summarize=condense_medical_texts, model=model)
 
     prompt = f"""You are a helpful medical assistant AI.
 Analyze the following combined medical texts from multiple documents and generate a comprehensive medical summary in Markdown format.
@@ -269,67 +540,176 @@ Combined Medical Texts:
 Comprehensive Medical Summary (Markdown):
 """
     try:
-        response = await llm.ainvoke(prompt)
-        if hasattr(response, 'content'):
-            print(f"Generated summary: {response.content}")
-            return response.content
-        else:
-            # Fallback for different response structures
-            return str(response)
+        with timed("llm.report", provider="openai"):
+            if on_draft is None:
+                response = await llm.ainvoke(prompt)
+                record_answer("llm.report", model)
+                # Fallback for different response structures
+                return clean_report(response.content if hasattr(response, 'content') else str(response))
+            stream = ReportStream()
+            async for chunk in llm.astream(prompt):
+                draft = stream.feed(chunk.content if isinstance(chunk.content, str) else "")
+                if draft is not None:
+                    await on_draft(draft, stream.sections)
+            record_answer("llm.report", model)
+            return stream.finish()
     except Exception as e:
-        print(f"Error during LLM call for summary: {str(e)}")
+        print(f"[{current_trace_id()}] Error during LLM call for summary: {str(e)}")
         raise
 
 
 @router.get("/trigger-report-generation")
-async def trigger_comprehensive_report_generation():
-    all_texts_concatenated = get_all_image_data_for_reprocessing()
-    if not all_texts_concatenated:
-        return {"success": False, "error": "No texts to process"}
-
-    # Create a task that generates the comprehensive report
-    asyncio.create_task(
-        generate_save_report(all_texts_concatenated))
+async def trigger_comprehensive_report_generation(scope: PatientScope = Depends(get_patient_scope)):
+    # Concurrent triggers for the same patient share one run; while documents are still
+    # being processed the run starts once they are done. Progress and the new report
+    # version are pushed to the patient's /events streams.
+    outcome = get_report_scheduler().trigger(scope)
+    if outcome != "joined":
+        await publish_event(scope.patient_id, scope.tenant_id, "report.progress", {"stage": "queued"})
 
     # Return immediately while processing continues in background
-    return {"success": True, "result": "Report generation started in background. The results will be available to the doctor shortly."}
+    return {"success": True, "status": outcome,
+            "result": "Report generation started in background. The results will be available to the doctor shortly."}
 
 
 @router.get("/get-report")
-async def get_grandma_report():
-    report = get_grandma_report_db()
-    if not report:
+async def get_grandma_report(request: Request, scope: PatientScope = Depends(get_patient_scope)):
+    """
+    Returns the patient's latest report. The version ID doubles as ETag, so clients that
+    re-fetch after a report.version event can send If-None-Match and get a 304 when
+    they already have that version.
+    While a new report is being generated, its completed sections are returned with
+    "partial": true (report.progress "section" events announce new drafts).
+    """
+    version = await asyncio.to_thread(
+        get_latest_report, patient_id=scope.patient_id, tenant_id=scope.tenant_id, include_partial=True)
+    if not version or not version.get("text"):
         return {"success": False, "error": "No report found"}
 
-    return {"success": True, "report": report}
+    partial = version.get("status") == REPORT_PARTIAL
+    # A draft grows under the same version ID
+    etag = f'"{version["id"]}-{len(version["text"])}"' if partial else f'"{version["id"]}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return JSONResponse(
+        {"success": True, "report": version["text"], "version_id": version["id"],
+         "created_at": version.get("created_at"), "partial": partial},
+        headers={"ETag": etag})
 
 
-async def generate_save_report(all_texts_concatenated: str):
+@router.get("/keypoints")
+async def get_keypoints(category: Optional[KeyPointCategory] = None, key: Optional[str] = None,
+                        scope: PatientScope = Depends(get_patient_scope)):
+    """
+    Lists the patient's structured keypoints across documents, optionally filtered by
+    category (e.g. /keypoints?category=medication) and key.
+    """
+    keypoints = await asyncio.to_thread(
+        get_patient_keypoints, category=category, key=key,
+        patient_id=scope.patient_id, tenant_id=scope.tenant_id)
+    return {"success": True, "keypoints": keypoints}
+
+
+@lru_cache(maxsize=1)
+def get_report_scheduler() -> ReportScheduler:
+    return ReportScheduler(
+        generate_save_report,
+        debounce_seconds=float(os.getenv("REPORT_DEBOUNCE_SECONDS", "5")),
+        auto_trigger=os.getenv("REPORT_AUTO_TRIGGER", "1") == "1")
+
+
+async def generate_save_report(scope: PatientScope):
+    with openai_priority(Priority.REPORT):
+        await _generate_save_report(scope)
+
+
+async def _generate_save_report(scope: PatientScope):
+    async def progress(stage: str, **data):
+        await publish_event(scope.patient_id, scope.tenant_id, "report.progress", {"stage": stage, **data})
+
+    await ensure_llm_sdks()
+    # Drafts and the final report are saved as one version
+    version_id = str(uuid.uuid4())
+    created_at = datetime.now(timezone.utc).isoformat()
+    draft_saved = False
+    draft_write: Optional[asyncio.Task] = None
+    completed = False
+
+    async def write_draft(draft: str):
+        nonlocal draft_saved
+        await asyncio.to_thread(
+            save_grandma_report, draft, patient_id=scope.patient_id, tenant_id=scope.tenant_id,
+            status=REPORT_PARTIAL, version_id=version_id, created_at=created_at)
+        draft_saved = True
+
+    async def save_draft(draft: str, sections: int):
+        nonlocal draft_write
+        # Shielded: a draft stored after the run was cancelled must still be seen by discard_draft
+        draft_write = asyncio.ensure_future(write_draft(draft))
+        try:
+            await asyncio.shield(draft_write)
+        except Exception as e:
+            # The final save still has the whole report
+            print(f"[{current_trace_id()}] Could not save report draft: {str(e)}")
+            return
+        await progress("section", sections=sections, version_id=version_id)
+
+    async def discard_draft():
+        """Marks a saved draft failed, so /get-report goes back to the previous complete report."""
+        nonlocal draft_saved
+        if draft_write is not None:
+            await asyncio.wait({draft_write})
+        if not draft_saved:
+            return
+        draft_saved = False
+        try:
+            await asyncio.to_thread(
+                save_grandma_report, "", patient_id=scope.patient_id, tenant_id=scope.tenant_id,
+                status=REPORT_FAILED, version_id=version_id, created_at=created_at)
+        except Exception as save_error:
+            print(f"[{current_trace_id()}] Could not mark report draft as failed: {str(save_error)}")
+
     try:
-        if not all_texts_concatenated.strip():
+        # Read the documents when the run starts, so it covers everything processed so far
+        all_texts_concatenated = await asyncio.to_thread(
+            get_all_image_data_for_reprocessing,
+            patient_id=scope.patient_id, tenant_id=scope.tenant_id)
+        if not isinstance(all_texts_concatenated, str) or not all_texts_concatenated.strip():
             print("Warning: No texts to process. Skipping report generation.")
+            await progress("failed", error="No texts to process")
             return
-        report = await generate_combined_medical_summary_md(all_texts_concatenated.strip())
+        await progress("generating")
+        with timed("report.generate"):
+            report = await generate_combined_medical_summary_md(
+                all_texts_concatenated.strip(), on_draft=save_draft if REPORT_STREAMING else None)
         if not report:
-            print("Warning: No report generated. Skipping save.")
-            return
-        report = clean_report(report)
-        save_grandma_report(report)
+            raise ValueError("No report generated")
+        await progress("saving")
+        version = await asyncio.to_thread(
+            save_grandma_report, report, patient_id=scope.patient_id, tenant_id=scope.tenant_id,
+            status=REPORT_COMPLETE, version_id=version_id, created_at=created_at)
+        completed = True
+        await publish_event(scope.patient_id, scope.tenant_id, "report.version", {
+            "version_id": version["id"], "created_at": version["created_at"]})
     except Exception as e:
-        print(f"Error in generate_save_report: {str(e)}")
+        print(f"[{current_trace_id()}] Error in generate_save_report: {str(e)}")
+        await discard_draft()
+        await progress("failed", error=str(e))
+    finally:
+        # Also reached when the run is cancelled, e.g. superseded by a newer one
+        if not completed:
+            await asyncio.shield(discard_draft())
 
 
 def clean_report(report: str) -> str:
-    report = report.strip()
-    if report.startswith("```markdown"):
-        report = report[len("```markdown"):].strip()
-    if report.endswith("```"):
-        report = report[:-len("```")]
-    return report
+    """Strips a code fence around the complete report."""
+    stream = ReportStream()
+    stream.feed(report)
+    return stream.finish()
 
 
 MODEL = "gpt-4o-mini-realtime-preview"
-BASE_URL = "https://api.openai.com/v1/realtime"
+BASE_URL = f"{os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')}/realtime"
 # Replace with your actual VOICE config or import it
 VOICE = "coral"
 
@@ -347,8 +727,9 @@ async def get_realtime_session():
             "voice": VOICE,
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(f"{BASE_URL}/sessions", json=payload, headers=headers)
+        with timed("llm.realtime_session", provider="openai"):
+            response = await get_openai_http_client().post(
+                f"{BASE_URL}/sessions", json=payload, headers=headers)
 
         return Response(content=response.content, media_type="application/json", status_code=status.HTTP_200_OK)
 
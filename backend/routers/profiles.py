@@ -0,0 +1,33 @@
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import FileResponse
+
+from utils.profiling import ADMIN_TOKEN, list_profiles, profile_path
+
+profiles_router = APIRouter()
+
+
+def _check_admin(token: Optional[str]):
+    # Without PROFILING_ADMIN_TOKEN the endpoints do not exist
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not found")
+    if token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+
+@profiles_router.get("/admin/profiles")
+async def get_profiles(x_admin_token: Optional[str] = Header(None)):
+    """Lists the stored request profiles (utils/profiling.py), newest first."""
+    _check_admin(x_admin_token)
+    return {"profiles": list_profiles()}
+
+
+@profiles_router.get("/admin/profiles/{profile_id}")
+async def get_profile(profile_id: str, x_admin_token: Optional[str] = Header(None)):
+    """Downloads one profile as a speedscope file."""
+    _check_admin(x_admin_token)
+    path = profile_path(profile_id)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return FileResponse(path, media_type="application/json", filename=path.name)
@@ -38,7 +38,11 @@ async def main():
     image_format = f"image/{image_path.split('.')[-1].lower()}"
     
     # Extract text from the image
-    result = extract_text_from_image(image_bytes, image_format)
+    try:
+        result = await extract_text_from_image(image_bytes, image_format)
+    except Exception as e:
+        print(f"Error: {str(e)}")
+        return
     
     print(f"Extracted Text:\n{result}")
 
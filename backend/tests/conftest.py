@@ -0,0 +1,13 @@
+import pytest
+
+from utils.loop_monitor import install_blocking_guards
+
+
+@pytest.fixture(scope="session", autouse=True)
+def strict_event_loop():
+    """
+    Runs the tests in strict mode (as LOOP_STRICT=1 does for the app): time.sleep and sync
+    HTTP clients raise BlockingCallError on an event loop thread. The guards stay
+    installed for the session.
+    """
+    install_blocking_guards()
@@ -0,0 +1,143 @@
+from datetime import date
+
+import pytest
+
+from utils.card_layout import (
+    CardParseError, extract_card_keypoints, group_lines, insurance_number_valid, parse_date,
+    parse_vaccination_card)
+from utils.ocr import OcrWord
+
+CHAR_WIDTH = 0.012
+LINE_HEIGHT = 0.03
+
+
+def line(top: float, *cells: tuple[float, str]) -> list[OcrWord]:
+    """Word boxes of one printed line; each cell is (left, text) and its words are laid out left to right."""
+    words = []
+    for left, text in cells:
+        for part in text.split():
+            right = left + len(part) * CHAR_WIDTH
+            words.append(OcrWord(part, left, top, right, top + LINE_HEIGHT))
+            left = right + CHAR_WIDTH
+    return words
+
+
+def page(*lines: list[OcrWord]) -> list[OcrWord]:
+    # OCR backends do not report words in reading order
+    return [word for words in reversed(lines) for word in words]
+
+
+def keypoints_by_key(keypoints: list[dict]) -> dict:
+    return {keypoint["key"]: keypoint["value"] for keypoint in keypoints}
+
+
+@pytest.mark.parametrize("number, valid", [
+    ("A123456780", True),
+    ("A123456781", False),   # wrong check digit
+    ("B123456780", False),   # the letter is part of the check
+    ("A12345678", False),    # too short
+    ("a123456780", False),
+])
+def test_insurance_number_check_digit(number, valid):
+    assert insurance_number_valid(number) is valid
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("12.03.2024", "2024-03-12"),
+    ("Gültig bis 12/28", "2028-12"),
+    ("31.02.2024", None),
+    ("keine Angabe", None),
+])
+def test_parse_date(value, expected):
+    assert parse_date(value) == expected
+
+
+def test_egk_front_is_read_by_position():
+    words = page(
+        line(0.10, (0.05, "AOK Bayern")),
+        line(0.55, (0.05, "Erika")),
+        line(0.59, (0.05, "Mustermann")),
+        line(0.63, (0.05, "A123456780")),
+    )
+
+    keypoints = keypoints_by_key(extract_card_keypoints("Insurance Card", words))
+
+    assert keypoints == {"Insurer": "AOK Bayern", "Insured Name": "Erika Mustermann",
+                         "Versichertennummer": "A123456780"}
+
+
+def test_ehic_back_is_read_from_labels():
+    words = page(
+        line(0.10, (0.05, "3 Name"), (0.30, "Mustermann")),
+        line(0.15, (0.05, "4 Vornamen"), (0.30, "Erika")),
+        line(0.20, (0.05, "6 Persönliche Kennnummer"), (0.50, "A123456780")),
+        line(0.25, (0.05, "7 Kennnummer des Trägers"), (0.50, "108310400 - AOK Bayern")),
+        line(0.30, (0.05, "9 Ablaufdatum"), (0.50, "31.12.2029")),
+    )
+
+    keypoints = keypoints_by_key(extract_card_keypoints("Insurance Card", words))
+
+    assert keypoints["Insurer"] == "AOK Bayern"
+    assert keypoints["Insured Name"] == "Erika Mustermann"
+    assert keypoints["Valid Until"] == "31.12.2029"
+
+
+def test_card_with_a_misread_number_falls_back_to_the_llm():
+    words = page(
+        line(0.10, (0.05, "AOK Bayern")),
+        line(0.55, (0.05, "Erika Mustermann")),
+        line(0.59, (0.05, "A123456781")),
+    )
+
+    assert extract_card_keypoints("Insurance Card", words) is None
+
+
+def test_no_layout_falls_back_to_the_llm():
+    assert extract_card_keypoints("Vaccination Card", []) is None
+    assert extract_card_keypoints("Lab Report", page(line(0.1, (0.05, "Datum")))) is None
+
+
+def vaccination_table(*rows: list[OcrWord]) -> list[OcrWord]:
+    header = [
+        line(0.10, (0.05, "Datum"), (0.25, "Impfstoff /"), (0.55, "Chargen-"), (0.75, "Stempel")),
+        line(0.135, (0.25, "Handelsname"), (0.55, "Nr.")),
+    ]
+    return page(*header, *rows)
+
+
+def test_vaccination_table_rows_become_keypoints():
+    words = vaccination_table(
+        line(0.20, (0.05, "12.03.2021"), (0.25, "Comirnaty"), (0.55, "EW2243"), (0.75, "Dr. Weber")),
+        line(0.25, (0.05, "03.05.2021"), (0.25, "Comirnaty"), (0.55, "FA4597")),
+        # Wrapped vaccine name
+        line(0.30, (0.05, "20.10.2022"), (0.25, "Boostrix"), (0.55, "AC37B150AE")),
+        line(0.335, (0.25, "Polio")),
+        # Header repeated on the next page of the booklet
+        line(0.45, (0.05, "Datum"), (0.25, "Impfstoff"), (0.55, "Charge")),
+        line(0.50, (0.05, "01.11.23"), (0.25, "Efluelda"), (0.55, "Ch.-B.: X58A1")),
+    )
+
+    keypoints = parse_vaccination_card(group_lines(words))
+
+    assert [keypoint["value"] for keypoint in keypoints] == [
+        "Comirnaty, 12.03.2021, batch EW2243",
+        "Comirnaty, 03.05.2021, batch FA4597",
+        "Boostrix Polio, 20.10.2022, batch AC37B150AE",
+        "Efluelda, 01.11.23, batch X58A1",
+    ]
+    assert {keypoint["category"] for keypoint in keypoints} == {"vaccination"}
+
+
+@pytest.mark.parametrize("row, reason", [
+    (line(0.20, (0.05, f"12.03.{date.today().year + 1}"), (0.25, "Comirnaty"), (0.55, "EW2243")), "future"),
+    (line(0.20, (0.05, "12.03.2021"), (0.55, "EW2243")), "no vaccine"),
+    (line(0.20, (0.05, "12.03.2021"), (0.25, "Comirnaty"), (0.55, "siehe oben")), "not a batch number"),
+])
+def test_implausible_vaccination_rows_fail_validation(row, reason):
+    with pytest.raises(CardParseError, match=reason):
+        parse_vaccination_card(group_lines(vaccination_table(row)))
+
+
+def test_page_without_a_table_header_fails_validation():
+    with pytest.raises(CardParseError, match="no vaccination table header"):
+        parse_vaccination_card(group_lines(page(line(0.1, (0.05, "Internationale Bescheinigungen")))))
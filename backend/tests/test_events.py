@@ -0,0 +1,84 @@
+import asyncio
+import fnmatch
+import sys
+import types
+
+import pytest
+
+from utils.events import RedisEventBroker, upload_channel
+
+
+class FakePubSub:
+    def __init__(self, redis: "FakeRedis"):
+        self.redis = redis
+        self.messages: asyncio.Queue = asyncio.Queue()
+        self.patterns = []
+
+    async def psubscribe(self, pattern: str):
+        # Redis confirms the subscription asynchronously; publishes before that are not received
+        async def confirm():
+            await asyncio.sleep(self.redis.confirm_delay)
+            self.patterns.append(pattern)
+            self.messages.put_nowait({"type": "psubscribe", "pattern": pattern, "channel": pattern, "data": 1})
+        asyncio.ensure_future(confirm())
+
+    async def listen(self):
+        while True:
+            yield await self.messages.get()
+
+
+class FakeRedis:
+    def __init__(self, confirm_delay: float):
+        self.confirm_delay = confirm_delay
+        self.pubsubs = []
+
+    def pubsub(self) -> FakePubSub:
+        pubsub = FakePubSub(self)
+        self.pubsubs.append(pubsub)
+        return pubsub
+
+    async def publish(self, channel: str, data: str):
+        for pubsub in self.pubsubs:
+            for pattern in pubsub.patterns:
+                if fnmatch.fnmatchcase(channel, pattern):
+                    pubsub.messages.put_nowait({"type": "pmessage", "pattern": pattern,
+                                                "channel": channel.encode(), "data": data})
+
+
+@pytest.fixture
+def fake_redis(monkeypatch):
+    redis = FakeRedis(confirm_delay=0.05)
+    module = types.ModuleType("redis.asyncio")
+    module.from_url = lambda url: redis
+    package = types.ModuleType("redis")
+    package.asyncio = module
+    monkeypatch.setitem(sys.modules, "redis", package)
+    monkeypatch.setitem(sys.modules, "redis.asyncio", module)
+    return redis
+
+
+def test_upload_events_before_the_first_subscriber_are_replayed(fake_redis):
+    async def scenario():
+        broker = RedisEventBroker("redis://fake")
+        await broker.start()
+        # Published by any worker while nobody watches this upload yet
+        await broker.publish(upload_channel("img-1"), {"type": "upload.progress", "data": {"stage": "ocr_done"}})
+        await asyncio.sleep(0.01)
+        async with broker.subscribe(upload_channel("img-1")) as queue:
+            event = await asyncio.wait_for(queue.get(), timeout=1)
+        await broker.close()
+        return event
+
+    assert asyncio.run(scenario())["data"] == {"stage": "ocr_done"}
+
+
+def test_subscriber_waits_for_the_subscription(fake_redis):
+    async def scenario():
+        broker = RedisEventBroker("redis://fake")
+        async with broker.subscribe(upload_channel("img-2")) as queue:
+            await broker.publish(upload_channel("img-2"), {"type": "upload.progress", "data": {"stage": "saved"}})
+            event = await asyncio.wait_for(queue.get(), timeout=1)
+        await broker.close()
+        return event
+
+    assert asyncio.run(scenario())["data"] == {"stage": "saved"}
@@ -0,0 +1,103 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from utils.lab_values import UNCONVERTED_ROWS, build_lab_series, normalize_unit
+
+
+def _row(analyte, value, unit, collected_on, low=None, high=None, file_id="file-1"):
+    return {"analyte": analyte, "value": value, "unit": unit, "collected_on": collected_on,
+            "reference_low": low, "reference_high": high, "file_id": file_id}
+
+
+@pytest.mark.parametrize("unit, expected", [
+    ("×10³/µl", "10^3/ul"),
+    ("x10^9/L", "10^9/l"),
+    ("10⁹/l", "10^9/l"),
+    ("Tsd/µl", "10^3/ul"),
+    ("Gpt/l", "10^9/l"),
+    ("/mm³", "/ul"),
+    ("µmol/L", "umol/l"),
+    (None, ""),
+])
+def test_normalize_unit(unit, expected):
+    assert normalize_unit(unit) == expected
+
+
+def test_count_units_with_superscripts_and_aliases_are_converted():
+    series = build_lab_series([
+        _row("Leukozyten", 6.1, "×10³/µl", "2025-01-10"),
+        _row("Leukozyten", 7.2, "Tsd/µl", "2025-02-10"),
+        _row("Leukozyten", 8.3, "Gpt/l", "2025-03-10"),
+        _row("Leukozyten", 9400, "/mm³", "2025-04-10"),
+    ])["leukocytes"]
+
+    assert series.unit == "10^9/l"
+    assert [point["value"] for point in series.to_points()] == [6.1, 7.2, 8.3, 9.4]
+
+
+def test_affine_conversion_of_hba1c_from_mmol_per_mol():
+    series = build_lab_series([
+        _row("HbA1c", 6.5, "%", "2025-01-10"),
+        _row("HbA1c", 48, "mmol/mol", "2025-04-10"),
+    ])["hba1c"]
+
+    points = series.to_points()
+    assert series.unit == "%"
+    assert points[0]["value"] == 6.5
+    # IFCC -> NGSP: % = 0.0915 * mmol/mol + 2.15
+    assert points[1]["value"] == pytest.approx(48 * 0.0915 + 2.15, abs=1e-4)
+    assert (points[1]["raw_value"], points[1]["raw_unit"]) == (48.0, "mmol/mol")
+
+
+def test_reference_ranges_are_converted_and_values_flagged():
+    series = build_lab_series([
+        _row("Kreatinin", 0.4, "mg/dL", "2025-01-10", low=0.5, high=1.1),
+        _row("Kreatinin", 88.42, "µmol/l", "2025-02-10", low=44.21, high=97.26),
+        _row("Kreatinin", 132.6, "µmol/l", "2025-03-10", low=44.21, high=97.26),
+        _row("Kreatinin", 1.0, "mg/dL", "2025-04-10"),
+    ])["creatinine"]
+
+    points = series.to_points()
+    assert [point["flag"] for point in points] == ["low", "normal", "high", None]
+    assert points[1]["reference_low"] == pytest.approx(0.5, abs=1e-3)
+    assert points[1]["reference_high"] == pytest.approx(1.1, abs=1e-3)
+    assert points[2]["value"] == pytest.approx(1.5, abs=1e-3)
+
+
+def test_unknown_units_give_no_value_and_are_counted():
+    before = UNCONVERTED_ROWS.value()
+
+    series = build_lab_series([
+        _row("Kreatinin", 1.0, "mg/dL", "2025-01-10", low=0.5, high=1.1),
+        _row("Kreatinin", 3.0, "furlongs", "2025-02-10", low=0.5, high=1.1),
+    ])["creatinine"]
+
+    points = series.to_points()
+    assert points[1]["value"] is None
+    assert points[1]["flag"] is None
+    assert points[1]["raw_unit"] == "furlongs"
+    assert np.isnan(series.values[1])
+    assert UNCONVERTED_ROWS.value() == before + 1
+
+
+def test_window_and_latest():
+    series = build_lab_series([
+        _row("Hb", 12.1, "g/dl", "2025-03-01"),
+        _row("Hb", 11.5, "g/dl", "2025-01-01"),
+        _row("Hb", 12.8, "g/dl", "2025-05-01"),
+        _row("Hb", 13.0, "g/dl", "2025-07-01"),
+    ])["hemoglobin"]
+
+    def dates(points):
+        return [point["date"] for point in points]
+
+    assert dates(series.to_points()) == ["2025-01-01", "2025-03-01", "2025-05-01", "2025-07-01"]
+    # Both bounds are inclusive
+    assert dates(series.to_points(since=date(2025, 3, 1), until=date(2025, 5, 1))) == ["2025-03-01", "2025-05-01"]
+    assert dates(series.to_points(since=date(2025, 4, 1))) == ["2025-05-01", "2025-07-01"]
+    assert dates(series.to_points(until=date(2024, 12, 31))) == []
+    assert series.window(since=date(2025, 2, 1)) == slice(1, 4)
+    assert series.latest() == series.to_points()[-1]
+    assert series.latest()["value"] == 13.0
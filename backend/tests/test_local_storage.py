@@ -0,0 +1,103 @@
+import pytest
+
+from database import supabase_client
+from database.local_storage import LocalStorage
+from database.storage import REPORT_COMPLETE, REPORT_FAILED, REPORT_PARTIAL, StorageBackend
+from database.supabase_client import (
+    find_files_by_keypoint, get_latest_report, insert_file_record, save_grandma_report, update_file_data,
+    update_file_previews)
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    """The application's storage functions running on the embedded backend in a temp dir."""
+    storage = LocalStorage(root=str(tmp_path), public_url="http://test/files")
+    monkeypatch.setattr(supabase_client, "get_storage", lambda: storage)
+    supabase_client.get_file_write_buffer.cache_clear()
+    yield storage
+    supabase_client.get_file_write_buffer.cache_clear()
+
+
+def _insert(image_id, keypoints=None, patient_id="grandma", file_name=None):
+    insert_file_record(
+        image_id, {"file_path": f"default/{patient_id}/{image_id}.jpg", "preview_url": f"http://test/{image_id}.jpg"},
+        file_name or f"{image_id}.jpg", "image/jpeg", 1234, "original text", keypoints or [], "Lab Report",
+        patient_id=patient_id)
+
+
+def _file(storage, image_id, patient_id="grandma"):
+    columns = ("id", "file_name", "text", "keypoints", "doc_type", "minhash", "clarity_score",
+               "thumbnail_url", "screen_url")
+    return next(row for row in storage.select_files("default", patient_id, columns) if row["id"] == image_id)
+
+
+def test_storage_backend_is_abstract():
+    with pytest.raises(TypeError):
+        StorageBackend()
+
+
+def test_partial_updates_keep_the_other_columns(storage):
+    _insert("doc-1", keypoints=[{"key": "Old", "value": "1", "category": "diagnosis"}])
+
+    update_file_data("doc-1", "new text", [{"key": "Metformin", "value": "500 mg", "category": "medication"}],
+                     minhash=[1, 2, 3], clarity_score=0.8)
+    update_file_previews("doc-1", "http://test/thumb.webp", "http://test/screen.webp")
+
+    row = _file(storage, "doc-1")
+    assert row["file_name"] == "doc-1.jpg"
+    assert row["doc_type"] == "Lab Report"
+    assert row["text"] == "new text"
+    assert row["keypoints"] == [{"key": "Metformin", "value": "500 mg", "category": "medication"}]
+    assert row["minhash"] == [1, 2, 3]
+    assert row["clarity_score"] == 0.8
+    assert (row["thumbnail_url"], row["screen_url"]) == ("http://test/thumb.webp", "http://test/screen.webp")
+
+
+def test_updates_never_touch_another_patients_row(storage):
+    _insert("doc-1")
+
+    update_file_data("doc-1", "overwritten", [], patient_id="someone-else")
+
+    assert _file(storage, "doc-1")["text"] == "original text"
+
+
+def test_keypoint_filter_matches_within_one_keypoint(storage):
+    metformin = {"key": "Metformin", "value": "500 mg", "category": "medication"}
+    _insert("doc-1", keypoints=[metformin, {"key": "Diabetes", "value": "Typ 2", "category": "diagnosis"}])
+    # Has the category and the key, but in different keypoints
+    _insert("doc-2", keypoints=[{"key": "Ramipril", "value": "5 mg", "category": "medication"},
+                                {"key": "Metformin", "value": "mentioned", "category": "history"}])
+    _insert("doc-3", keypoints=[metformin])
+    _insert("doc-4", keypoints=[metformin], patient_id="someone-else")
+
+    def ids(**needle):
+        return [row["id"] for row in find_files_by_keypoint(**needle)]
+
+    assert ids(category="medication", key="Metformin") == ["doc-1", "doc-3"]
+    assert ids(category="medication") == ["doc-1", "doc-2", "doc-3"]
+    assert ids(key="Metformin", value="mentioned") == ["doc-2"]
+    assert ids(category="allergy") == []
+    assert ids() == ["doc-1", "doc-2", "doc-3"]
+    assert find_files_by_keypoint(category="medication", key="Metformin")[0]["keypoints"][0] == metformin
+
+
+def test_latest_report_with_and_without_drafts(storage):
+    assert get_latest_report() is None
+
+    save_grandma_report("v1", version_id="v1", created_at="2025-05-01T10:00:00+00:00")
+    save_grandma_report("v2 section 1", version_id="v2", created_at="2025-05-02T10:00:00+00:00",
+                        status=REPORT_PARTIAL)
+
+    assert get_latest_report()["id"] == "v1"
+    assert get_latest_report(include_partial=True) == {
+        "id": "v2", "text": "v2 section 1", "created_at": "2025-05-02T10:00:00+00:00", "status": REPORT_PARTIAL}
+    # Other patients see nothing
+    assert get_latest_report(patient_id="someone-else", include_partial=True) is None
+
+    save_grandma_report("v2 aborted", version_id="v2", created_at="2025-05-02T10:00:00+00:00",
+                        status=REPORT_FAILED)
+    assert get_latest_report(include_partial=True)["id"] == "v1"
+
+    save_grandma_report("v3", version_id="v3", created_at="2025-05-03T10:00:00+00:00", status=REPORT_COMPLETE)
+    assert get_latest_report()["text"] == "v3"
+    assert get_latest_report(include_partial=True)["id"] == "v3"
@@ -0,0 +1,89 @@
+import asyncio
+import time
+
+import httpx
+import pytest
+
+from utils.loop_monitor import (
+    BLOCKING_CALLS, LOOP_BLOCKED, LOOP_LAG_LAST, BlockingCallError, LoopMonitor, allow_blocking)
+
+
+def test_time_sleep_on_the_loop_raises():
+    async def handler():
+        time.sleep(0.01)
+
+    before = BLOCKING_CALLS.value(api="time.sleep")
+    with pytest.raises(BlockingCallError, match="time.sleep"):
+        asyncio.run(handler())
+    assert BLOCKING_CALLS.value(api="time.sleep") == before + 1
+
+
+def test_sync_http_client_on_the_loop_raises():
+    async def handler():
+        with httpx.Client(transport=httpx.MockTransport(lambda request: httpx.Response(200))) as client:
+            client.get("http://test/")
+
+    with pytest.raises(BlockingCallError, match="httpx.Client.send"):
+        asyncio.run(handler())
+
+
+def test_allow_blocking_lets_deliberate_calls_through():
+    async def handler():
+        with allow_blocking():
+            time.sleep(0.01)
+        # Only for the block
+        with pytest.raises(BlockingCallError):
+            time.sleep(0.01)
+
+    asyncio.run(handler())
+
+
+def test_blocking_calls_off_the_loop_are_allowed():
+    async def handler():
+        await asyncio.to_thread(time.sleep, 0.01)
+
+    asyncio.run(handler())
+    time.sleep(0.01)
+
+
+def test_watchdog_reports_a_stalled_loop(capsys):
+    def hold_the_loop():
+        with allow_blocking():
+            time.sleep(0.3)
+
+    async def run():
+        monitor = LoopMonitor(asyncio.get_running_loop(), interval=0.02, threshold=0.1)
+        try:
+            await asyncio.sleep(0.1)
+            hold_the_loop()
+            # Let the probe run again so the watchdog sees the stall end
+            await asyncio.sleep(0.2)
+        finally:
+            monitor.stop()
+
+    before = LOOP_BLOCKED.value()
+    asyncio.run(run())
+
+    assert LOOP_BLOCKED.value() == before + 1
+    assert LOOP_LAG_LAST.value() < 0.1
+    output = capsys.readouterr().out
+    # The loop thread's stack, down to the callback holding the loop
+    assert "Event loop blocked for" in output
+    assert "hold_the_loop" in output
+    assert "Event loop was blocked for" in output
+
+
+def test_watchdog_stays_quiet_while_the_loop_is_responsive(capsys):
+    async def run():
+        monitor = LoopMonitor(asyncio.get_running_loop(), interval=0.02, threshold=0.1)
+        try:
+            for _ in range(10):
+                await asyncio.sleep(0.02)
+        finally:
+            monitor.stop()
+
+    before = LOOP_BLOCKED.value()
+    asyncio.run(run())
+
+    assert LOOP_BLOCKED.value() == before
+    assert "blocked" not in capsys.readouterr().out
@@ -0,0 +1,87 @@
+import asyncio
+import json
+
+import pytest
+
+from benchmarks.fakes import LatencyProfile, ServerThread, create_openai_app
+from utils import model_cascade
+from utils.model_cascade import CASCADE_ESCALATIONS, CascadePolicy, answer_confidence, first_tier
+
+STAGE = "llm.validate"
+
+
+@pytest.fixture(scope="module")
+def openai_fake():
+    server = ServerThread(create_openai_app(LatencyProfile.parse("0"))).start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def cascade(openai_fake, tmp_path, monkeypatch):
+    """Routes the classifier chains to the OpenAI fake with a two-tier policy for STAGE."""
+    policy = tmp_path / "model_cascade.json"
+    policy.write_text(json.dumps({STAGE: {"tiers": ["cheap-model", "strong-model"], "min_confidence": 0.9,
+                                          "max_input_tokens": 500}}))
+    monkeypatch.setenv("MODEL_CASCADE_POLICY", str(policy))
+    monkeypatch.setenv("OPENAI_API_KEY", "sk-test")
+    monkeypatch.setenv("OPENAI_BASE_URL", f"{openai_fake.url}/v1")
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1,localhost")
+    monkeypatch.setenv("LLM_CACHE_MODE", "off")
+    from utils.llm_cache import get_llm_cache
+    get_llm_cache.cache_clear()
+    model_cascade.load_policies.cache_clear()
+    openai_fake.app.state.models.clear()
+    openai_fake.app.state.answer_confidence.clear()
+    yield openai_fake.app.state
+    model_cascade.load_policies.cache_clear()
+    get_llm_cache.cache_clear()
+
+
+def classify(text: str) -> str:
+    from langchain_core.prompts import ChatPromptTemplate
+    from routers.extract_text_and_keypoints import invoke_cascade
+
+    prompt = ChatPromptTemplate.from_template("Is this a medical document? Respond with only 'yes' or 'no'.\n{text}")
+    return asyncio.run(invoke_cascade(STAGE, prompt, {"text": text}))
+
+
+def test_confident_answer_of_the_cheap_tier_is_used(cascade):
+    assert classify("Arztbrief") == "yes"
+    assert cascade.models == ["cheap-model"]
+
+
+def test_unsure_answer_is_asked_again_on_the_next_tier(cascade):
+    cascade.answer_confidence["cheap-model"] = 0.6
+    escalations = CASCADE_ESCALATIONS.value(stage=STAGE, model="cheap-model", reason="low_confidence")
+
+    assert classify("Arztbrief") == "yes"
+
+    assert cascade.models == ["cheap-model", "strong-model"]
+    assert CASCADE_ESCALATIONS.value(stage=STAGE, model="cheap-model", reason="low_confidence") == escalations + 1
+
+
+def test_long_input_starts_on_the_last_tier(cascade):
+    classify("Befund " * 1000)
+    assert cascade.models == ["strong-model"]
+
+
+def test_first_tier_for_complex_inputs():
+    policy = CascadePolicy(("gpt-4o-mini", "gpt-4o"), max_input_tokens=4000, max_documents=3)
+
+    assert first_tier("llm.report", policy, input_tokens=1000, documents=3) == 0
+    assert first_tier("llm.report", policy, input_tokens=1000, documents=4) == 1
+    assert first_tier("llm.report", CascadePolicy(("gpt-4o",)), input_tokens=10 ** 6) == 0
+
+
+class Message:
+    def __init__(self, logprobs):
+        self.response_metadata = {"logprobs": logprobs}
+
+
+def test_answer_confidence_is_the_least_certain_token():
+    logprobs = {"content": [{"token": "ye", "logprob": -0.01}, {"token": "s", "logprob": -0.7},
+                            {"token": "\n", "logprob": -5.0}]}
+
+    assert answer_confidence(Message(logprobs)) == pytest.approx(0.4966, abs=1e-3)
+    assert answer_confidence(Message(None)) is None
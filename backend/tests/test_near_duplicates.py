@@ -0,0 +1,52 @@
+from utils.near_duplicates import (
+    NEAR_DUPLICATE_THRESHOLD, estimated_similarity, minhash_signature, select_distinct_documents)
+
+LAB_TEMPLATE = """Labor Dr. Muster & Kollegen, Hauptstraße 12, 80331 München, Tel. 089 123456
+Laborbefund
+Patientin: Erika Mustermann, geb. 12.08.1941
+Eingang: {date}   Befund: {date}
+Kleines Blutbild
+Hämoglobin {hb} g/dL (12.0-16.0)
+Leukozyten 6.1 /nl (4.0-10.0)
+Thrombozyten 245 /nl (150-400)
+Klinische Chemie
+Kreatinin {crea} mg/dL (0.5-1.0)
+HbA1c {hba1c} % (4.0-6.0)
+Validiert: Dr. med. A. Muster, Fachärztin für Laboratoriumsmedizin"""
+
+
+def _lab_report(date, hb, crea, hba1c):
+    return LAB_TEMPLATE.format(date=date, hb=hb, crea=crea, hba1c=hba1c)
+
+
+def _record(text, clarity=0.9):
+    return {"doc_type": "Lab Report", "text": text, "clarity_score": clarity,
+            "minhash": minhash_signature(text)}
+
+
+def test_same_template_reports_with_different_values_stay_distinct():
+    earlier = _lab_report("03.02.2025", "11.2", "1.4", "7.9")
+    later = _lab_report("14.05.2025", "13.1", "1.1", "6.8")
+    # Similar enough by shingles alone to be taken for copies
+    assert estimated_similarity(minhash_signature(earlier), minhash_signature(later)) >= NEAR_DUPLICATE_THRESHOLD
+
+    kept = select_distinct_documents([_record(earlier), _record(later)])
+
+    assert [record["text"] for record in kept] == [earlier, later]
+
+
+def test_same_date_but_different_values_stay_distinct():
+    first = _lab_report("03.02.2025", "11.2", "1.4", "7.9")
+    second = _lab_report("03.02.2025", "13.1", "1.1", "6.8")
+
+    assert len(select_distinct_documents([_record(first), _record(second)])) == 2
+
+
+def test_two_photos_of_one_report_are_merged():
+    text = _lab_report("03.02.2025", "11.2", "1.4", "7.9")
+    # Second photo: OCR noise in the letters and the punctuation, the contents are the same
+    noisy = text.replace("Hämoglobin", "Hämogl0bin").replace("Kollegen,", "Kollegen").replace("ä", "a")
+
+    kept = select_distinct_documents([_record(noisy, clarity=0.6), _record(text, clarity=0.95)])
+
+    assert [record["text"] for record in kept] == [text]
@@ -0,0 +1,313 @@
+import asyncio
+import json
+import time
+
+import httpx
+import pytest
+
+from utils import resilience
+from utils.openai_scheduler import (
+    RATE_LIMITED, OpenAIScheduler, Priority, QueueTimeoutError, SchedulingTransport, TokenBucket, openai_priority)
+from utils.resilience import HEDGES, CircuitBreaker, get_breaker, get_latency_window, hedged
+
+
+@pytest.fixture(autouse=True)
+def quick_hedges(monkeypatch):
+    monkeypatch.setattr(resilience, "HEDGE_MIN_DELAY_SECONDS", 0.01)
+
+
+@pytest.fixture
+def openai_breaker(monkeypatch):
+    """A fresh "openai" breaker and a provider timeout of 0.2 s."""
+    monkeypatch.setenv("PROVIDER_TIMEOUT_OPENAI", "0.2")
+    monkeypatch.delitem(resilience._breakers, "openai", raising=False)
+    yield get_breaker("openai")
+    resilience._breakers.pop("openai", None)
+
+
+def make_scheduler(**kwargs) -> OpenAIScheduler:
+    return OpenAIScheduler(requests_per_minute=60000, tokens_per_minute=10 ** 9, **kwargs)
+
+
+class SlowFirstServer:
+    """Answers the first request after `first_delay` seconds and every other one right away."""
+
+    def __init__(self, first_delay: float):
+        self.first_delay = first_delay
+        self.requests = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.requests == 1:
+            await asyncio.sleep(self.first_delay)
+        return httpx.Response(200, json={"answer": self.requests})
+
+
+def chat(transport: SchedulingTransport, model: str) -> dict:
+    async def call():
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.post("https://api.openai.com/v1/chat/completions",
+                                         json={"model": model, "messages": []})
+            return response.json()
+    return asyncio.run(call())
+
+
+def known_latencies(model: str, seconds: float = 0.01):
+    window = get_latency_window(f"openai:/v1/chat/completions:{model}")
+    for _ in range(resilience.HEDGE_MIN_SAMPLES):
+        window.add(seconds)
+
+
+def test_slow_interactive_call_is_hedged():
+    known_latencies("hedge-model")
+    server = SlowFirstServer(first_delay=1.0)
+
+    scheduler = make_scheduler()
+
+    answer = chat(SchedulingTransport(scheduler, transport=httpx.MockTransport(server)), "hedge-model")
+
+    assert answer == {"answer": 2}
+    assert server.requests == 2
+    assert scheduler.inflight == 0
+
+
+def test_no_hedge_while_the_scheduler_is_at_its_concurrency_limit():
+    known_latencies("busy-model")
+    server = SlowFirstServer(first_delay=0.2)
+    scheduler = make_scheduler(min_concurrency=1, max_concurrency=1)
+    fired = HEDGES.value(provider="openai", outcome="fired")
+
+    answer = chat(SchedulingTransport(scheduler, transport=httpx.MockTransport(server)), "busy-model")
+
+    assert answer == {"answer": 1}
+    # Not even queued behind the first attempt
+    assert HEDGES.value(provider="openai", outcome="fired") == fired
+    assert server.requests == 1
+
+
+def test_no_second_hedge_inside_a_hedged_call():
+    known_latencies("ocr-model")
+    server = SlowFirstServer(first_delay=0.2)
+    transport = SchedulingTransport(make_scheduler(), transport=httpx.MockTransport(server))
+
+    async def ocr_attempt():
+        async with httpx.AsyncClient(transport=transport) as client:
+            response = await client.post("https://api.openai.com/v1/chat/completions",
+                                         json={"model": "ocr-model", "messages": []})
+            return response.json()
+
+    # One attempt only: the outer hedge has no alternative to fire
+    answer = asyncio.run(hedged([("openai_vision", ocr_attempt)]))
+
+    assert answer == {"answer": 1}
+    assert server.requests == 1
+
+
+def test_latency_excludes_the_wait_for_admission():
+    scheduler = make_scheduler()
+    # A Retry-After pause holds the request back before it is sent
+    scheduler.paused_until = time.monotonic() + 0.3
+    server = SlowFirstServer(first_delay=0.0)
+
+    chat(SchedulingTransport(scheduler, transport=httpx.MockTransport(server)), "queued-model")
+
+    window = get_latency_window("openai:/v1/chat/completions:queued-model")
+    assert len(window._samples) == 1 and window._samples[0] < 0.1
+
+
+def test_token_bucket_refills_at_its_rate_up_to_capacity():
+    bucket = TokenBucket(rate=2.0, capacity=4.0)
+    start = bucket.updated
+
+    bucket.take(4, start)
+    assert bucket.time_until(1, start) == pytest.approx(0.5)
+    assert bucket.time_until(1, start + 0.5) == 0.0
+    # More than the capacity only ever waits for a full bucket
+    assert bucket.time_until(10, start + 0.5) == pytest.approx(1.5)
+    assert bucket.time_until(1, start + 60) == 0.0 and bucket.tokens == 4.0
+
+
+def test_aimd_grows_on_success_and_halves_once_per_window_on_errors():
+    scheduler = make_scheduler(min_concurrency=2, max_concurrency=32, latency_target=1.0)
+
+    async def call(status_code, latency=0.01):
+        await scheduler.acquire(Priority.BACKGROUND, 10)
+        scheduler.release(Priority.BACKGROUND, status_code, latency)
+
+    async def scenario():
+        await call(200)
+        assert scheduler.limit == pytest.approx(8 + 1 / 8)
+        await call(503)
+        assert scheduler.limit == pytest.approx((8 + 1 / 8) / 2)
+        # Errors of calls that were already in flight do not halve the limit again
+        await call(None)
+        assert scheduler.limit == pytest.approx((8 + 1 / 8) / 2)
+        scheduler._last_decrease -= 1.0
+        await call(200, latency=5.0)
+        assert scheduler.limit == pytest.approx((8 + 1 / 8) / 4)
+        scheduler._last_decrease -= 1.0
+        await call(429)
+        assert scheduler.limit == 2
+
+    asyncio.run(scenario())
+
+
+def test_rate_limit_bucket_holds_requests_back():
+    scheduler = OpenAIScheduler(requests_per_minute=60, tokens_per_minute=10 ** 9)
+    scheduler.request_bucket.tokens = 1
+
+    async def scenario():
+        start = time.monotonic()
+        await scheduler.acquire(Priority.INTERACTIVE, 1)
+        await scheduler.acquire(Priority.INTERACTIVE, 1)
+        return time.monotonic() - start
+
+    # One request per second: the second waits for the bucket to refill
+    assert asyncio.run(scenario()) >= 0.9
+
+
+def test_waiting_requests_are_admitted_in_priority_order():
+    scheduler = make_scheduler(min_concurrency=1, max_concurrency=1, interactive_reserved=0)
+    scheduler.limit = 1
+    admitted = []
+
+    async def call(priority):
+        await scheduler.acquire(priority, 1)
+        admitted.append(priority)
+        await asyncio.sleep(0.01)
+        scheduler.release(priority, 200, 0.01)
+
+    async def scenario():
+        await scheduler.acquire(Priority.REPORT, 1)
+        waiting = [asyncio.ensure_future(call(priority))
+                   for priority in (Priority.REPORT, Priority.BACKGROUND, Priority.INTERACTIVE)]
+        await asyncio.sleep(0.01)
+        scheduler.release(Priority.REPORT, 200, 0.01)
+        await asyncio.gather(*waiting)
+
+    asyncio.run(scenario())
+    assert admitted == [Priority.INTERACTIVE, Priority.BACKGROUND, Priority.REPORT]
+
+
+class RateLimitedServer:
+    def __init__(self, rate_limited: int, retry_after_ms: int = 100):
+        self.rate_limited = rate_limited
+        self.retry_after_ms = retry_after_ms
+        self.requests = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.requests <= self.rate_limited:
+            return httpx.Response(429, headers={"retry-after-ms": str(self.retry_after_ms)})
+        return httpx.Response(200, json={"answer": "ok"})
+
+
+def test_429_pauses_admission_for_retry_after_and_retries():
+    server = RateLimitedServer(rate_limited=1, retry_after_ms=200)
+    limited = RATE_LIMITED.value(priority="background")
+
+    async def scenario():
+        transport = SchedulingTransport(make_scheduler(), transport=httpx.MockTransport(server))
+        async with httpx.AsyncClient(transport=transport) as client:
+            start = time.monotonic()
+            # Background calls are not hedged
+            with openai_priority(Priority.BACKGROUND):
+                response = await client.post("https://api.openai.com/v1/embeddings", json={"input": "x"})
+            return response, time.monotonic() - start
+
+    response, seconds = asyncio.run(scenario())
+    assert response.status_code == 200 and server.requests == 2
+    assert seconds >= 0.2
+    assert RATE_LIMITED.value(priority="background") == limited + 1
+
+
+def test_429_is_returned_once_the_retries_are_used_up():
+    server = RateLimitedServer(rate_limited=10, retry_after_ms=1)
+
+    async def scenario():
+        transport = SchedulingTransport(make_scheduler(), max_retries=2, transport=httpx.MockTransport(server))
+        async with httpx.AsyncClient(transport=transport) as client:
+            with openai_priority(Priority.BACKGROUND):
+                return await client.post("https://api.openai.com/v1/embeddings", json={"input": "x"})
+
+    assert asyncio.run(scenario()).status_code == 429
+    assert server.requests == 3
+
+
+class SlowServer:
+    def __init__(self, delay: float):
+        self.delay = delay
+        self.requests = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        await asyncio.sleep(self.delay)
+        return httpx.Response(200, json={"answer": "ok"})
+
+
+def background_calls(transport: SchedulingTransport, count: int) -> list:
+    async def call(client):
+        with openai_priority(Priority.BACKGROUND):
+            return await client.post("https://api.openai.com/v1/chat/completions",
+                                     json={"model": "background-model", "messages": []})
+
+    async def scenario():
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await asyncio.gather(*(call(client) for _ in range(count)), return_exceptions=True)
+    return asyncio.run(scenario())
+
+
+def test_queued_background_calls_do_not_time_out_or_open_the_breaker(openai_breaker):
+    scheduler = make_scheduler(min_concurrency=1, max_concurrency=1, interactive_reserved=0)
+    server = SlowServer(delay=0.1)
+
+    # One at a time: the last call waits 0.5 s for admission, longer than the provider timeout
+    responses = background_calls(SchedulingTransport(scheduler, transport=httpx.MockTransport(server)), 6)
+
+    assert [response.status_code for response in responses] == [200] * 6
+    assert openai_breaker.state == CircuitBreaker.CLOSED and openai_breaker.failures == 0
+    assert scheduler.inflight == 0
+
+
+def test_queue_timeout_fails_the_call_without_counting_against_the_breaker(openai_breaker):
+    scheduler = make_scheduler(min_concurrency=1, max_concurrency=1, interactive_reserved=0)
+    server = SlowServer(delay=0.15)
+    transport = SchedulingTransport(scheduler, transport=httpx.MockTransport(server), queue_timeout=0.05)
+
+    responses = background_calls(transport, 3)
+
+    assert responses[0].status_code == 200
+    assert all(isinstance(response, QueueTimeoutError) for response in responses[1:])
+    assert server.requests == 1
+    assert openai_breaker.failures == 0
+    assert scheduler.inflight == 0 and not scheduler._waiters
+
+
+def test_provider_timeout_still_counts_against_the_breaker(openai_breaker):
+    server = SlowServer(delay=0.5)
+
+    responses = background_calls(SchedulingTransport(make_scheduler(), transport=httpx.MockTransport(server)), 1)
+
+    assert isinstance(responses[0], TimeoutError)
+    assert openai_breaker.failures == 1
+
+
+def test_hedge_delay_starts_at_admission(openai_breaker):
+    known_latencies("queued-hedge-model")
+    scheduler = make_scheduler(min_concurrency=1, max_concurrency=1, interactive_reserved=0)
+    server = SlowServer(delay=0.0)
+    transport = SchedulingTransport(scheduler, transport=httpx.MockTransport(server))
+    hedges = {outcome: HEDGES.value(provider="openai", outcome=outcome) for outcome in ("fired", "skipped")}
+
+    async def scenario():
+        # A report call holds the only slot for longer than the hedge delay
+        await scheduler.acquire(Priority.REPORT, 1)
+        asyncio.get_running_loop().call_later(0.2, scheduler.release, Priority.REPORT, 200, 0.2)
+        async with httpx.AsyncClient(transport=transport) as client:
+            return await client.post("https://api.openai.com/v1/chat/completions",
+                                     json={"model": "queued-hedge-model", "messages": []})
+
+    assert asyncio.run(scenario()).status_code == 200
+    # Waiting for admission made the call slow, but OpenAI answered fast: no hedge was due
+    assert {outcome: HEDGES.value(provider="openai", outcome=outcome) for outcome in hedges} == hedges
+    assert server.requests == 1
@@ -0,0 +1,156 @@
+import asyncio
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from routers import profiles
+from utils import profiling
+from utils.profiling import PROFILE_SUFFIX, Capture, Profiler
+
+
+def _capture():
+    request = SimpleNamespace(method="POST", url=SimpleNamespace(path="/upload-image"))
+    return Capture("test-capture", "header", request)
+
+
+async def _waiting_job():
+    await asyncio.sleep(10)
+
+
+def test_speedscope_output_of_running_and_waiting_tasks():
+    capture = _capture()
+
+    def take_samples():
+        # The loop thread's stack as the sampler thread sees it, outermost first
+        frame, loop_stack = sys._getframe(), []
+        while frame is not None:
+            loop_stack.append(frame)
+            frame = frame.f_back
+        loop_stack.reverse()
+        now = capture.started_at
+        for _ in range(2):
+            now += 0.01
+            capture.sample(loop_stack, now, 0.01)
+
+    async def request_handler():
+        capture.add_task(asyncio.current_task())
+        job = asyncio.create_task(_waiting_job())
+        capture.add_task(job)
+        await asyncio.sleep(0)
+        take_samples()
+        job.cancel()
+
+    asyncio.run(request_handler())
+    data = capture.to_speedscope()
+
+    assert data["$schema"] == "https://www.speedscope.app/file-format-schema.json"
+    assert data["name"] == "POST /upload-image (-)"
+    frames = data["shared"]["frames"]
+    names = [frame["name"] for frame in frames]
+    # Each frame is listed once however many samples refer to it
+    assert len(names) == len(set(names))
+    assert all(frame["file"] and frame["line"] for frame in frames if not frame["name"].startswith("["))
+
+    assert len(data["profiles"]) == 2
+    for profile in data["profiles"]:
+        assert profile["type"] == "sampled" and profile["unit"] == "seconds"
+        assert len(profile["samples"]) == len(profile["weights"]) == 2
+        assert profile["endValue"] - profile["startValue"] == pytest.approx(sum(profile["weights"]))
+        assert all(0 <= index < len(frames) for stack in profile["samples"] for index in stack)
+    # Profiles are named "<task name> <coroutine qualname>"
+    stacks = {profile["name"].split()[-1].rsplit(".", 1)[-1]: [names[index] for index in profile["samples"][0]]
+              for profile in data["profiles"]}
+    # The running task's real stack, from its coroutine down to the frame being executed
+    assert [name.rsplit(".", 1)[-1] for name in stacks["request_handler"]] == ["request_handler", "take_samples"]
+    # A suspended task's chain of awaited coroutines, ending in what it waits on
+    assert stacks["_waiting_job"] == ["_waiting_job", "sleep", "[await Future]"]
+
+
+def _write_profile(directory, name, size, mtime):
+    path = directory / f"{name}{PROFILE_SUFFIX}"
+    path.write_text("x" * size)
+    path.with_suffix(".meta").write_text("{}")
+    os.utime(path, (mtime, mtime))
+
+
+def _stored(directory):
+    return sorted(path.name[:-len(PROFILE_SUFFIX)] for path in directory.glob(f"*{PROFILE_SUFFIX}"))
+
+
+def test_eviction_keeps_the_newest_files_within_the_count_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "MAX_FILES", 3)
+    monkeypatch.setattr(profiling, "MAX_BYTES", 10_000)
+    now = time.time()
+    for number in range(5):
+        _write_profile(tmp_path, f"p{number}", 100, now - 100 + number)
+
+    Profiler(directory=tmp_path)._evict()
+
+    assert _stored(tmp_path) == ["p2", "p3", "p4"]
+    # With their metadata
+    assert sorted(path.name for path in tmp_path.glob("*.meta")) == [f"p{number}.speedscope.meta" for number in (2, 3, 4)]
+
+
+def test_eviction_keeps_the_newest_files_within_the_size_limit(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "MAX_FILES", 20)
+    monkeypatch.setattr(profiling, "MAX_BYTES", 250)
+    now = time.time()
+    for number in range(4):
+        _write_profile(tmp_path, f"p{number}", 100, now - 100 + number)
+
+    Profiler(directory=tmp_path)._evict()
+
+    assert _stored(tmp_path) == ["p2", "p3"]
+
+
+def _get(path, headers=None):
+    app = FastAPI()
+    app.include_router(profiles.profiles_router)
+
+    async def request():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://test") as client:
+            return await client.get(path, headers=headers or {})
+
+    return asyncio.run(request())
+
+
+def test_admin_endpoints_do_not_exist_without_a_token(monkeypatch):
+    monkeypatch.setattr(profiles, "ADMIN_TOKEN", "")
+
+    assert _get("/admin/profiles").status_code == 404
+    assert _get("/admin/profiles", {"X-Admin-Token": ""}).status_code == 404
+
+
+def test_admin_endpoints_require_the_token(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiles, "ADMIN_TOKEN", "secret")
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    _write_profile(tmp_path, "20250501T100000-upload-image-abc", 10, time.time())
+
+    assert _get("/admin/profiles").status_code == 403
+    assert _get("/admin/profiles", {"X-Admin-Token": "wrong"}).status_code == 403
+    assert _get("/admin/profiles/20250501T100000-upload-image-abc").status_code == 403
+
+    listing = _get("/admin/profiles", {"X-Admin-Token": "secret"})
+    assert listing.status_code == 200
+    assert [profile["id"] for profile in listing.json()["profiles"]] == ["20250501T100000-upload-image-abc"]
+    download = _get("/admin/profiles/20250501T100000-upload-image-abc", {"X-Admin-Token": "secret"})
+    assert download.status_code == 200 and download.text == "x" * 10
+    assert _get("/admin/profiles/missing", {"X-Admin-Token": "secret"}).status_code == 404
+
+
+def test_capture_metadata_is_listed(tmp_path, monkeypatch):
+    monkeypatch.setattr(profiling, "PROFILE_DIR", tmp_path)
+    _write_profile(tmp_path, "older", 10, time.time() - 10)
+    _write_profile(tmp_path, "newer", 10, time.time())
+    (tmp_path / f"newer{PROFILE_SUFFIX}").with_suffix(".meta").write_text(json.dumps({"path": "/upload-image"}))
+
+    listed = profiling.list_profiles()
+
+    assert [profile["id"] for profile in listed] == ["newer", "older"]
+    assert listed[0]["path"] == "/upload-image"
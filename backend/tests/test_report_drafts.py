@@ -0,0 +1,69 @@
+import asyncio
+
+import pytest
+
+from routers import process_image
+from routers.patient_scope import PatientScope
+
+
+@pytest.fixture
+def saved(monkeypatch):
+    """Records the report versions saved (status per version) instead of storing them."""
+    versions = {}
+
+    def save_grandma_report(report, patient_id, tenant_id, status, version_id, created_at):
+        versions[version_id] = status
+        return {"id": version_id, "created_at": created_at}
+
+    async def nothing(*args, **kwargs):
+        pass
+
+    monkeypatch.setattr(process_image, "save_grandma_report", save_grandma_report)
+    monkeypatch.setattr(process_image, "get_all_image_data_for_reprocessing", lambda **kwargs: "Arztbrief")
+    monkeypatch.setattr(process_image, "ensure_llm_sdks", nothing)
+    monkeypatch.setattr(process_image, "publish_event", nothing)
+    monkeypatch.setattr(process_image, "REPORT_STREAMING", True)
+    return versions
+
+
+def test_cancelled_run_marks_its_draft_failed(saved, monkeypatch):
+    drafted = asyncio.Event()
+
+    async def generate(texts, on_draft=None):
+        await on_draft("## Diagnosen", 1)
+        drafted.set()
+        await asyncio.sleep(60)
+
+    monkeypatch.setattr(process_image, "generate_combined_medical_summary_md", generate)
+
+    async def supersede():
+        run = asyncio.ensure_future(process_image._generate_save_report(PatientScope("t", "p")))
+        await drafted.wait()
+        run.cancel()
+        await asyncio.wait({run})
+        assert run.cancelled()
+
+    asyncio.run(supersede())
+    assert list(saved.values()) == [process_image.REPORT_FAILED]
+
+
+def test_failed_run_marks_its_draft_failed(saved, monkeypatch):
+    async def generate(texts, on_draft=None):
+        await on_draft("## Diagnosen", 1)
+        raise RuntimeError("model unavailable")
+
+    monkeypatch.setattr(process_image, "generate_combined_medical_summary_md", generate)
+
+    asyncio.run(process_image._generate_save_report(PatientScope("t", "p")))
+    assert list(saved.values()) == [process_image.REPORT_FAILED]
+
+
+def test_completed_run_keeps_its_version(saved, monkeypatch):
+    async def generate(texts, on_draft=None):
+        await on_draft("## Diagnosen", 1)
+        return "## Diagnosen\n- Diabetes"
+
+    monkeypatch.setattr(process_image, "generate_combined_medical_summary_md", generate)
+
+    asyncio.run(process_image._generate_save_report(PatientScope("t", "p")))
+    assert list(saved.values()) == [process_image.REPORT_COMPLETE]
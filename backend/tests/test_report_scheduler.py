@@ -0,0 +1,32 @@
+import asyncio
+
+from utils.report_scheduler import ReportScheduler
+
+
+def test_superseding_run_starts_after_the_cancelled_run_finalized():
+    events = []
+
+    async def generate(key):
+        run = len([event for event in events if event == "start"])
+        events.append("start")
+        try:
+            await asyncio.sleep(60)
+        finally:
+            # A cancelled run still needs the loop to finalize its version
+            await asyncio.sleep(0.01)
+            events.append(f"finalized {run}")
+
+    async def scenario():
+        scheduler = ReportScheduler(generate, auto_trigger=False)
+        assert scheduler.trigger("p") == "started"
+        await asyncio.sleep(0)
+        scheduler.document_job_started("p")
+        scheduler.document_job_finished("p")
+        assert scheduler.trigger("p") == "superseded"
+        await asyncio.sleep(0.05)
+        assert scheduler.trigger("p") == "joined"
+        scheduler._patients["p"].run.cancel()
+        await asyncio.sleep(0.05)
+
+    asyncio.run(scenario())
+    assert events == ["start", "finalized 0", "start", "finalized 1"]
@@ -0,0 +1,164 @@
+import asyncio
+import sys
+
+import pytest
+
+from utils import token_budget
+from utils.token_budget import (
+    BUDGET_ACTIONS, TokenBudgetExceeded, count_tokens, ensure_budget, fit_prompt, token_account,
+    truncate_to_tokens)
+
+STAGE = "llm.test"
+
+
+@pytest.fixture(autouse=True)
+def estimated_tokens(monkeypatch):
+    """Counts tokens from the text length (the encoding files cannot be downloaded in tests)."""
+    monkeypatch.setattr(token_budget, "_encoding", lambda model: None)
+
+
+@pytest.fixture
+def stage_budget(monkeypatch):
+    def configure(budget, policy):
+        monkeypatch.setenv("TOKEN_BUDGET_LLM_TEST", str(budget))
+        monkeypatch.setenv("TOKEN_POLICY_LLM_TEST", policy)
+    return configure
+
+
+def _fit(text, overhead_tokens=0, summarize=None):
+    return asyncio.run(fit_prompt(STAGE, text, overhead_tokens=overhead_tokens, summarize=summarize))
+
+
+def _actions(budget, action):
+    return BUDGET_ACTIONS.value(stage=STAGE, budget=budget, action=action)
+
+
+def test_prompt_within_budget_is_unchanged(stage_budget):
+    stage_budget(100, "reject")
+    text = "x" * 300  # 75 tokens
+
+    assert _fit(text, overhead_tokens=25) == text
+
+
+def test_truncate_keeps_the_beginning_and_the_end(stage_budget):
+    stage_budget(100, "truncate")
+    text = "A" * 400 + "B" * 400 + "C" * 400  # 300 tokens
+    before = _actions("call", "truncate")
+
+    fitted = _fit(text, overhead_tokens=20)
+
+    assert count_tokens(fitted) <= 80
+    assert fitted.startswith("A") and fitted.endswith("C")
+    assert "[... text truncated ...]" in fitted
+    assert "B" not in fitted
+    assert _actions("call", "truncate") == before + 1
+
+
+def test_reject_raises(stage_budget):
+    stage_budget(100, "reject")
+    before = _actions("call", "reject")
+
+    with pytest.raises(TokenBudgetExceeded, match="call token budget"):
+        _fit("x" * 800)
+    assert _actions("call", "reject") == before + 1
+
+
+def test_overhead_alone_over_budget_is_rejected_whatever_the_policy(stage_budget):
+    stage_budget(100, "truncate")
+
+    with pytest.raises(TokenBudgetExceeded):
+        _fit("x" * 40, overhead_tokens=120)
+
+
+def test_summarize_uses_the_summarizer(stage_budget):
+    stage_budget(100, "summarize")
+    calls = []
+
+    async def summarize(text, max_tokens):
+        calls.append(max_tokens)
+        return "summary"
+
+    before = _actions("call", "summarize")
+
+    assert _fit("x" * 800, overhead_tokens=40, summarize=summarize) == "summary"
+    assert calls == [60]
+    assert _actions("call", "summarize") == before + 1
+
+
+def test_summary_still_over_budget_is_truncated(stage_budget):
+    stage_budget(100, "summarize")
+
+    async def summarize(text, max_tokens):
+        return text[:600]
+
+    fitted = _fit("x" * 800, summarize=summarize)
+
+    assert count_tokens(fitted) <= 100
+    assert "[... text truncated ...]" in fitted
+
+
+def test_summarize_without_a_summarizer_truncates(stage_budget):
+    stage_budget(100, "summarize")
+
+    fitted = _fit("x" * 800)
+
+    assert count_tokens(fitted) <= 100
+    assert "[... text truncated ...]" in fitted
+
+
+def test_request_budget_applies_when_it_is_smaller_than_the_call_budget(stage_budget):
+    stage_budget(1000, "reject")
+    text = "x" * 800  # 200 tokens
+
+    with token_account(job="test") as account:
+        assert _fit(text) == text
+        account.budget, account.used = 500, 350
+        before = _actions("request", "reject")
+        with pytest.raises(TokenBudgetExceeded, match="request token budget \\(150\\)"):
+            _fit(text)
+        assert _actions("request", "reject") == before + 1
+
+
+def test_request_budget_truncates_under_a_truncating_policy(stage_budget):
+    stage_budget(1000, "truncate")
+
+    with token_account(job="test") as account:
+        account.budget, account.used = 500, 400
+        before = _actions("request", "truncate")
+        fitted = _fit("x" * 800)
+
+    assert count_tokens(fitted) <= 100
+    assert _actions("request", "truncate") == before + 1
+
+
+def test_ensure_budget_rejects_unshortenable_prompts(stage_budget):
+    stage_budget(1000, "truncate")
+
+    ensure_budget(STAGE, 765)
+    with pytest.raises(TokenBudgetExceeded):
+        ensure_budget(STAGE, 1001)
+    with token_account(job="test") as account:
+        account.budget, account.used = 1000, 500
+        with pytest.raises(TokenBudgetExceeded, match="request token budget"):
+            ensure_budget(STAGE, 765)
+
+
+def test_default_budget_and_policy_for_unlisted_stages(monkeypatch):
+    monkeypatch.delenv("TOKEN_BUDGET_LLM_TEST", raising=False)
+    monkeypatch.delenv("TOKEN_POLICY_LLM_TEST", raising=False)
+
+    assert token_budget.call_budget(STAGE) == (token_budget.DEFAULT_CALL_BUDGET, "truncate")
+    assert token_budget.call_budget("llm.chat") == (100000, "reject")
+
+
+def test_tiktoken_unavailable_falls_back_to_length_estimate(monkeypatch):
+    monkeypatch.undo()  # the real _encoding, with tiktoken made unimportable
+    monkeypatch.setitem(sys.modules, "tiktoken", None)
+    token_budget._encoding.cache_clear()
+    try:
+        assert token_budget._encoding("gpt-4o-mini") is None
+        assert count_tokens("x" * 10) == 3
+        truncated = truncate_to_tokens("A" * 400 + "C" * 400, 50)
+        assert truncated.startswith("A" * 120) and truncated.endswith("C" * 32)
+    finally:
+        token_budget._encoding.cache_clear()
@@ -0,0 +1,159 @@
+import json
+
+import pytest
+
+from database.write_behind import INSERT, UPDATE, FileWriteBuffer, WriteRejected
+
+
+class ConstraintViolation(Exception):
+    code = "23505"
+
+
+class FakeTable:
+    """grandma_files stand-in: rejects rows whose file_name is 'poison', fails while `down`."""
+
+    def __init__(self):
+        self.rows = {}
+        self.requests = []
+        self.down = False
+
+    def _check(self, rows):
+        if self.down:
+            raise ConnectionError("database unreachable")
+        if any(row.get("file_name") == "poison" for row in rows):
+            raise ConstraintViolation("violates check constraint")
+
+    def insert_rows(self, rows):
+        self.requests.append(("insert", len(rows)))
+        self._check(rows)
+        for row in rows:
+            self.rows[row["id"]] = dict(row)
+
+    def update_rows(self, updates):
+        self.requests.append(("update", len(updates)))
+        self._check(updates)
+        for update in updates:
+            self.rows.setdefault(update["id"], {}).update(update)
+
+
+@pytest.fixture
+def table():
+    return FakeTable()
+
+
+def make_buffer(table, tmp_path, **kwargs):
+    # A long interval: the tests flush explicitly
+    return FileWriteBuffer(table.insert_rows, table.update_rows, journal_path=str(tmp_path / "journal.jsonl"),
+                           dead_letter_path=str(tmp_path / "dead_letter.jsonl"), interval=60, **kwargs)
+
+
+def test_writes_to_one_row_are_merged_into_one_request(table, tmp_path):
+    buffer = make_buffer(table, tmp_path)
+    buffer.write(INSERT, "a", {"file_name": "a.png", "text": None}, tenant_id="t", patient_id="p")
+    buffer.write(UPDATE, "a", {"text": "Arztbrief"}, tenant_id="t", patient_id="p")
+    buffer.write(UPDATE, "a", {"thumbnail_url": "thumb"}, tenant_id="t", patient_id="p")
+
+    buffer.flush()
+
+    assert table.requests == [("insert", 1)]
+    assert table.rows["a"] == {"id": "a", "tenant_id": "t", "patient_id": "p", "file_name": "a.png",
+                               "text": "Arztbrief", "thumbnail_url": "thumb"}
+    buffer.close()
+
+
+def test_unflushed_writes_are_replayed_from_the_journal(table, tmp_path):
+    buffer = make_buffer(table, tmp_path)
+    buffer.write(INSERT, "a", {"file_name": "a.png"}, tenant_id="t", patient_id="p")
+    buffer.flush()
+    buffer.write(INSERT, "b", {"file_name": "b.png"}, tenant_id="t", patient_id="p")
+    buffer.write(UPDATE, "b", {"text": "Laborbefund"}, tenant_id="t", patient_id="p")
+    # Crash: the flusher stops without writing what is pending
+    buffer._closed = True
+    buffer._journal.close()
+    buffer._journal = None
+
+    replayed = make_buffer(table, tmp_path)
+    assert replayed.pending("a") is None
+    assert replayed.pending("b") == {"file_name": "b.png", "text": "Laborbefund"}
+    replayed.flush()
+
+    assert table.rows["b"]["text"] == "Laborbefund"
+    assert table.requests == [("insert", 1), ("insert", 1)]
+    replayed.close()
+
+
+def test_a_torn_journal_line_is_ignored(table, tmp_path):
+    journal = tmp_path / "journal.jsonl"
+    journal.write_text(json.dumps({"seq": 1, "image_id": "a", "kind": INSERT, "tenant_id": "t",
+                                   "patient_id": "p", "columns": {"file_name": "a.png"}}) + "\n"
+                       + '{"seq": 2, "image_id": "b", "ki')
+
+    buffer = make_buffer(table, tmp_path)
+
+    assert buffer.pending("a") == {"file_name": "a.png"}
+    assert buffer.pending("b") is None
+    buffer.close()
+
+
+def test_transient_failure_keeps_every_write_pending(table, tmp_path):
+    buffer = make_buffer(table, tmp_path)
+    buffer.write(INSERT, "a", {"file_name": "a.png"}, tenant_id="t", patient_id="p")
+    buffer.write(INSERT, "b", {"file_name": "b.png"}, tenant_id="t", patient_id="p")
+    table.down = True
+
+    with pytest.raises(ConnectionError):
+        buffer.flush()
+    # No row-by-row retries against a database that is down
+    assert table.requests == [("insert", 2)]
+    buffer.write(UPDATE, "a", {"text": "newer"}, tenant_id="t", patient_id="p")
+
+    table.down = False
+    buffer.flush()
+    assert table.rows["a"]["text"] == "newer"
+    assert set(table.rows) == {"a", "b"}
+    buffer.close()
+
+
+def test_a_rejected_row_does_not_block_the_others_and_is_dead_lettered(table, tmp_path):
+    buffer = make_buffer(table, tmp_path, max_attempts=2)
+    buffer.write(INSERT, "good", {"file_name": "good.png"}, tenant_id="t", patient_id="p")
+    buffer.write(INSERT, "bad", {"file_name": "poison"}, tenant_id="t", patient_id="p")
+
+    with pytest.raises(ConstraintViolation):
+        buffer.flush()
+    assert "good" in table.rows
+    assert buffer.pending("bad") == {"file_name": "poison"}
+
+    # Later writes of other rows go through while the rejected row is retried on its own
+    buffer.write(INSERT, "later", {"file_name": "later.png"}, tenant_id="t", patient_id="p")
+    buffer.flush()
+    assert "later" in table.rows
+    assert buffer.pending("bad") is None
+
+    dead = [json.loads(line) for line in (tmp_path / "dead_letter.jsonl").read_text().splitlines()]
+    assert [(entry["image_id"], entry["attempts"]) for entry in dead] == [("bad", 2)]
+    assert "bad" not in table.rows
+    buffer.close()
+
+    # Dead-lettered rows are acknowledged and not replayed
+    assert make_buffer(table, tmp_path).pending("bad") is None
+
+
+def test_waited_insert_is_flushed_right_away(table, tmp_path):
+    buffer = make_buffer(table, tmp_path)
+
+    waiter = buffer.write(INSERT, "a", {"file_name": "a.png"}, tenant_id="t", patient_id="p", wait=True)
+
+    assert waiter.result(timeout=5) is None
+    assert "a" in table.rows
+    buffer.close()
+
+
+def test_waited_insert_fails_once_rejected(table, tmp_path):
+    buffer = make_buffer(table, tmp_path, max_attempts=2, retry_seconds=0.05)
+
+    waiter = buffer.write(INSERT, "bad", {"file_name": "poison"}, tenant_id="t", patient_id="p", wait=True)
+
+    with pytest.raises(WriteRejected):
+        waiter.result(timeout=5)
+    buffer.close()
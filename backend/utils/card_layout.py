@@ -0,0 +1,353 @@
+"""
+Deterministic extraction of Insurance Cards and Vaccination Cards from the OCR layout.
+
+Cards print their fields in fixed places, so with the word boxes of the OCR result
+(OcrResult.words, reported by Google Vision and Tesseract) they can be read without an LLM:
+
+- Insurance Card: insurer, insured name, Versichertennummer and validity dates, taken from
+  next to or below their printed labels (EHIC on the back of the eGK) or, on the unlabelled
+  eGK front, by position: the name sits right above the Versichertennummer.
+- Vaccination Card: the vaccination table is rebuilt row by row from its column headers
+  (Datum, Impfstoff/Handelsname, Charge, optionally Krankheit), one keypoint per vaccination.
+
+A parse is only used when it validates (Versichertennummer check digit, plausible dates,
+complete table rows). Otherwise extract_card_keypoints returns None and the document goes
+through the LLM keyword extraction as before. CARD_LAYOUT_EXTRACTION=0 always does that.
+"""
+
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date
+from typing import Optional
+
+from utils.metrics import REGISTRY
+from utils.ocr import OcrWord
+
+CARD_LAYOUT_ENABLED = os.getenv("CARD_LAYOUT_EXTRACTION", "1") == "1"
+CARD_DOC_TYPES = ("Insurance Card", "Vaccination Card")
+
+CARD_PARSES = REGISTRY.counter(
+    "card_layout_parses_total", "Deterministic card parses by document type and outcome (ok/invalid/no_layout).",
+    ("doc_type", "outcome"))
+
+
+class CardParseError(ValueError):
+    pass
+
+
+@dataclass
+class Line:
+    words: list[OcrWord] = field(default_factory=list)
+
+    @property
+    def text(self) -> str:
+        return " ".join(word.text for word in self.words)
+
+    @property
+    def left(self) -> float:
+        return min(word.left for word in self.words)
+
+    @property
+    def right(self) -> float:
+        return max(word.right for word in self.words)
+
+    @property
+    def top(self) -> float:
+        return min(word.top for word in self.words)
+
+    @property
+    def bottom(self) -> float:
+        return max(word.bottom for word in self.words)
+
+    @property
+    def center_y(self) -> float:
+        return sum(word.center_y for word in self.words) / len(self.words)
+
+    @property
+    def height(self) -> float:
+        return max(word.height for word in self.words)
+
+    def words_after(self, offset: int) -> list[OcrWord]:
+        """The words starting at or after the character offset of self.text."""
+        words, position = [], 0
+        for word in self.words:
+            if position >= offset:
+                words.append(word)
+            position += len(word.text) + 1
+        return words
+
+
+def group_lines(words: list[OcrWord]) -> list[Line]:
+    """Groups words into visual lines (vertical centers within half a word height), top to bottom."""
+    lines: list[Line] = []
+    for word in sorted(words, key=lambda word: word.center_y):
+        # Only the latest lines can still be level with a word further down
+        for line in reversed(lines[-3:]):
+            if abs(line.center_y - word.center_y) <= max(line.height, word.height) / 2:
+                line.words.append(word)
+                break
+        else:
+            lines.append(Line([word]))
+    for line in lines:
+        line.words.sort(key=lambda word: word.left)
+    return sorted(lines, key=lambda line: line.top)
+
+
+def _line_below(lines: list[Line], anchor: Line, left: float, right: float) -> Optional[Line]:
+    """The nearest line below the anchor that overlaps [left, right] horizontally."""
+    for line in lines:
+        if line.top <= anchor.center_y or line.top - anchor.bottom > 2.5 * anchor.height:
+            continue
+        if line.left < right and line.right > left:
+            return line
+    return None
+
+
+def _labelled_value(lines: list[Line], label: re.Pattern) -> Optional[str]:
+    """
+    The value printed right of a label on the same line or, if the label ends its line,
+    in the line below it. None if the label is not printed.
+    """
+    for line in lines:
+        match = label.search(line.text)
+        if match is None:
+            continue
+        after = line.words_after(match.end())
+        if after:
+            return " ".join(word.text for word in after).strip(" :")
+        label_words = [word for word in line.words if word not in after]
+        below = _line_below(lines, line, label_words[0].left, label_words[-1].right + 0.3)
+        return below.text.strip(" :") if below is not None else ""
+    return None
+
+
+_DATE = re.compile(r"\b(?:(\d{1,2})[./-])?(\d{1,2})[./-](\d{4}|\d{2})\b")
+
+
+def parse_date(value: str) -> Optional[str]:
+    """The first date in the value (dd.mm.yyyy, dd.mm.yy, mm/yyyy, mm/yy) as ISO, None if there is no plausible one."""
+    match = _DATE.search(value)
+    if match is None:
+        return None
+    day, month, year = match.group(1), int(match.group(2)), int(match.group(3))
+    if year < 100:
+        # Two-digit years on cards: validity dates lie ahead, vaccinations in the past
+        year += 2000 if year <= date.today().year % 100 + 15 else 1900
+    if not 1900 <= year <= date.today().year + 15:
+        return None
+    try:
+        if day is None:
+            return date(year, month, 1).isoformat()[:7]
+        return date(year, month, int(day)).isoformat()
+    except ValueError:
+        return None
+
+
+# Insurance Card
+
+_INSURANCE_NUMBER = re.compile(r"\b([A-Z])\s?(\d{9})\b")
+_NUMBER_LABEL = re.compile(
+    r"versicherten-?\s?(?:nummer|nr\.?)|versicherungs-?\s?(?:nummer|nr\.?)|persönliche kennnummer"
+    r"|personal identification number", re.I)
+_INSURER_LABEL = re.compile(
+    r"krankenkasse bzw\. kostenträger|kennnummer des trägers|identification number of the institution", re.I)
+_SURNAME_LABEL = re.compile(r"(?:^|\d\s)(?:name|surname)\b(?!,)", re.I)
+_GIVEN_NAME_LABEL = re.compile(r"\b(?:vornamen?|given names?)\b", re.I)
+_FULL_NAME_LABEL = re.compile(r"\bname,\s?vorname\b(?: des versicherten)?", re.I)
+_VALID_FROM_LABEL = re.compile(r"\bgültig ab\b|\bvalid from\b", re.I)
+_VALID_UNTIL_LABEL = re.compile(r"\bgültig bis\b|\bablaufdatum\b|\bexpiry date\b|\bvalid until\b", re.I)
+_INSURER = re.compile(
+    r"\b(?:AOK|BKK|IKK|DAK|Barmer|Techniker|TK|KKH|hkk|HEK|Knappschaft|LKK|SVLFG|Krankenkasse|Ersatzkasse"
+    r"|Gesundheitskasse|Krankenversicherung|Betriebskrankenkasse)\b", re.I)
+_NAME_WORD = re.compile(r"^(?:[A-ZÄÖÜ][a-zäöüß]*\.?|[A-ZÄÖÜ][A-Za-zÄÖÜäöüß'-]+|von|van|de|zu|der|den)$")
+_ANY_LABEL = (_NUMBER_LABEL, _INSURER_LABEL, _VALID_FROM_LABEL, _VALID_UNTIL_LABEL, _GIVEN_NAME_LABEL)
+
+
+def insurance_number_valid(number: str) -> bool:
+    """
+    Checks the check digit of a Krankenversichertennummer (letter + 8 digits + check digit):
+    the letter becomes its two-digit position in the alphabet, the ten digits are weighted
+    1, 2, 1, 2, ... and the digit sums of the products add up to the check digit mod 10.
+    """
+    if not re.fullmatch(r"[A-Z]\d{9}", number):
+        return False
+    digits = f"{ord(number[0]) - ord('A') + 1:02d}{number[1:9]}"
+    total = 0
+    for index, digit in enumerate(digits):
+        product = int(digit) * (1 if index % 2 == 0 else 2)
+        total += product // 10 + product % 10
+    return total % 10 == int(number[9])
+
+
+def _looks_like_name(line: Line) -> bool:
+    words = [word.text.strip(",") for word in line.words]
+    return (1 <= len(words) <= 5 and all(_NAME_WORD.match(word) for word in words)
+            and sum(len(word) > 1 for word in words) >= 1
+            and not _INSURER.search(line.text) and not any(label.search(line.text) for label in _ANY_LABEL))
+
+
+def _name_above(lines: list[Line], number_line: Line) -> Optional[str]:
+    """The eGK front prints the name (one or two lines) directly above the Versichertennummer."""
+    index = lines.index(number_line)
+    names = []
+    anchor = number_line
+    for line in reversed(lines[:index]):
+        if anchor.top - line.bottom > 1.5 * anchor.height or not _looks_like_name(line):
+            break
+        names.insert(0, line.text)
+        anchor = line
+        if len(names) == 2:
+            break
+    return " ".join(names) or None
+
+
+def parse_insurance_card(lines: list[Line]) -> list[dict]:
+    """Insurer, insured name, Versichertennummer and validity dates of an insurance card."""
+    candidates = [(line, match.group(1) + match.group(2))
+                  for line in lines for match in _INSURANCE_NUMBER.finditer(line.text)]
+    if not candidates:
+        raise CardParseError("no Versichertennummer")
+    valid = [(line, number) for line, number in candidates if insurance_number_valid(number)]
+    if not valid:
+        raise CardParseError(f"Versichertennummer {candidates[0][1]} fails the check digit")
+    number_line, number = valid[0]
+
+    insurer = _labelled_value(lines, _INSURER_LABEL)
+    if insurer:
+        # EHIC: "108310400 - AOK Bayern"
+        insurer = re.sub(r"^\d{9}\s*-?\s*", "", insurer)
+    else:
+        insurer_lines = [line for line in lines if _INSURER.search(line.text) and line is not number_line]
+        insurer = insurer_lines[0].text if insurer_lines else None
+    if not insurer:
+        raise CardParseError("no insurer")
+
+    name = _labelled_value(lines, _FULL_NAME_LABEL)
+    if not name:
+        surname, given = _labelled_value(lines, _SURNAME_LABEL), _labelled_value(lines, _GIVEN_NAME_LABEL)
+        name = " ".join(part for part in (given, surname) if part) or _name_above(lines, number_line)
+    if not name or not re.search(r"[A-Za-zÄÖÜäöüß]{2}", name) or re.search(r"\d", name):
+        raise CardParseError("no insured name")
+
+    keypoints = [
+        {"key": "Insurer", "value": insurer, "category": "insurance"},
+        {"key": "Insured Name", "value": name, "category": "patient"},
+        {"key": "Versichertennummer", "value": number, "category": "insurance"},
+    ]
+    for key, label in (("Valid From", _VALID_FROM_LABEL), ("Valid Until", _VALID_UNTIL_LABEL)):
+        value = _labelled_value(lines, label)
+        if value is None:
+            continue
+        if parse_date(value) is None:
+            raise CardParseError(f"{key} '{value}' is not a date")
+        keypoints.append({"key": key, "value": _DATE.search(value).group(0), "category": "insurance"})
+    return keypoints
+
+
+# Vaccination Card
+
+_COLUMN_HEADERS = {
+    "date": re.compile(r"^(?:datum|date)\b", re.I),
+    "vaccine": re.compile(r"^(?:impfstoff|handelsname|vaccine|präparat|trade)", re.I),
+    "batch": re.compile(r"^(?:charge|chargen|ch\.?-?b\.?|batch|lot)", re.I),
+    "disease": re.compile(r"^(?:krankheit|impfung|disease|gegen)", re.I),
+    # Stamp and signature are not extracted, but their column must not spill into the others
+    "stamp": re.compile(r"^(?:stempel|unterschrift|arzt|signature|stamp)", re.I),
+}
+_BATCH = re.compile(r"^(?:ch\.?-?b\.?:?\s*)?([A-Z0-9][A-Z0-9./-]{2,})$", re.I)
+
+
+def _header_columns(line: Line) -> dict[str, float]:
+    """The column kinds named in a line, with the horizontal center of their first header word."""
+    columns: dict[str, float] = {}
+    for word in line.words:
+        for kind, header in _COLUMN_HEADERS.items():
+            if header.match(word.text.strip(" /:")):
+                columns.setdefault(kind, word.center_x)
+                break
+    return columns
+
+
+def parse_vaccination_card(lines: list[Line]) -> list[dict]:
+    """One keypoint per row of the vaccination table: vaccine (disease), date, batch."""
+    for header_index, line in enumerate(lines):
+        columns = _header_columns(line)
+        if "date" in columns and "vaccine" in columns:
+            break
+    else:
+        raise CardParseError("no vaccination table header")
+    body = lines[header_index + 1:]
+    # Headers are often set on two lines ("Impfstoff /" over "Handelsname", "Chargen-" over "Nr.")
+    while body and body[0].top - lines[header_index].bottom < 1.5 * lines[header_index].height and _header_columns(body[0]):
+        for kind, center in _header_columns(body.pop(0)).items():
+            columns.setdefault(kind, center)
+
+    ordered = sorted(columns.items(), key=lambda column: column[1])
+    bounds = [(ordered[i][1] + ordered[i + 1][1]) / 2 for i in range(len(ordered) - 1)]
+
+    def column_of(word: OcrWord) -> str:
+        return ordered[sum(word.center_x > bound for bound in bounds)][0]
+
+    rows: list[dict[str, list[str]]] = []
+    for line in body:
+        if len(_header_columns(line)) >= 2:
+            # The header repeated further down the page
+            continue
+        cells: dict[str, list[str]] = {}
+        for word in line.words:
+            cells.setdefault(column_of(word), []).append(word.text)
+        if parse_date(" ".join(cells.get("date", []))):
+            rows.append(cells)
+        elif rows:
+            # A wrapped cell of the previous row
+            for kind, words in cells.items():
+                rows[-1].setdefault(kind, []).extend(words)
+    if not rows:
+        raise CardParseError("no vaccination rows")
+
+    keypoints = []
+    for cells in rows:
+        printed_date = _DATE.search(" ".join(cells["date"])).group(0)
+        if parse_date(printed_date) > date.today().isoformat():
+            raise CardParseError(f"vaccination date {printed_date} lies in the future")
+        vaccine = " ".join(cells.get("vaccine", [])).strip(" ,")
+        if not re.search(r"[A-Za-zÄÖÜäöüß]{2}", vaccine):
+            raise CardParseError(f"no vaccine in the row of {printed_date}")
+        value = vaccine
+        disease = " ".join(cells.get("disease", [])).strip(" ,")
+        if disease:
+            value += f" ({disease})"
+        value += f", {printed_date}"
+        batch = " ".join(cells.get("batch", [])).strip(" ,")
+        if batch:
+            match = _BATCH.match(batch)
+            if match is None or not re.search(r"\d", match.group(1)):
+                raise CardParseError(f"batch '{batch}' in the row of {printed_date} is not a batch number")
+            value += f", batch {match.group(1)}"
+        keypoints.append({"key": "Vaccination", "value": value, "category": "vaccination"})
+    return keypoints
+
+
+_PARSERS = {"Insurance Card": parse_insurance_card, "Vaccination Card": parse_vaccination_card}
+
+
+def extract_card_keypoints(doc_type: str, words: Optional[list[OcrWord]]) -> Optional[list[dict]]:
+    """
+    The keypoints of an Insurance or Vaccination Card read from the OCR layout, or None when
+    the document is no card, the OCR backend reported no layout or the parse fails validation.
+    """
+    parser = _PARSERS.get(doc_type)
+    if parser is None or not CARD_LAYOUT_ENABLED:
+        return None
+    if not words:
+        CARD_PARSES.inc(doc_type=doc_type, outcome="no_layout")
+        return None
+    try:
+        keypoints = parser(group_lines(words))
+    except CardParseError as e:
+        CARD_PARSES.inc(doc_type=doc_type, outcome="invalid")
+        print(f"Card layout parse of the {doc_type} failed ({e}); falling back to the LLM.")
+        return None
+    CARD_PARSES.inc(doc_type=doc_type, outcome="ok")
+    return keypoints
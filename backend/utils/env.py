@@ -0,0 +1,17 @@
+from functools import lru_cache
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+PROJECT_ROOT = BACKEND_DIR.parent
+
+
+@lru_cache(maxsize=1)
+def load_env():
+    """
+    Loads the .env file (backend/.env, then the repository root .env) into the process
+    environment, once. Variables that are already set take precedence.
+    """
+    from dotenv import load_dotenv
+
+    load_dotenv(BACKEND_DIR / ".env")
+    load_dotenv(PROJECT_ROOT / ".env")
@@ -0,0 +1,232 @@
+"""
+Event fan-out for the server-sent event streams.
+
+Background jobs publish events (report generation progress, new report versions) on
+the patient's channel; every open /events stream of that patient receives them, so the
+dashboard only fetches the report when it changed instead of polling. The background
+processing of each upload publishes its stage transitions on the upload's own channel
+(/uploads/{image_id}/progress).
+
+EVENT_BROKER selects how events reach the streams:
+    memory - in-process fan-out (default); enough for a single worker
+    redis  - events go through Redis pub/sub (REDIS_URL) so that streams served by any
+             worker receive events published by any other; needs the `redis` package
+
+The broker is started with the app (main.py lifespan). The Redis broker then subscribes
+before the first request is served, so every worker records the upload events it replays
+from startup on, not only from its first subscriber on.
+"""
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import AsyncIterator, Optional
+
+from utils.metrics import REGISTRY
+
+EVENTS_PUBLISHED = REGISTRY.counter(
+    "events_published_total", "Events published, by type.", ("type",))
+EVENT_SUBSCRIBERS = REGISTRY.gauge(
+    "event_subscribers", "Open event streams in this worker.")
+EVENTS_DROPPED = REGISTRY.counter(
+    "events_dropped_total", "Events dropped because a subscriber fell too far behind.")
+
+
+UPLOAD_CHANNEL_PREFIX = "upload:"
+
+
+def patient_channel(patient_id: str, tenant_id: str) -> str:
+    return f"{tenant_id}:{patient_id}"
+
+
+def upload_channel(image_id: str) -> str:
+    return f"{UPLOAD_CHANNEL_PREFIX}{image_id}"
+
+
+class EventBroker:
+    """
+    In-process broker: delivers published events to the local subscribers of a channel.
+    For channels named in `replay_prefixes` the recent events are kept (bounded number of
+    channels, events and age) and replayed to late subscribers, e.g. a client that opens
+    an upload's progress stream after the upload request returned.
+    """
+
+    def __init__(self, queue_size: int = 100, replay_prefixes: tuple = (UPLOAD_CHANNEL_PREFIX,),
+                 replay_channels: int = 1000, replay_events: int = 20, replay_ttl_seconds: float = 600):
+        self._queue_size = queue_size
+        self._subscribers: dict[str, set[asyncio.Queue]] = {}
+        self._replay_prefixes = replay_prefixes
+        self._replay_channels = replay_channels
+        self._replay_events = replay_events
+        self._replay_ttl_seconds = replay_ttl_seconds
+        self._history: OrderedDict[str, deque] = OrderedDict()
+
+    async def start(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, channel: str, event: dict):
+        self._deliver(channel, event)
+
+    def _remember(self, channel: str, event: dict):
+        history = self._history.get(channel)
+        if history is None:
+            history = self._history[channel] = deque(maxlen=self._replay_events)
+            while len(self._history) > self._replay_channels:
+                self._history.popitem(last=False)
+        history.append((time.monotonic(), event))
+
+    def history(self, channel: str) -> list[dict]:
+        cutoff = time.monotonic() - self._replay_ttl_seconds
+        return [event for created, event in self._history.get(channel, ()) if created >= cutoff]
+
+    def _deliver(self, channel: str, event: dict):
+        if channel.startswith(self._replay_prefixes):
+            self._remember(channel, event)
+        for queue in list(self._subscribers.get(channel, ())):
+            if queue.full():
+                # A slow client loses its oldest event rather than blocking the publisher
+                queue.get_nowait()
+                EVENTS_DROPPED.inc()
+            queue.put_nowait(event)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[asyncio.Queue]:
+        """
+        Yields a queue receiving the channel's events until the block exits, starting
+        with the channel's replayed recent events, if any.
+        """
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self._queue_size)
+        for event in self.history(channel)[-self._queue_size:]:
+            queue.put_nowait(event)
+        self._subscribers.setdefault(channel, set()).add(queue)
+        EVENT_SUBSCRIBERS.inc()
+        try:
+            yield queue
+        finally:
+            EVENT_SUBSCRIBERS.dec()
+            subscribers = self._subscribers.get(channel)
+            if subscribers is not None:
+                subscribers.discard(queue)
+                if not subscribers:
+                    del self._subscribers[channel]
+
+
+class RedisEventBroker(EventBroker):
+    """
+    Broker for several workers: events are published to Redis and every worker runs one
+    pattern subscription that hands them to its local subscribers.
+    """
+
+    def __init__(self, url: str, prefix: str = "patient-events:", start_timeout: float = 5.0, **kwargs):
+        super().__init__(**kwargs)
+        import redis.asyncio as redis  # Optional dependency, only needed with EVENT_BROKER=redis
+
+        self._redis = redis.from_url(url)
+        self._prefix = prefix
+        self._start_timeout = start_timeout
+        self._listener: Optional[asyncio.Task] = None
+        self._subscribed = asyncio.Event()
+
+    async def start(self):
+        """Starts the pattern subscription and waits (up to `start_timeout`) until Redis confirmed it."""
+        if self._listener is None or self._listener.done():
+            self._subscribed.clear()
+            self._listener = asyncio.create_task(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout=self._start_timeout)
+        except asyncio.TimeoutError:
+            # The listener keeps reconnecting; events published until then are missed
+            print(f"Redis event subscription not confirmed within {self._start_timeout:.0f}s.")
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+
+    async def publish(self, channel: str, event: dict):
+        await self._redis.publish(self._prefix + channel, json.dumps(event))
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub()
+                await pubsub.psubscribe(self._prefix + "*")
+                async for message in pubsub.listen():
+                    if message.get("type") == "psubscribe":
+                        # From now on every published event reaches this worker
+                        self._subscribed.set()
+                    if message.get("type") != "pmessage":
+                        continue
+                    channel = message["channel"]
+                    if isinstance(channel, bytes):
+                        channel = channel.decode()
+                    self._deliver(channel[len(self._prefix):], json.loads(message["data"]))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._subscribed.clear()
+                print(f"Redis event subscription failed, reconnecting: {str(e)}")
+                await asyncio.sleep(1)
+
+    @asynccontextmanager
+    async def subscribe(self, channel: str) -> AsyncIterator[asyncio.Queue]:
+        if not self._subscribed.is_set():
+            # Normally started with the app; waits out a reconnect
+            await self.start()
+        async with super().subscribe(channel) as queue:
+            yield queue
+
+
+@lru_cache(maxsize=1)
+def get_event_broker() -> EventBroker:
+    broker = os.getenv("EVENT_BROKER", "memory")
+    if broker == "memory":
+        return EventBroker()
+    if broker == "redis":
+        return RedisEventBroker(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+    raise ValueError(f"Unknown EVENT_BROKER '{broker}', expected 'memory' or 'redis'")
+
+
+async def publish_event(patient_id: str, tenant_id: str, event_type: str, data: dict):
+    """Publishes an event on the patient's channel. Failures are logged, never raised."""
+    EVENTS_PUBLISHED.inc(type=event_type)
+    try:
+        await get_event_broker().publish(patient_channel(patient_id, tenant_id), {
+            "type": event_type, "data": data, "time": time.time()})
+    except Exception as e:
+        print(f"Failed to publish {event_type} event: {str(e)}")
+
+
+class UploadProgress:
+    """
+    Publishes the stage transitions of one upload's background processing on its
+    upload channel, with the time spent in the stage and since the upload started.
+    """
+
+    TERMINAL_STAGES = ("saved", "failed")
+
+    def __init__(self, image_id: str):
+        self.image_id = image_id
+        self.started = time.perf_counter()
+        self._last = self.started
+
+    async def stage(self, stage: str, **data):
+        now = time.perf_counter()
+        event = {"image_id": self.image_id, "stage": stage,
+                 "stage_seconds": round(now - self._last, 3),
+                 "elapsed_seconds": round(now - self.started, 3), **data}
+        self._last = now
+        EVENTS_PUBLISHED.inc(type="upload.progress")
+        try:
+            await get_event_broker().publish(upload_channel(self.image_id), {
+                "type": "upload.progress", "data": event, "time": time.time()})
+        except Exception as e:
+            print(f"Failed to publish upload progress: {str(e)}")
@@ -1,33 +1,95 @@
 import os
-import time
+from functools import lru_cache
+from typing import Optional
 
-from dotenv import load_dotenv
-from google.cloud import vision
-from google.oauth2 import service_account
+from utils.env import load_env
+from utils.metrics import timed
 
-load_dotenv(override=True)
 
-if int(os.getenv("PRODUCTION", "0")):
-    # Load your service account key from environment variable
-    credentials = None
-    client = vision.ImageAnnotatorClient()
-else:
+@lru_cache(maxsize=1)
+def get_vision_client():
+    """
+    Builds the Google Vision client on first use, so importing this module neither loads
+    the SDK nor reads credentials and a missing key file only affects OCR calls.
+    """
+    load_env()
+    from google.cloud import vision
+
+    if os.getenv("GOOGLE_VISION_ENDPOINT"):
+        # Self-hosted or local stand-in endpoint (e.g. the offline benchmark fakes), spoken to over REST
+        from google.auth.credentials import AnonymousCredentials
+        return vision.ImageAnnotatorClient(
+            credentials=AnonymousCredentials(),
+            transport="rest",
+            client_options={"api_endpoint": os.getenv("GOOGLE_VISION_ENDPOINT")},
+        )
+    if int(os.getenv("PRODUCTION", "0")):
+        # Use the default service account credentials of the environment
+        return vision.ImageAnnotatorClient()
     # Load your service account key locally
+    from google.oauth2 import service_account
     credentials = service_account.Credentials.from_service_account_file(
         "google-key.json")
-    client = vision.ImageAnnotatorClient(credentials=credentials)
+    return vision.ImageAnnotatorClient(credentials=credentials)
 
 
 def extract_text_from_image_using_google(content: bytes):
     """
     Extract text from an image using Google Vision.
     """
-    start = time.time()
-    image = vision.Image(content=content)
-    response = client.text_detection(image=image)
-    text = response.full_text_annotation.text
-    end = time.time()
-    result_google = end - start
-    print(f"Text extraction via Google Vision: {result_google} seconds")
-    print(f"Extracted text: {text}")
+    text, _ = extract_text_and_confidence_using_google(content)
     return text
+
+
+def extract_text_and_confidence_using_google(content: bytes) -> tuple[str, Optional[float]]:
+    """
+    Extracts the text of an image with Google Vision, together with the mean confidence
+    of the detected pages (None when Vision reports none).
+    """
+    text, confidence, _ = extract_text_and_layout_using_google(content)
+    return text, confidence
+
+
+def _layout_words(annotation) -> list[tuple[str, float, float, float, float]]:
+    """
+    The words of a full_text_annotation as (text, left, top, right, bottom), with the
+    coordinates relative to the page size (0..1); later pages continue below (top + page index).
+    """
+    words = []
+    for index, page in enumerate(annotation.pages):
+        boxes = []
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    vertices = word.bounding_box.vertices
+                    if not vertices:
+                        continue
+                    text = "".join(symbol.text for symbol in word.symbols)
+                    xs = [vertex.x for vertex in vertices]
+                    ys = [vertex.y for vertex in vertices]
+                    boxes.append((text, min(xs), min(ys), max(xs), max(ys)))
+        # Vision reports the page size in pixels; fall back to the extent of the words
+        width = page.width or max((box[3] for box in boxes), default=0) or 1
+        height = page.height or max((box[4] for box in boxes), default=0) or 1
+        words.extend((text, left / width, index + top / height, right / width, index + bottom / height)
+                     for text, left, top, right, bottom in boxes if text.strip())
+    return words
+
+
+def extract_text_and_layout_using_google(content: bytes) -> tuple[str, Optional[float], list]:
+    """
+    Like extract_text_and_confidence_using_google, plus the word boxes of the page layout
+    (see _layout_words) that the card extractor (utils/card_layout.py) reads fields from.
+    """
+    from google.cloud import vision
+
+    client = get_vision_client()
+    image = vision.Image(content=content)
+    with timed("ocr", provider="google_vision"):
+        response = client.text_detection(image=image)
+    if response.error.message:
+        raise RuntimeError(f"Google Vision error: {response.error.message}")
+    annotation = response.full_text_annotation
+    confidences = [page.confidence for page in annotation.pages if page.confidence]
+    confidence = sum(confidences) / len(confidences) if confidences else None
+    return annotation.text, confidence, _layout_words(annotation)
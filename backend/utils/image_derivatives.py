@@ -0,0 +1,108 @@
+"""
+Size-tiered WebP derivatives of uploaded document photos.
+
+Phone photos of documents are several megabytes; the dashboard only needs a thumbnail
+for the document list and a screen-sized image for the preview dialog and the report's
+reference links. Both are rendered once at ingest and stored next to the original:
+
+    thumbnail - longest side DERIVATIVE_SIZES["thumbnail"] px
+    screen    - longest side DERIVATIVE_SIZES["screen"] px
+
+Decoding and resizing a 12 MP photo is CPU-bound and holds the GIL for most of the
+work, so it runs in a small process pool (DERIVATIVE_WORKERS, default 2 or the CPU
+count if lower) rather than in the event loop's thread pool. The workers run at a lower
+CPU priority (DERIVATIVE_NICENESS, default 10) so renders do not slow down requests.
+Pillow is imported by the worker processes only.
+"""
+
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from utils.metrics import REGISTRY, timed
+
+DERIVATIVE_SIZES = {"thumbnail": 256, "screen": 1600}
+DERIVATIVE_CONTENT_TYPE = "image/webp"
+WEBP_QUALITY = {"thumbnail": 70, "screen": 80}
+
+DERIVATIVE_BYTES = REGISTRY.counter(
+    "image_derivative_bytes_total", "Bytes of stored image derivatives, by size tier.", ("tier",))
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+
+def render_derivatives(image_bytes: bytes) -> dict[str, bytes]:
+    """
+    Renders every tier of DERIVATIVE_SIZES as WebP. Runs in a worker process.
+    Images smaller than a tier are re-encoded but never upscaled.
+    """
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        # Phone cameras store the orientation in EXIF instead of rotating the pixels
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "transparency" in image.info else "RGB")
+        # Largest tier first; each smaller tier is resized from the previous one
+        derivatives = {}
+        for tier, size in sorted(DERIVATIVE_SIZES.items(), key=lambda item: -item[1]):
+            image = image.copy() if max(image.size) <= size else image.resize(
+                _fit(image.size, size), Image.Resampling.LANCZOS)
+            buffer = io.BytesIO()
+            image.save(buffer, "WEBP", quality=WEBP_QUALITY.get(tier, 80), method=4)
+            derivatives[tier] = buffer.getvalue()
+    return derivatives
+
+
+def _fit(size: tuple[int, int], longest_side: int) -> tuple[int, int]:
+    width, height = size
+    scale = longest_side / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def get_derivative_pool() -> ProcessPoolExecutor:
+    """
+    Returns the process-wide pool. Workers are spawned rather than forked: the server
+    process runs threads (SDK clients, the thread pool) that must not be forked.
+    """
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(
+            max_workers=int(os.getenv("DERIVATIVE_WORKERS", str(min(2, os.cpu_count() or 1)))),
+            mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker)
+    return _pool
+
+
+def shutdown_derivative_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=True, cancel_futures=True)
+        _pool = None
+
+
+def warm_derivative_pool():
+    """Starts the worker processes ahead of the first upload."""
+    get_derivative_pool().submit(int).result()
+
+
+def _init_worker():
+    # Rendering is background work: on a busy host the request handlers get the CPU first
+    try:
+        os.nice(int(os.getenv("DERIVATIVE_NICENESS", "10")))
+    except (AttributeError, OSError):
+        pass
+    import PIL.Image  # noqa: F401  Imported once per worker so the first upload does not pay for it
+    import PIL.WebPImagePlugin  # noqa: F401
+
+
+async def create_derivatives(image_bytes: bytes) -> dict[str, bytes]:
+    """Renders the derivatives of an uploaded image in the process pool."""
+    loop = asyncio.get_running_loop()
+    with timed("derivatives.render"):
+        derivatives = await loop.run_in_executor(get_derivative_pool(), render_derivatives, image_bytes)
+    for tier, data in derivatives.items():
+        DERIVATIVE_BYTES.inc(len(data), tier=tier)
+    return derivatives
@@ -0,0 +1,236 @@
+"""
+Per-patient columnar store of lab values for the dashboard's trend graphs.
+
+Lab Report documents are parsed into (analyte, value, unit, reference range, date,
+source document) rows in the background pipeline and persisted in grandma_lab_values.
+For reads, a patient's rows are loaded once into NumPy columns grouped by analyte and
+sorted by date, so /labs/{analyte} is a dict lookup plus a searchsorted slice.
+
+Values are normalized to one canonical unit per analyte (e.g. creatinine in mg/dL, so
+µmol/L results from another lab land on the same graph) with vectorized affine
+conversions, and flagged against their normalized reference range.
+"""
+
+import re
+import threading
+import time
+from dataclasses import dataclass
+from datetime import date
+from typing import Optional
+
+import numpy as np
+
+from utils.metrics import REGISTRY
+
+# Analyte names as they appear on (German and English) lab reports -> canonical name
+ANALYTE_ALIASES = {
+    "hb": "hemoglobin", "hgb": "hemoglobin", "hämoglobin": "hemoglobin", "haemoglobin": "hemoglobin",
+    "kreatinin": "creatinine", "crea": "creatinine",
+    "glukose": "glucose", "blutzucker": "glucose", "nüchternglukose": "glucose",
+    "cholesterin": "cholesterol", "gesamtcholesterin": "cholesterol", "total cholesterol": "cholesterol",
+    "ldl": "ldl cholesterol", "ldl-cholesterin": "ldl cholesterol", "ldl-cholesterol": "ldl cholesterol",
+    "hdl": "hdl cholesterol", "hdl-cholesterin": "hdl cholesterol", "hdl-cholesterol": "hdl cholesterol",
+    "triglyceride": "triglycerides",
+    "kalium": "potassium", "k": "potassium", "k+": "potassium",
+    "natrium": "sodium", "na": "sodium", "na+": "sodium",
+    "c-reaktives protein": "crp", "c-reactive protein": "crp",
+    "hba1c": "hba1c", "hämoglobin a1c": "hba1c",
+    "nt-probnp": "nt-probnp", "ntprobnp": "nt-probnp",
+    "leukozyten": "leukocytes", "wbc": "leukocytes", "leukocytes": "leukocytes",
+    "thrombozyten": "platelets", "plt": "platelets",
+}
+
+# Canonical unit per analyte and (scale, offset) conversions into it: canonical = value * scale + offset
+UNIT_CONVERSIONS = {
+    "hemoglobin": ("g/dl", {"g/dl": (1.0, 0.0), "g/l": (0.1, 0.0), "mmol/l": (1.611, 0.0)}),
+    "creatinine": ("mg/dl", {"mg/dl": (1.0, 0.0), "umol/l": (1 / 88.42, 0.0)}),
+    "glucose": ("mg/dl", {"mg/dl": (1.0, 0.0), "mmol/l": (18.016, 0.0)}),
+    "cholesterol": ("mg/dl", {"mg/dl": (1.0, 0.0), "mmol/l": (38.67, 0.0)}),
+    "ldl cholesterol": ("mg/dl", {"mg/dl": (1.0, 0.0), "mmol/l": (38.67, 0.0)}),
+    "hdl cholesterol": ("mg/dl", {"mg/dl": (1.0, 0.0), "mmol/l": (38.67, 0.0)}),
+    "triglycerides": ("mg/dl", {"mg/dl": (1.0, 0.0), "mmol/l": (88.57, 0.0)}),
+    "potassium": ("mmol/l", {"mmol/l": (1.0, 0.0), "meq/l": (1.0, 0.0)}),
+    "sodium": ("mmol/l", {"mmol/l": (1.0, 0.0), "meq/l": (1.0, 0.0)}),
+    "crp": ("mg/l", {"mg/l": (1.0, 0.0), "mg/dl": (10.0, 0.0)}),
+    "hba1c": ("%", {"%": (1.0, 0.0), "mmol/mol": (0.0915, 2.15)}),
+    "nt-probnp": ("pg/ml", {"pg/ml": (1.0, 0.0), "ng/l": (1.0, 0.0)}),
+    "leukocytes": ("10^9/l", {"10^9/l": (1.0, 0.0), "g/l": (1.0, 0.0), "10^3/ul": (1.0, 0.0),
+                              "/nl": (1.0, 0.0), "/ul": (0.001, 0.0)}),
+    "platelets": ("10^9/l", {"10^9/l": (1.0, 0.0), "g/l": (1.0, 0.0), "10^3/ul": (1.0, 0.0),
+                             "/nl": (1.0, 0.0), "/ul": (0.001, 0.0)}),
+}
+
+# Spellings of count units on German reports (Tausend/µl, Gigapartikel/l) and per-mm³
+# counts, after normalize_unit's other rewrites -> the spelling UNIT_CONVERSIONS uses
+UNIT_ALIASES = {
+    "tsd/ul": "10^3/ul", "tsd./ul": "10^3/ul", "tsd/mm^3": "10^3/ul", "10^3/mm^3": "10^3/ul",
+    "gpt/l": "10^9/l", "/mm^3": "/ul",
+}
+
+_SUPERSCRIPTS = str.maketrans("⁰¹²³⁴⁵⁶⁷⁸⁹", "0123456789")
+
+UNCONVERTED_ROWS = REGISTRY.counter(
+    "lab_values_unconverted_rows_total",
+    "Lab values whose unit could not be converted to the analyte's canonical unit (counted per series build).")
+
+FLAG_LOW, FLAG_NORMAL, FLAG_HIGH, FLAG_UNKNOWN = -1, 0, 1, 2
+FLAG_NAMES = {FLAG_LOW: "low", FLAG_NORMAL: "normal", FLAG_HIGH: "high", FLAG_UNKNOWN: None}
+
+
+def normalize_analyte(name: str) -> str:
+    name = re.sub(r"\s+", " ", (name or "").strip().lower())
+    return ANALYTE_ALIASES.get(name, name)
+
+
+def normalize_unit(unit: Optional[str]) -> str:
+    """Lower-cased, space-free spelling of a unit, e.g. "×10³/µl" -> "10^3/ul"."""
+    unit = (unit or "").strip().lower().replace(" ", "")
+    unit = unit.replace("μ", "u").replace("µ", "u").replace("×", "x").replace("*", "x")
+    unit = re.sub(r"[⁰¹²³⁴⁵⁶⁷⁸⁹]+", lambda match: "^" + match.group().translate(_SUPERSCRIPTS), unit)
+    unit = unit.replace("x10", "10")
+    return UNIT_ALIASES.get(unit, unit)
+
+
+def _conversion_arrays(analytes: np.ndarray, units: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scale, offset and canonical unit per row. The lookups run once per distinct
+    (analyte, unit) pair; rows are mapped back through np.unique's inverse index.
+    Unknown analytes keep their most common unit; rows in any other unit get NaN.
+    """
+    pairs = np.char.add(np.char.add(analytes.astype(str), "\x1f"), units.astype(str))
+    unique_pairs, inverse = np.unique(pairs, return_inverse=True)
+
+    fallback_units = {}
+    for analyte in np.unique(analytes):
+        if analyte not in UNIT_CONVERSIONS:
+            values, counts = np.unique(units[analytes == analyte], return_counts=True)
+            fallback_units[analyte] = values[np.argmax(counts)]
+
+    scale = np.full(len(unique_pairs), np.nan)
+    offset = np.zeros(len(unique_pairs))
+    canonical = np.empty(len(unique_pairs), dtype=object)
+    for i, pair in enumerate(unique_pairs):
+        analyte, unit = pair.split("\x1f")
+        if analyte in UNIT_CONVERSIONS:
+            canonical[i], conversions = UNIT_CONVERSIONS[analyte]
+            if unit in conversions:
+                scale[i], offset[i] = conversions[unit]
+        else:
+            canonical[i] = fallback_units[analyte]
+            if unit == canonical[i]:
+                scale[i] = 1.0
+    return scale[inverse], offset[inverse], canonical[inverse]
+
+
+@dataclass
+class LabSeries:
+    """One analyte's measurements for one patient, sorted by date."""
+    analyte: str
+    unit: str
+    dates: np.ndarray            # datetime64[D]
+    values: np.ndarray           # float64, in `unit` (NaN if the unit could not be converted)
+    reference_low: np.ndarray    # float64, in `unit`, NaN if unknown
+    reference_high: np.ndarray
+    flags: np.ndarray            # int8, FLAG_*
+    raw_values: np.ndarray       # float64 as reported
+    raw_units: np.ndarray        # object, as reported
+    file_ids: np.ndarray         # object, source document (grandma_files.id)
+
+    def window(self, since: Optional[date] = None, until: Optional[date] = None) -> slice:
+        start = 0 if since is None else int(np.searchsorted(self.dates, np.datetime64(since, "D"), "left"))
+        stop = len(self.dates) if until is None else int(
+            np.searchsorted(self.dates, np.datetime64(until, "D"), "right"))
+        return slice(start, stop)
+
+    def to_points(self, since: Optional[date] = None, until: Optional[date] = None) -> list[dict]:
+        window = self.window(since, until)
+        return [self._point(i) for i in range(window.start, window.stop)]
+
+    def latest(self) -> Optional[dict]:
+        return self._point(len(self.dates) - 1) if len(self.dates) else None
+
+    def _point(self, i: int) -> dict:
+        def number(value):
+            return None if np.isnan(value) else round(float(value), 4)
+
+        return {"date": str(self.dates[i]), "value": number(self.values[i]), "unit": self.unit,
+                "reference_low": number(self.reference_low[i]), "reference_high": number(self.reference_high[i]),
+                "flag": FLAG_NAMES[int(self.flags[i])],
+                "raw_value": float(self.raw_values[i]), "raw_unit": self.raw_units[i],
+                "file_id": self.file_ids[i]}
+
+
+def build_lab_series(rows: list[dict]) -> dict[str, LabSeries]:
+    """Builds the per-analyte columns of a patient from grandma_lab_values rows."""
+    if not rows:
+        return {}
+    analytes = np.array([normalize_analyte(row["analyte"]) for row in rows], dtype=object)
+    units = np.array([normalize_unit(row.get("unit")) for row in rows], dtype=object)
+    raw_values = np.array([row["value"] for row in rows], dtype=np.float64)
+    ref_low = np.array([np.nan if row.get("reference_low") is None else row["reference_low"]
+                        for row in rows], dtype=np.float64)
+    ref_high = np.array([np.nan if row.get("reference_high") is None else row["reference_high"]
+                         for row in rows], dtype=np.float64)
+    dates = np.array([row["collected_on"] for row in rows], dtype="datetime64[D]")
+    file_ids = np.array([row.get("file_id") for row in rows], dtype=object)
+    raw_units = np.array([row.get("unit") or "" for row in rows], dtype=object)
+
+    scale, offset, canonical = _conversion_arrays(analytes, units)
+    unconverted = np.isnan(scale)
+    if unconverted.any():
+        UNCONVERTED_ROWS.inc(int(unconverted.sum()))
+        pairs = sorted({f"{analyte} [{unit or '-'}]"
+                        for analyte, unit in zip(analytes[unconverted], units[unconverted])})
+        print(f"Lab values: {int(unconverted.sum())} rows in units that cannot be converted "
+              f"(shown without a value): {', '.join(pairs)}")
+    values = raw_values * scale + offset
+    low = ref_low * scale + offset
+    high = ref_high * scale + offset
+
+    flags = np.full(len(rows), FLAG_UNKNOWN, dtype=np.int8)
+    has_range = ~np.isnan(values) & (~np.isnan(low) | ~np.isnan(high))
+    flags[has_range] = FLAG_NORMAL
+    flags[has_range & (values < low)] = FLAG_LOW
+    flags[has_range & (values > high)] = FLAG_HIGH
+
+    # Group by analyte, then by date within each group
+    order = np.lexsort((dates, analytes.astype(str)))
+    sorted_analytes = analytes[order].astype(str)
+    boundaries = np.flatnonzero(sorted_analytes[1:] != sorted_analytes[:-1]) + 1
+    series = {}
+    for group in np.split(order, boundaries):
+        analyte = analytes[group[0]]
+        series[analyte] = LabSeries(
+            analyte=analyte, unit=canonical[group[0]], dates=dates[group], values=values[group],
+            reference_low=low[group], reference_high=high[group], flags=flags[group],
+            raw_values=raw_values[group], raw_units=raw_units[group], file_ids=file_ids[group])
+    return series
+
+
+class LabStore:
+    """
+    Per-patient cache of LabSeries. Entries are rebuilt from the database when they are
+    older than the TTL (another worker may have added values) or invalidated after this
+    process stored new values for the patient.
+    """
+
+    def __init__(self, load_rows, ttl_seconds: float):
+        self._load_rows = load_rows
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._patients: dict[tuple[str, str], tuple[float, dict[str, LabSeries]]] = {}
+
+    def get(self, patient_id: str, tenant_id: str) -> dict[str, LabSeries]:
+        key = (tenant_id, patient_id)
+        with self._lock:
+            cached = self._patients.get(key)
+        if cached and time.monotonic() - cached[0] < self._ttl_seconds:
+            return cached[1]
+        series = build_lab_series(self._load_rows(patient_id=patient_id, tenant_id=tenant_id))
+        with self._lock:
+            self._patients[key] = (time.monotonic(), series)
+        return series
+
+    def invalidate(self, patient_id: str, tenant_id: str):
+        with self._lock:
+            self._patients.pop((tenant_id, patient_id), None)
@@ -0,0 +1,185 @@
+"""
+Persistent response cache for the LangChain classifier chains.
+
+The validation, recency, clarity, medical relevance, keyword and error-message chains are
+deterministic at temperature 0, yet reprocessing, retries and background re-analysis run
+them again on identical inputs. SQLiteLLMCache plugs in underneath them as a LangChain
+cache, keyed by the model parameters (model name, temperature, ...) and the hash of the
+rendered prompt, with TTL and size-based eviction.
+
+LLM_CACHE_MODE selects how the cache is used:
+    off       - no caching
+    readwrite - serve hits, call the API and store on misses (default)
+    record    - always call the API and store the responses
+    replay    - serve hits only and raise LLMCacheMiss otherwise, for deterministic
+                offline test runs against a previously recorded cache file
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Sequence
+
+from langchain_core.caches import BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+from pydantic import BaseModel
+
+from utils.metrics import REGISTRY
+
+CACHE_LOOKUPS = REGISTRY.counter(
+    "llm_cache_lookups_total",
+    "Classifier chain cache lookups by model and result (hit/miss).",
+    ("model", "result"))
+
+CACHE_MODES = ("off", "readwrite", "record", "replay")
+DEFAULT_CACHE_PATH = Path(__file__).resolve().parent.parent / ".cache" / "llm_cache.sqlite3"
+
+
+class LLMCacheMiss(RuntimeError):
+    """Raised in replay mode when a prompt has no recorded response."""
+
+
+def _hash(value: str) -> str:
+    return hashlib.sha256(value.encode("utf-8")).hexdigest()
+
+
+def _json_default(value):
+    # Structured-output chains attach the parsed pydantic object to the message; it is
+    # stored as a dict, which LangChain's structured output parser accepts as well.
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _serialize(generations: Sequence[Generation]) -> str:
+    return json.dumps([
+        {"message": message_to_dict(g.message)} if isinstance(g, ChatGeneration) else {"text": g.text}
+        for g in generations
+    ], default=_json_default)
+
+
+def _deserialize(payload: str) -> list[Generation]:
+    return [
+        ChatGeneration(message=messages_from_dict([item["message"]])[0]) if "message" in item
+        else Generation(text=item["text"])
+        for item in json.loads(payload)
+    ]
+
+
+def _llm_params(llm_string: str) -> tuple[str, Optional[float]]:
+    """Extracts model name and temperature from LangChain's serialized model parameters."""
+    try:
+        kwargs = json.loads(llm_string.split("---")[0]).get("kwargs", {})
+    except (ValueError, AttributeError):
+        return "unknown", None
+    return kwargs.get("model_name") or kwargs.get("model", "unknown"), kwargs.get("temperature")
+
+
+class SQLiteLLMCache(BaseCache):
+    """LangChain cache stored in a local SQLite file with TTL and LRU size eviction."""
+
+    def __init__(self, path: Path, mode: str = "readwrite",
+                 ttl_seconds: float = 7 * 24 * 3600, max_entries: int = 50_000):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown LLM cache mode '{mode}', expected one of {CACHE_MODES}")
+        self.path = Path(path)
+        self.mode = mode
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._writes_since_eviction = 0
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS llm_cache (
+                key          TEXT PRIMARY KEY,
+                model        TEXT NOT NULL,
+                temperature  REAL,
+                prompt_hash  TEXT NOT NULL,
+                response     TEXT NOT NULL,
+                created_at   REAL NOT NULL,
+                last_access  REAL NOT NULL
+            )""")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS llm_cache_last_access_idx ON llm_cache (last_access)")
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return _hash(_hash(llm_string) + _hash(prompt))
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[Sequence[Generation]]:
+        if self.mode == "record":
+            return None
+        key = self._key(prompt, llm_string)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            # Recorded fixtures never expire in replay mode
+            if row and self.mode != "replay" and now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                row = None
+            if row:
+                self._conn.execute(
+                    "UPDATE llm_cache SET last_access = ? WHERE key = ?", (now, key))
+        model, _ = _llm_params(llm_string)
+        CACHE_LOOKUPS.inc(model=model, result="hit" if row else "miss")
+        if row:
+            return _deserialize(row[0])
+        if self.mode == "replay":
+            raise LLMCacheMiss(
+                f"No recorded {model} response for prompt {_hash(prompt)[:12]} in {self.path}")
+        return None
+
+    def update(self, prompt: str, llm_string: str, return_val: Sequence[Generation]) -> None:
+        if self.mode == "replay":
+            return
+        model, temperature = _llm_params(llm_string)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self._key(prompt, llm_string), model, temperature, _hash(prompt),
+                 _serialize(return_val), now, now))
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= 100:
+                self._evict(now)
+
+    def _evict(self, now: float):
+        """Drops expired entries, then the least recently used ones above max_entries."""
+        self._writes_since_eviction = 0
+        self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        self._conn.execute("""
+            DELETE FROM llm_cache WHERE key IN (
+                SELECT key FROM llm_cache ORDER BY last_access DESC LIMIT -1 OFFSET ?
+            )""", (self.max_entries,))
+
+    def clear(self, **kwargs) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+
+
+@lru_cache(maxsize=1)
+def get_llm_cache():
+    """
+    Returns the process-wide classifier cache configured from the environment, or False
+    (LangChain's "do not cache") when LLM_CACHE_MODE is "off".
+    """
+    mode = os.getenv("LLM_CACHE_MODE", "readwrite")
+    if mode == "off":
+        return False
+    return SQLiteLLMCache(
+        Path(os.getenv("LLM_CACHE_PATH", DEFAULT_CACHE_PATH)),
+        mode=mode,
+        ttl_seconds=float(os.getenv("LLM_CACHE_TTL_SECONDS", 7 * 24 * 3600)),
+        max_entries=int(os.getenv("LLM_CACHE_MAX_ENTRIES", 50_000)),
+    )
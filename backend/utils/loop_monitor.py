@@ -0,0 +1,169 @@
+"""
+Event-loop lag monitor and blocking-call detector.
+
+A synchronous call made from an async handler (an SDK without async support, a sync
+database query) stalls every concurrent request until it returns. Three things watch for
+that:
+
+- A probe task sleeps LOOP_LAG_INTERVAL_SECONDS (default 0.1) in a loop and records how
+  much later than requested it woke up in the `event_loop_lag_seconds` histogram.
+- A watchdog thread notices when the probe has not run for LOOP_BLOCK_THRESHOLD_SECONDS
+  (default 0.25) beyond its interval, prints the stack of the event loop thread (the
+  callback holding the loop) once per stall and counts it in `event_loop_blocked_total`.
+- With LOOP_STRICT=1 (meant for test runs), known blocking APIs (time.sleep, sync httpx
+  and requests sessions, which back the Supabase, OpenAI and Google SDK clients) raise
+  BlockingCallError when called on the event loop thread. Offload them with
+  asyncio.to_thread, or wrap deliberate calls in `allow_blocking()`.
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from utils.metrics import REGISTRY
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR", "1") == "1"
+LAG_INTERVAL_SECONDS = float(os.getenv("LOOP_LAG_INTERVAL_SECONDS", "0.1"))
+BLOCK_THRESHOLD_SECONDS = float(os.getenv("LOOP_BLOCK_THRESHOLD_SECONDS", "0.25"))
+STRICT = os.getenv("LOOP_STRICT", "0") == "1"
+
+LOOP_LAG = REGISTRY.histogram(
+    "event_loop_lag_seconds", "How much later than scheduled the event loop ran the lag probe.",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0))
+LOOP_LAG_LAST = REGISTRY.gauge(
+    "event_loop_lag_last_seconds", "Event loop lag measured by the latest probe.")
+LOOP_BLOCKED = REGISTRY.counter(
+    "event_loop_blocked_total", "Times the event loop was held by one callback for longer than the threshold.")
+BLOCKING_CALLS = REGISTRY.counter(
+    "event_loop_blocking_calls_total", "Known blocking APIs called on the event loop thread (strict mode).",
+    ("api",))
+
+
+class BlockingCallError(RuntimeError):
+    pass
+
+
+class LoopMonitor:
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float = LAG_INTERVAL_SECONDS,
+                 threshold: float = BLOCK_THRESHOLD_SECONDS):
+        self.loop = loop
+        self.interval = interval
+        self.threshold = threshold
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stalled_since: Optional[float] = None
+        self._stopped = threading.Event()
+        self._probe = loop.create_task(self._measure())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watchdog.start()
+
+    async def _measure(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._heartbeat = now = time.monotonic()
+            lag = max(0.0, now - start - self.interval)
+            LOOP_LAG.observe(lag)
+            LOOP_LAG_LAST.set(lag)
+
+    def _watch(self):
+        while not self._stopped.wait(self.threshold / 2):
+            heartbeat = self._heartbeat
+            silent = time.monotonic() - heartbeat
+            if self._stalled_since is not None and heartbeat > self._stalled_since:
+                print(f"Event loop was blocked for {heartbeat - self._stalled_since - self.interval:.2f}s.")
+                self._stalled_since = None
+            if self._stalled_since is None and silent > self.interval + self.threshold:
+                self._stalled_since = heartbeat
+                LOOP_BLOCKED.inc()
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = "".join(traceback.format_stack(frame)) if frame is not None else "(no stack)\n"
+                print(f"Event loop blocked for {silent - self.interval:.2f}s so far; the loop thread is at:\n{stack}", end="")
+
+    def stop(self):
+        self._stopped.set()
+        self._probe.cancel()
+
+
+_monitor: Optional[LoopMonitor] = None
+
+
+def start_loop_monitor():
+    """Starts the lag probe and the watchdog for the running loop (called in the app lifespan)."""
+    global _monitor
+    if STRICT:
+        install_blocking_guards()
+    if LOOP_MONITOR_ENABLED and _monitor is None:
+        _monitor = LoopMonitor(asyncio.get_running_loop())
+
+
+def stop_loop_monitor():
+    global _monitor
+    if _monitor is not None:
+        _monitor.stop()
+        _monitor = None
+
+
+# Strict mode
+
+_blocking_allowed: ContextVar[bool] = ContextVar("blocking_allowed", default=False)
+_installed = False
+
+
+@contextmanager
+def allow_blocking():
+    """Lets a deliberate blocking call through strict mode."""
+    token = _blocking_allowed.set(True)
+    try:
+        yield
+    finally:
+        _blocking_allowed.reset(token)
+
+
+def _on_loop_thread() -> bool:
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def _guard(owner, attribute: str, api: str):
+    original = getattr(owner, attribute)
+
+    def guarded(*args, **kwargs):
+        if _on_loop_thread() and not _blocking_allowed.get():
+            BLOCKING_CALLS.inc(api=api)
+            raise BlockingCallError(f"{api} called on the event loop thread; use asyncio.to_thread")
+        return original(*args, **kwargs)
+
+    guarded.__wrapped__ = original
+    setattr(owner, attribute, guarded)
+
+
+def install_blocking_guards():
+    """
+    Makes the known blocking APIs raise BlockingCallError on the event loop thread.
+    Libraries that are not installed are skipped.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    _guard(time, "sleep", "time.sleep")
+    try:
+        import httpx
+        _guard(httpx.Client, "send", "httpx.Client.send")
+    except ImportError:
+        pass
+    try:
+        import requests
+        _guard(requests.Session, "send", "requests.Session.send")
+    except ImportError:
+        pass
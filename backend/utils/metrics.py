@@ -0,0 +1,245 @@
+"""
+Minimal in-process metrics registry exported in the Prometheus text format at /metrics.
+
+Pipeline code records timings with `timed(stage, provider)`:
+
+    with timed("llm.validate", provider="openai"):
+        result = await chain_validate.ainvoke(...)
+
+which feeds the per-stage latency histogram, the in-flight gauge and, on exceptions,
+the error counter for the provider.
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterable, Optional
+
+# Latency buckets (seconds) covering fast cache hits up to long report generations.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0,
+                   2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames: tuple, labelvalues: tuple, extra: Optional[tuple] = None) -> str:
+    pairs = list(zip(labelnames, labelvalues))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    type_name = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: dict[tuple, object] = {}
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.type_name}"]
+
+
+class Counter(_Metric):
+    type_name = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Gauge(_Metric):
+    type_name = "gauge"
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def collect(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(
+                    f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [per-bucket counts..., +Inf count], sum
+                state = [[0] * (len(self.buckets) + 1), 0.0]
+                self._values[key] = state
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    def count(self, **labels) -> int:
+        state = self._values.get(self._key(labels))
+        return sum(state[0]) if state else 0
+
+    def collect(self) -> list[str]:
+        lines = self.header()
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets, counts):
+                    cumulative += count
+                    lines.append(
+                        f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', repr(float(bound))))} {cumulative}")
+                cumulative += counts[-1]
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', '+Inf'))} {cumulative}")
+                lines.append(
+                    f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(
+                    f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: tuple = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Renders every registered metric in the Prometheus text exposition format."""
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_DURATION = REGISTRY.histogram(
+    "pipeline_stage_duration_seconds",
+    "Duration of a pipeline stage (OCR, LLM chain, Supabase call, report generation, TTS).",
+    ("stage", "provider"))
+STAGE_INFLIGHT = REGISTRY.gauge(
+    "pipeline_stage_inflight",
+    "Number of pipeline stages currently executing.",
+    ("stage",))
+PROVIDER_ERRORS = REGISTRY.counter(
+    "provider_errors_total",
+    "Errors raised by calls to an external provider.",
+    ("provider", "stage"))
+LLM_TOKENS = REGISTRY.counter(
+    "llm_tokens_total",
+    "Tokens reported by the OpenAI API, by model and kind (prompt/completion).",
+    ("model", "kind"))
+HTTP_REQUEST_DURATION = REGISTRY.histogram(
+    "http_request_duration_seconds",
+    "Duration of HTTP requests handled by the API.",
+    ("method", "route", "status"))
+HTTP_INFLIGHT = REGISTRY.gauge(
+    "http_requests_inflight",
+    "Number of HTTP requests currently being handled.")
+BACKGROUND_JOBS_INFLIGHT = REGISTRY.gauge(
+    "background_jobs_inflight",
+    "Number of background jobs (image processing, report generation) currently running.",
+    ("job",))
+
+
+# Innermost stage being timed, so token usage can be attributed to the stage that spent it
+_stage_var: ContextVar[str] = ContextVar("stage", default="unstaged")
+
+
+def current_stage() -> str:
+    return _stage_var.get()
+
+
+@contextmanager
+def timed(stage: str, provider: str = "internal"):
+    """
+    Records the duration of the enclosed block in the per-stage histogram.
+    Exceptions are counted against the provider and re-raised.
+    """
+    STAGE_INFLIGHT.inc(stage=stage)
+    token = _stage_var.set(stage)
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        PROVIDER_ERRORS.inc(provider=provider, stage=stage)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start,
+                               stage=stage, provider=provider)
+        STAGE_INFLIGHT.dec(stage=stage)
+        _stage_var.reset(token)
+
+
+def record_token_usage(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+    """Adds the usage reported by an OpenAI response to the token counters."""
+    if prompt_tokens:
+        LLM_TOKENS.inc(prompt_tokens, model=model, kind="prompt")
+    if completion_tokens:
+        LLM_TOKENS.inc(completion_tokens, model=model, kind="completion")
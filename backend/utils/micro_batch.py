@@ -0,0 +1,123 @@
+"""
+Micro-batching of single LLM calls.
+
+A MicroBatcher gathers the items submitted by concurrent callers for up to `max_wait`
+seconds, or until `max_items` items (or items of `max_cost` total cost, e.g. prompt
+tokens) are pending, and hands them to `run_batch` in one call. `run_batch` returns the
+results it could validate by the items' positions in the batch; every other item is
+retried on its own with `run_one`, as are all items of a batch whose call failed. Items
+that are too costly for any batch go straight to `run_one`.
+
+The batch call runs as a background job (utils/tracing.py), so a caller that stops
+waiting (e.g. a rejected document) does not cancel the batch for the others.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Optional
+
+from utils.metrics import REGISTRY
+from utils.tracing import current_trace_id, spawn_background
+
+BATCH_SIZE = REGISTRY.histogram(
+    "llm_batch_size", "Items per micro-batch call by batcher.", ("batcher",),
+    buckets=(1, 2, 4, 8, 16, 32, 64))
+BATCH_ITEMS = REGISTRY.counter(
+    "llm_batch_items_total",
+    "Micro-batched items by batcher and outcome (batched/retried/single).",
+    ("batcher", "outcome"))
+
+
+@dataclass
+class _Job:
+    item: Any
+    cost: int
+    future: asyncio.Future
+
+
+class MicroBatcher:
+    def __init__(self, name: str, run_batch: Callable[[list], Awaitable[dict[int, Any]]],
+                 run_one: Callable[[Any], Awaitable[Any]], max_items: int, max_wait: float,
+                 max_cost: Optional[int] = None, cost: Callable[[Any], int] = lambda item: 1):
+        self.name = name
+        self.run_batch = run_batch
+        self.run_one = run_one
+        self.max_items = max_items
+        self.max_wait = max_wait
+        self.max_cost = max_cost
+        self.cost = cost
+        self._pending: list[_Job] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def _pending_cost(self) -> int:
+        return sum(job.cost for job in self._pending)
+
+    async def submit(self, item):
+        """Returns the item's result once its batch (or its retry) has run."""
+        cost = self.cost(item)
+        if self.max_items <= 1 or (self.max_cost is not None and cost > self.max_cost):
+            BATCH_ITEMS.inc(batcher=self.name, outcome="single")
+            return await self.run_one(item)
+        if self.max_cost is not None and self._pending_cost() + cost > self.max_cost:
+            self._flush()
+        loop = asyncio.get_running_loop()
+        job = _Job(item, cost, loop.create_future())
+        self._pending.append(job)
+        if len(self._pending) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await job.future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers that stopped waiting have cancelled their futures
+        jobs = [job for job in self._pending if not job.future.done()]
+        self._pending = []
+        if jobs:
+            spawn_background(self._run(jobs), job=f"{self.name}_batch")
+
+    async def _run(self, jobs: list[_Job]):
+        BATCH_SIZE.observe(len(jobs), batcher=self.name)
+        try:
+            results = await self._results(jobs)
+            for i, job in enumerate(jobs):
+                if job.future.done():
+                    continue
+                if isinstance(results[i], BaseException):
+                    job.future.set_exception(results[i])
+                else:
+                    job.future.set_result(results[i])
+        finally:
+            # A batch cancelled at shutdown must not leave its callers waiting
+            for job in jobs:
+                if not job.future.done():
+                    job.future.cancel()
+
+    async def _results(self, jobs: list[_Job]) -> dict[int, Any]:
+        if len(jobs) == 1:
+            # Nothing to share a call with
+            BATCH_ITEMS.inc(batcher=self.name, outcome="single")
+            return {0: await self._run_one(jobs[0])}
+        results: dict[int, Any] = {}
+        try:
+            results = await self.run_batch([job.item for job in jobs])
+        except Exception as e:
+            print(f"[{current_trace_id()}] {self.name} batch of {len(jobs)} failed, retrying one by one: {str(e)}")
+        retries = [i for i in range(len(jobs)) if i not in results]
+        BATCH_ITEMS.inc(len(jobs) - len(retries), batcher=self.name, outcome="batched")
+        BATCH_ITEMS.inc(len(retries), batcher=self.name, outcome="retried")
+        for i, result in zip(retries, await asyncio.gather(*(self._run_one(jobs[i]) for i in retries))):
+            results[i] = result
+        return results
+
+    async def _run_one(self, job: _Job):
+        """Runs one item on its own; its exception is handed to the caller instead of raised."""
+        if job.future.done():
+            return None
+        try:
+            return await self.run_one(job.item)
+        except Exception as e:
+            return e
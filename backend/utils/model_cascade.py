@@ -0,0 +1,108 @@
+"""
+Model cascade: which model answers each LLM task.
+
+Each task, named by its pipeline stage (e.g. llm.validate), lists its model tiers, cheapest
+first, in the policy file model_cascade.json (MODEL_CASCADE_POLICY points to another one):
+
+    "llm.validate": {"tiers": ["gpt-4o-mini", "gpt-4o"], "min_confidence": 0.9,
+                     "max_input_tokens": 8000}
+
+A task starts on its first tier. Classifier answers are requested with log-probs and their
+confidence is the probability of the least certain answer token; an answer below
+min_confidence is asked again on the next tier. Inputs over max_input_tokens, or with more
+than max_documents documents (report generation), start on the last tier right away.
+Tasks missing from the file use their default model only.
+
+llm_cascade_answers_total counts which tier answered each task, llm_cascade_escalations_total
+why a tier was passed over and llm_cascade_confidence the answer confidence per tier.
+"""
+
+import json
+import math
+import os
+from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional
+
+from utils.metrics import REGISTRY
+
+CASCADE_ANSWERS = REGISTRY.counter(
+    "llm_cascade_answers_total", "LLM task answers by stage and the model tier that gave them.",
+    ("stage", "model"))
+CASCADE_ESCALATIONS = REGISTRY.counter(
+    "llm_cascade_escalations_total",
+    "Model tiers passed over, by stage, model and reason (low_confidence/long_input/complex_input).",
+    ("stage", "model", "reason"))
+CASCADE_CONFIDENCE = REGISTRY.histogram(
+    "llm_cascade_confidence", "Confidence of the classifier answers by stage and model tier.",
+    ("stage", "model"), buckets=(0.1, 0.25, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.0))
+
+DEFAULT_POLICY_PATH = Path(__file__).resolve().parent.parent / "model_cascade.json"
+
+
+@dataclass(frozen=True)
+class CascadePolicy:
+    tiers: tuple[str, ...]
+    min_confidence: float = 0.0
+    max_input_tokens: Optional[int] = None
+    max_documents: Optional[int] = None
+
+
+@lru_cache(maxsize=1)
+def load_policies() -> dict[str, CascadePolicy]:
+    path = Path(os.getenv("MODEL_CASCADE_POLICY", DEFAULT_POLICY_PATH))
+    try:
+        raw = json.loads(path.read_text())
+    except FileNotFoundError:
+        print(f"Model cascade policy {path} not found; every task uses its default model.")
+        return {}
+    policies = {}
+    for task, spec in raw.items():
+        if not spec.get("tiers"):
+            raise ValueError(f"Model cascade policy for {task} lists no tiers")
+        policies[task] = CascadePolicy(
+            tuple(spec["tiers"]), float(spec.get("min_confidence", 0.0)),
+            spec.get("max_input_tokens"), spec.get("max_documents"))
+    return policies
+
+
+def get_policy(task: str, default_model: str) -> CascadePolicy:
+    return load_policies().get(task) or CascadePolicy((default_model,))
+
+
+def escalate(task: str, model: str, reason: str):
+    CASCADE_ESCALATIONS.inc(stage=task, model=model, reason=reason)
+
+
+def first_tier(task: str, policy: CascadePolicy, input_tokens: int, documents: int = 1) -> int:
+    """The tier a task starts on: the first, or the last for long or complex inputs."""
+    if len(policy.tiers) == 1:
+        return 0
+    if policy.max_input_tokens is not None and input_tokens > policy.max_input_tokens:
+        reason = "long_input"
+    elif policy.max_documents is not None and documents > policy.max_documents:
+        reason = "complex_input"
+    else:
+        return 0
+    for model in policy.tiers[:-1]:
+        escalate(task, model, reason)
+    return len(policy.tiers) - 1
+
+
+def answer_confidence(message) -> Optional[float]:
+    """
+    Probability of the least certain token of an answer requested with logprobs=True,
+    or None if the response carries no log-probs.
+    """
+    logprobs = (getattr(message, "response_metadata", None) or {}).get("logprobs") or {}
+    tokens = [token for token in logprobs.get("content") or [] if token.get("token", "").strip()]
+    if not tokens:
+        return None
+    return math.exp(min(token["logprob"] for token in tokens))
+
+
+def record_answer(task: str, model: str, confidence: Optional[float] = None):
+    CASCADE_ANSWERS.inc(stage=task, model=model)
+    if confidence is not None:
+        CASCADE_CONFIDENCE.observe(confidence, stage=task, model=model)
@@ -0,0 +1,170 @@
+"""
+Near-duplicate detection for a patient's documents.
+
+Two photos of the same doctor's letter never OCR to exactly the same text, so exact
+text comparison lets both into the report prompt. Each document instead gets a MinHash
+signature of its character shingles at ingest (stored in grandma_files.minhash). When
+the report is built, an LSH index over the signatures proposes candidate pairs, the
+candidates are confirmed by their estimated Jaccard similarity, and of each cluster of
+near-duplicates only the best copy (highest clarity score, then longest text) is kept.
+
+Shingle similarity alone cannot tell a second photo from a second document: two lab
+reports of the same lab and panel share most of their text and differ only in dates and
+values. Documents are therefore only treated as copies when their contents match as well:
+they share a date (if both carry dates) and their numbers (values, doses, dates) agree to
+NEAR_DUPLICATE_NUMBER_THRESHOLD, which leaves room for a misread digit or two.
+"""
+
+import os
+import re
+import zlib
+from typing import Optional
+
+import numpy as np
+
+from utils.metrics import REGISTRY
+
+NUM_PERMUTATIONS = 128
+LSH_BANDS, LSH_ROWS = 32, 4          # NUM_PERMUTATIONS = LSH_BANDS * LSH_ROWS
+SHINGLE_SIZE = 5                     # characters
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", "0.7"))
+NEAR_DUPLICATE_NUMBER_THRESHOLD = float(os.getenv("NEAR_DUPLICATE_NUMBER_THRESHOLD", "0.85"))
+
+_PRIME = (1 << 31) - 1
+# Fixed seed: signatures are persisted and must stay comparable across processes and releases
+_rng = np.random.default_rng(20250517)
+_A = _rng.integers(1, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, _PRIME, NUM_PERMUTATIONS, dtype=np.uint64)
+
+NEAR_DUPLICATES_DROPPED = REGISTRY.counter(
+    "near_duplicate_documents_dropped_total",
+    "Documents left out of a report because a better copy of them was kept.")
+
+
+def normalize_text(text: str) -> str:
+    """Lowercases and reduces the text to letters and digits, so OCR punctuation and line breaks do not matter."""
+    return re.sub(r"[\W_]+", " ", (text or "").lower()).strip()
+
+
+def minhash_signature(text: str) -> list[int]:
+    """MinHash signature (NUM_PERMUTATIONS values) of the text's character shingles."""
+    normalized = normalize_text(text)
+    if len(normalized) < SHINGLE_SIZE:
+        normalized = normalized.ljust(SHINGLE_SIZE)
+    shingles = {normalized[i:i + SHINGLE_SIZE] for i in range(len(normalized) - SHINGLE_SIZE + 1)}
+    hashes = np.fromiter((zlib.crc32(s.encode()) % _PRIME for s in shingles),
+                         dtype=np.uint64, count=len(shingles))
+    # (a * x + b) mod p for every permutation and shingle; a, x < 2^31 so nothing overflows
+    permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+    return permuted.min(axis=1).astype(np.int64).tolist()
+
+
+_DATE = re.compile(r"\b(\d{1,2})\.(\d{1,2})\.(\d{2,4})\b")
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def content_facts(text: str) -> tuple[frozenset, frozenset]:
+    """The dates (day, month, year) and the numbers (decimal commas as points) printed in the text."""
+    text = text or ""
+    dates = frozenset((int(day), int(month), int(year) % 100) for day, month, year in _DATE.findall(text))
+    numbers = frozenset(number.replace(",", ".") for number in _NUMBER.findall(text))
+    return dates, numbers
+
+
+def same_content(facts_a: tuple[frozenset, frozenset], facts_b: tuple[frozenset, frozenset],
+                 threshold: float = NEAR_DUPLICATE_NUMBER_THRESHOLD) -> bool:
+    """Whether two documents' dates and numbers are consistent with being copies of one document."""
+    dates_a, numbers_a = facts_a
+    dates_b, numbers_b = facts_b
+    if dates_a and dates_b and not dates_a & dates_b:
+        return False
+    if not numbers_a and not numbers_b:
+        return True
+    return len(numbers_a & numbers_b) / len(numbers_a | numbers_b) >= threshold
+
+
+def estimated_similarity(signature_a, signature_b) -> float:
+    """Estimated Jaccard similarity of two documents' shingle sets."""
+    return float(np.mean(np.asarray(signature_a) == np.asarray(signature_b)))
+
+
+class LshIndex:
+    """Banded LSH over MinHash signatures: documents sharing any band are candidates."""
+
+    def __init__(self, bands: int = LSH_BANDS, rows: int = LSH_ROWS):
+        self.bands = bands
+        self.rows = rows
+        self._buckets: dict[tuple, list] = {}
+
+    def _band_keys(self, signature) -> list[tuple]:
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows]))
+                for band in range(self.bands)]
+
+    def add(self, key, signature):
+        for band_key in self._band_keys(signature):
+            self._buckets.setdefault(band_key, []).append(key)
+
+    def candidates(self, signature) -> set:
+        found = set()
+        for band_key in self._band_keys(signature):
+            found.update(self._buckets.get(band_key, ()))
+        return found
+
+
+def near_duplicate_clusters(signatures: list, groups: Optional[list] = None,
+                            threshold: float = NEAR_DUPLICATE_THRESHOLD,
+                            facts: Optional[list] = None) -> list[list[int]]:
+    """
+    Clusters documents (by index) whose estimated similarity reaches `threshold` and,
+    given their content_facts, whose dates and numbers match (same_content).
+    Across groups (e.g. document types) only documents with identical signatures are
+    clustered, so the same photo uploaded under two types still counts once while short,
+    templated texts of different types stay apart.
+    Clusters are ordered by their first member; members keep their order.
+    """
+    parent = list(range(len(signatures)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    index = LshIndex()
+    for i, signature in enumerate(signatures):
+        for j in index.candidates(signature):
+            similarity = estimated_similarity(signature, signatures[j])
+            same_group = groups is None or groups[i] == groups[j]
+            if similarity >= (threshold if same_group else 1.0) and (
+                    facts is None or same_content(facts[i], facts[j])):
+                parent[find(i)] = find(j)
+        index.add(i, signature)
+
+    clusters: dict[int, list[int]] = {}
+    for i in range(len(signatures)):
+        clusters.setdefault(find(i), []).append(i)
+    return sorted(clusters.values(), key=lambda members: members[0])
+
+
+def select_distinct_documents(records: list[dict]) -> list[dict]:
+    """
+    Keeps the best copy of each cluster of near-duplicate grandma_files records (grouped
+    by doc_type) with matching dates and numbers: the highest clarity_score, then the
+    longest text. Records without a stored
+    signature (stored before fingerprints existed) are fingerprinted here. The kept
+    records stay in their original order.
+    """
+    if len(records) < 2:
+        return records
+    signatures = [record.get("minhash") or minhash_signature(record.get("text") or "")
+                  for record in records]
+    clusters = near_duplicate_clusters(signatures, groups=[record.get("doc_type") for record in records],
+                                       facts=[content_facts(record.get("text")) for record in records])
+
+    def quality(i):
+        clarity = records[i].get("clarity_score")
+        return (-1.0 if clarity is None else clarity, len(records[i].get("text") or ""))
+
+    kept = sorted(max(members, key=quality) for members in clusters)
+    NEAR_DUPLICATES_DROPPED.inc(len(records) - len(kept))
+    return [records[i] for i in kept]
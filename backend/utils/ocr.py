@@ -0,0 +1,353 @@
+"""
+OCR backends and the router that picks one per pipeline stage and document type.
+
+Backends:
+    google_vision - Google Vision text detection (remote, reports page confidence and layout)
+    openai_vision - gpt-4o-mini reading the image (remote, most robust on photos and handwriting)
+    tesseract     - local Tesseract in a process pool (no network; needs the `pytesseract`
+                    package and the tesseract binary, otherwise it is skipped; reports layout)
+
+Backends that report layout fill OcrResult.words with the word boxes, which the card
+extractor (utils/card_layout.py) reads Insurance and Vaccination Card fields from; the
+card extraction routes prefer Google Vision for that reason.
+
+OCR_ROUTES lists the backends to try per stage, optionally per document type, in order
+of preference, as JSON, e.g.
+
+    {"validate": ["tesseract", "google_vision"],
+     "extract": ["openai_vision", "google_vision"],
+     "extract:Vaccination Card": ["openai_vision"]}
+
+so the quick plausibility check at upload can run locally and only the final extraction
+pays for a remote call. The router keeps a moving average of each backend's latency and,
+per document type, of its confidence: a backend slower than the stage's latency budget
+(OCR_LATENCY_BUDGET_<STAGE>) or less confident than OCR_MIN_CONFIDENCE is passed over
+while a better one is available, a result below OCR_MIN_CONFIDENCE is retried on the
+next backend, and failures fall through to the next backend as well.
+
+Every backend call runs under the backend's timeout and circuit breaker (utils/resilience.py):
+backends whose breaker is open are tried last, and a call slower than the backend's p95
+latency is hedged with the next candidate (or, for remote backends without an alternative,
+with a second request to the same backend); the first answer wins.
+"""
+
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Optional
+
+from utils.env import load_env
+from utils.metrics import REGISTRY, timed
+from utils.resilience import CircuitOpenError, HedgedCallError, get_breaker, hedged
+
+OCR_CALLS = REGISTRY.counter(
+    "ocr_calls_total", "OCR calls by backend, stage and outcome (ok/low_confidence/error/circuit_open).",
+    ("backend", "stage", "outcome"))
+OCR_LATENCY_EWMA = REGISTRY.gauge(
+    "ocr_backend_latency_seconds", "Moving average of the OCR latency per backend.", ("backend",))
+OCR_CONFIDENCE_EWMA = REGISTRY.gauge(
+    "ocr_backend_confidence", "Moving average of the OCR confidence per backend and document type.",
+    ("backend", "doc_type"))
+
+DEFAULT_ROUTES = {
+    "validate": ["tesseract", "google_vision", "openai_vision"],
+    "extract": ["openai_vision", "google_vision", "tesseract"],
+    "extract:Insurance Card": ["google_vision", "openai_vision", "tesseract"],
+    "extract:Vaccination Card": ["google_vision", "openai_vision", "tesseract"],
+}
+DEFAULT_LATENCY_BUDGETS = {"validate": 3.0, "extract": 30.0}
+MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "0.6"))
+# Moving averages are trusted after this many observations
+MIN_SAMPLES = 3
+EWMA_ALPHA = 0.2
+
+
+class OcrError(Exception):
+    pass
+
+
+@dataclass
+class OcrWord:
+    text: str
+    # Bounding box relative to the page size (0..1), origin top left
+    left: float
+    top: float
+    right: float
+    bottom: float
+
+    @property
+    def center_x(self) -> float:
+        return (self.left + self.right) / 2
+
+    @property
+    def center_y(self) -> float:
+        return (self.top + self.bottom) / 2
+
+    @property
+    def height(self) -> float:
+        return self.bottom - self.top
+
+
+@dataclass
+class OcrResult:
+    text: str
+    confidence: Optional[float]   # 0..1, None if the backend does not report one
+    backend: str
+    seconds: float
+    words: Optional[list[OcrWord]] = None   # layout, None if the backend does not report one
+
+
+class OcrBackend:
+    name = ""
+    remote = True   # a slow local backend is not helped by a second request to itself
+
+    def available(self) -> bool:
+        return True
+
+    async def extract(self, image_bytes: bytes, content_type: str) -> OcrResult:
+        raise NotImplementedError
+
+
+class GoogleVisionBackend(OcrBackend):
+    name = "google_vision"
+
+    async def extract(self, image_bytes: bytes, content_type: str) -> OcrResult:
+        from utils.google_vision import extract_text_and_layout_using_google
+
+        start = time.perf_counter()
+        # The Vision client is synchronous; keep the event loop free for concurrent work
+        text, confidence, words = await asyncio.to_thread(extract_text_and_layout_using_google, image_bytes)
+        return OcrResult(text, confidence, self.name, time.perf_counter() - start,
+                         [OcrWord(*word) for word in words])
+
+
+class OpenAIVisionBackend(OcrBackend):
+    name = "openai_vision"
+    instruction = ("Extract the text from this image, ensuring all text is captured accurately. "
+                   "Do not include any markdown or code formatting.")
+
+    def available(self) -> bool:
+        load_env()
+        return bool(os.getenv("OPENAI_API_KEY"))
+
+    async def extract(self, image_bytes: bytes, content_type: str) -> OcrResult:
+        import base64
+        from openai import AsyncOpenAI
+        from utils.openai_scheduler import get_openai_http_client
+        from utils.token_budget import IMAGE_TOKENS, count_tokens, ensure_budget, record_usage
+
+        ensure_budget("ocr", IMAGE_TOKENS + count_tokens(self.instruction))
+        client = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), http_client=get_openai_http_client())
+        base64_image = base64.b64encode(image_bytes).decode("utf-8")
+        image_format = content_type.split("/")[1]
+        start = time.perf_counter()
+        with timed("ocr", provider="openai"):
+            response = await client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": self.instruction},
+                        {"type": "image_url",
+                         "image_url": {"url": f"data:image/{image_format};base64,{base64_image}"}},
+                    ],
+                }])
+        if response.usage:
+            record_usage(response.model, response.usage.prompt_tokens,
+                         response.usage.completion_tokens, stage="ocr")
+        return OcrResult(response.choices[0].message.content or "", None, self.name,
+                         time.perf_counter() - start)
+
+
+def _tesseract_worker(image_bytes: bytes, lang: str) -> tuple[str, Optional[float], list]:
+    """
+    Runs Tesseract on one image in a worker process:
+    (text, mean word confidence 0..1, word boxes relative to the image size).
+    """
+    import pytesseract
+    from PIL import Image, ImageOps
+
+    with Image.open(io.BytesIO(image_bytes)) as original:
+        image = ImageOps.exif_transpose(original).convert("L")
+        data = pytesseract.image_to_data(image, lang=lang, output_type=pytesseract.Output.DICT)
+        width, height = image.size
+    lines: dict[tuple, list[str]] = {}
+    confidences = []
+    words = []
+    for i, word in enumerate(data["text"]):
+        confidence = float(data["conf"][i])
+        if not word.strip() or confidence < 0:
+            continue
+        lines.setdefault((data["block_num"][i], data["par_num"][i], data["line_num"][i]), []).append(word)
+        confidences.append(confidence)
+        left, top = data["left"][i] / width, data["top"][i] / height
+        words.append((word, left, top, left + data["width"][i] / width, top + data["height"][i] / height))
+    text = "\n".join(" ".join(line) for _, line in sorted(lines.items()))
+    return text, (sum(confidences) / len(confidences) / 100 if confidences else None), words
+
+
+class TesseractBackend(OcrBackend):
+    name = "tesseract"
+    remote = False
+
+    def __init__(self):
+        self.lang = os.getenv("TESSERACT_LANG", "deu+eng")
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def available(self) -> bool:
+        try:
+            import pytesseract  # noqa: F401  Optional dependency
+        except ImportError:
+            return False
+        return shutil.which(os.getenv("TESSERACT_CMD", "tesseract")) is not None
+
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=int(os.getenv("TESSERACT_WORKERS", str(min(2, os.cpu_count() or 1)))),
+                mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=True, cancel_futures=True)
+            self._pool = None
+
+    async def extract(self, image_bytes: bytes, content_type: str) -> OcrResult:
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        with timed("ocr", provider="tesseract"):
+            text, confidence, words = await loop.run_in_executor(self.pool(), _tesseract_worker, image_bytes, self.lang)
+        return OcrResult(text, confidence, self.name, time.perf_counter() - start,
+                         [OcrWord(*word) for word in words])
+
+
+class _Average:
+    def __init__(self):
+        self.value: Optional[float] = None
+        self.samples = 0
+
+    def add(self, value: float):
+        self.value = value if self.value is None else (1 - EWMA_ALPHA) * self.value + EWMA_ALPHA * value
+        self.samples += 1
+
+    def trusted(self) -> bool:
+        return self.samples >= MIN_SAMPLES
+
+
+class OcrRouter:
+    def __init__(self, backends: list[OcrBackend], routes: Optional[dict] = None,
+                 latency_budgets: Optional[dict] = None, min_confidence: float = MIN_CONFIDENCE):
+        self.backends = {backend.name: backend for backend in backends}
+        self.routes = routes or DEFAULT_ROUTES
+        self.latency_budgets = latency_budgets or DEFAULT_LATENCY_BUDGETS
+        self.min_confidence = min_confidence
+        self._latency: dict[str, _Average] = {}
+        self._confidence: dict[tuple[str, str], _Average] = {}
+
+    def candidates(self, stage: str, doc_type: str) -> list[OcrBackend]:
+        """
+        The stage's available backends, those meeting the latency budget and confidence
+        first and those with an open circuit breaker last.
+        """
+        names = self.routes.get(f"{stage}:{doc_type}") or self.routes.get(stage) or list(self.backends)
+        backends = [self.backends[name] for name in names
+                    if name in self.backends and self.backends[name].available()]
+        budget = self.latency_budgets.get(stage)
+
+        def demoted(backend: OcrBackend) -> bool:
+            latency = self._latency.get(backend.name)
+            confidence = self._confidence.get((backend.name, doc_type))
+            too_slow = budget is not None and latency is not None and latency.trusted() and latency.value > budget
+            too_unsure = confidence is not None and confidence.trusted() and confidence.value < self.min_confidence
+            return too_slow or too_unsure
+
+        # Stable sort: the configured preference decides among equally suitable backends
+        return sorted(backends, key=lambda backend: (not get_breaker(backend.name).available(), demoted(backend)))
+
+    def _observe(self, result: OcrResult, doc_type: str):
+        latency = self._latency.setdefault(result.backend, _Average())
+        latency.add(result.seconds)
+        OCR_LATENCY_EWMA.set(latency.value, backend=result.backend)
+        if result.confidence is not None:
+            confidence = self._confidence.setdefault((result.backend, doc_type), _Average())
+            confidence.add(result.confidence)
+            OCR_CONFIDENCE_EWMA.set(confidence.value, backend=result.backend, doc_type=doc_type)
+
+    async def _attempt(self, backend: OcrBackend, image_bytes: bytes, content_type: str, stage: str) -> OcrResult:
+        try:
+            return await backend.extract(image_bytes, content_type)
+        except asyncio.CancelledError:
+            raise
+        except BaseException:
+            # Counted here: a failed attempt whose hedge succeeded is not reported by hedged()
+            OCR_CALLS.inc(backend=backend.name, stage=stage, outcome="error")
+            raise
+
+    async def extract(self, image_bytes: bytes, content_type: str, stage: str, doc_type: str) -> OcrResult:
+        """
+        Runs OCR with the best backend for the stage and document type, hedged with the
+        next candidate, and moves on to the next backends when both fail or the result
+        is not confident enough. Raises OcrError when no backend produced text.
+        """
+        best: Optional[OcrResult] = None
+        errors = []
+        remaining = self.candidates(stage, doc_type)
+        while remaining:
+            primary = remaining[0]
+            hedge = remaining[1] if len(remaining) > 1 else (primary if primary.remote else None)
+            attempts = [(backend.name, lambda backend=backend: self._attempt(backend, image_bytes, content_type, stage))
+                        for backend in ([primary, hedge] if hedge is not None else [primary])]
+            try:
+                result = await hedged(attempts)
+            except HedgedCallError as e:
+                failed = set()
+                for name, error in e.errors.items():
+                    name = name.split("#")[0]
+                    failed.add(name)
+                    if isinstance(error, CircuitOpenError):
+                        OCR_CALLS.inc(backend=name, stage=stage, outcome="circuit_open")
+                    errors.append(f"{name}: {str(error) or type(error).__name__}")
+                remaining = [backend for backend in remaining if backend.name not in failed]
+                continue
+            self._observe(result, doc_type)
+            if result.confidence is not None and result.confidence < self.min_confidence:
+                OCR_CALLS.inc(backend=result.backend, stage=stage, outcome="low_confidence")
+                if best is None or result.confidence > best.confidence:
+                    best = result
+                remaining = [backend for backend in remaining if backend.name != result.backend]
+                continue
+            OCR_CALLS.inc(backend=result.backend, stage=stage, outcome="ok")
+            return result
+        if best is not None:
+            return best
+        raise OcrError("; ".join(errors) or f"No OCR backend available for {stage}")
+
+    def shutdown(self):
+        for backend in self.backends.values():
+            if hasattr(backend, "shutdown"):
+                backend.shutdown()
+
+
+def _latency_budgets() -> dict:
+    return {stage: float(os.getenv(f"OCR_LATENCY_BUDGET_{stage.upper()}", budget))
+            for stage, budget in DEFAULT_LATENCY_BUDGETS.items()}
+
+
+@lru_cache(maxsize=1)
+def get_ocr_router() -> OcrRouter:
+    routes = json.loads(os.getenv("OCR_ROUTES", "null")) or DEFAULT_ROUTES
+    return OcrRouter([GoogleVisionBackend(), OpenAIVisionBackend(), TesseractBackend()],
+                     routes=routes, latency_budgets=_latency_budgets())
+
+
+def shutdown_ocr_router():
+    if get_ocr_router.cache_info().currsize:
+        get_ocr_router().shutdown()
@@ -0,0 +1,451 @@
+"""
+Process-wide scheduler in front of every OpenAI call.
+
+Upload validation, background extraction, report generation and /chat share one OpenAI
+account. All of them send their requests through `get_openai_http_client()`, whose
+transport admits requests through a single OpenAIScheduler:
+
+- token buckets on requests per minute and tokens per minute,
+- priority classes (interactive > background extraction > report generation); waiting
+  requests are admitted strictly in priority order and a few concurrency slots are
+  reserved for interactive traffic,
+- an adaptive (AIMD) concurrency limit that grows by one slot per window of successful
+  calls and halves on 429s, 5xx responses or calls slower than the latency target,
+- Retry-After handling: a 429 pauses admission for the advertised time and the request
+  is retried by the transport,
+- a timeout and circuit breaker on the "openai" provider (utils/resilience.py) around
+  the request once it is admitted: errors, timeouts and 5xx responses open the breaker,
+  429s do not (they are handled above). The wait for admission has its own bound
+  (OPENAI_QUEUE_TIMEOUT_SECONDS) and never counts against the breaker, so a backlog of
+  background calls cannot open it for interactive ones,
+- hedging of interactive, non-streaming calls: a call slower than the recent p95 of its
+  endpoint and model is sent a second time and the first response wins. The p95 and the
+  hedge delay are of OpenAI's own response times, from admission on. The hedge is only
+  sent if it is admitted right away (nothing waiting, a free slot, no Retry-After pause),
+  and not for calls that are already an attempt of a hedged call (OCR).
+
+The priority of a call is taken from the `openai_priority` context, which background jobs
+set on entry with `with openai_priority(Priority.BACKGROUND): ...`.
+"""
+
+import asyncio
+import heapq
+import itertools
+import json
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Optional
+
+import httpx
+
+from utils.metrics import REGISTRY
+from utils.resilience import (
+    CircuitOpenError, HedgedCallError, call_provider, get_latency_window, hedged, inside_hedged_call)
+
+
+class Priority(IntEnum):
+    INTERACTIVE = 0  # upload validation, /chat, /speak, realtime sessions
+    BACKGROUND = 1   # process_image_properly extraction and keywords
+    REPORT = 2       # comprehensive report generation
+
+
+_priority_var: ContextVar[Priority] = ContextVar("openai_priority", default=Priority.INTERACTIVE)
+
+
+@contextmanager
+def openai_priority(priority: Priority):
+    """Runs the enclosed OpenAI calls (including nested tasks started inside) at the given priority."""
+    token = _priority_var.set(priority)
+    try:
+        yield
+    finally:
+        _priority_var.reset(token)
+
+
+def current_priority() -> Priority:
+    return _priority_var.get()
+
+
+CONCURRENCY_LIMIT = REGISTRY.gauge(
+    "openai_concurrency_limit", "Current adaptive concurrency limit for OpenAI calls.")
+OPENAI_INFLIGHT = REGISTRY.gauge(
+    "openai_requests_inflight", "OpenAI calls currently in flight.", ("priority",))
+QUEUE_WAIT = REGISTRY.histogram(
+    "openai_queue_wait_seconds", "Time an OpenAI call waited for admission.", ("priority",))
+RATE_LIMITED = REGISTRY.counter(
+    "openai_rate_limited_total", "429 responses received from OpenAI.", ("priority",))
+QUEUE_TIMEOUTS = REGISTRY.counter(
+    "openai_queue_timeouts_total", "OpenAI calls that gave up waiting for admission.", ("priority",))
+
+
+class QueueTimeoutError(TimeoutError):
+    """An OpenAI call was not admitted within the queue timeout (it was never sent)."""
+
+
+class TokenBucket:
+    """Classic token bucket refilled continuously at `rate` per second up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def time_until(self, amount: float, now: float) -> float:
+        """Seconds until `amount` tokens are available (0 if they already are)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount: float, now: float):
+        self._refill(now)
+        self.tokens -= min(amount, self.capacity)
+
+
+class OpenAIScheduler:
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float,
+                 min_concurrency: int = 2, max_concurrency: int = 32,
+                 interactive_reserved: int = 2, latency_target: float = 20.0):
+        self.request_bucket = TokenBucket(requests_per_minute / 60, max(1.0, requests_per_minute / 60 * 5))
+        self.token_bucket = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60 * 5)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.interactive_reserved = interactive_reserved
+        self.latency_target = latency_target
+        self.limit = float(max(min_concurrency, min(max_concurrency, 8)))
+        self.inflight = 0
+        self.paused_until = 0.0
+        self._last_decrease = 0.0
+        self._waiters: list = []
+        self._seq = itertools.count()
+        self._wakeup: Optional[asyncio.Event] = None
+        CONCURRENCY_LIMIT.set(self.limit)
+
+    def _event(self) -> asyncio.Event:
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        return self._wakeup
+
+    def _notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+            self._wakeup = None
+
+    def _concurrency_for(self, priority: Priority) -> int:
+        limit = int(self.limit)
+        if priority == Priority.INTERACTIVE:
+            return limit
+        return max(1, limit - self.interactive_reserved)
+
+    async def acquire(self, priority: Priority, tokens: int):
+        """Waits until the call may be sent: it is the highest-priority waiter and both
+        the concurrency limit and the rate buckets allow it."""
+        entry = (int(priority), next(self._seq))
+        heapq.heappush(self._waiters, entry)
+        start = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                wait = 0.0
+                if self._waiters[0] != entry:
+                    wait = None
+                elif self.inflight >= self._concurrency_for(priority):
+                    wait = None
+                else:
+                    wait = max(self.paused_until - now,
+                               self.request_bucket.time_until(1, now),
+                               self.token_bucket.time_until(tokens, now))
+                    if wait <= 0:
+                        break
+                event = self._event()
+                try:
+                    await asyncio.wait_for(event.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+            heapq.heappop(self._waiters)
+            self._take(priority, tokens, now)
+        except BaseException:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+        finally:
+            # The next waiter may now be at the head of the queue
+            self._notify()
+        QUEUE_WAIT.observe(time.monotonic() - start, priority=priority.name.lower())
+
+    def try_acquire(self, priority: Priority, tokens: int) -> bool:
+        """Admits the call only if it may be sent right away: nobody is waiting and the limits allow it."""
+        now = time.monotonic()
+        if (self._waiters or self.inflight >= self._concurrency_for(priority) or now < self.paused_until
+                or self.request_bucket.time_until(1, now) > 0 or self.token_bucket.time_until(tokens, now) > 0):
+            return False
+        self._take(priority, tokens, now)
+        QUEUE_WAIT.observe(0.0, priority=priority.name.lower())
+        return True
+
+    def _take(self, priority: Priority, tokens: int, now: float):
+        self.request_bucket.take(1, now)
+        self.token_bucket.take(tokens, now)
+        self.inflight += 1
+        OPENAI_INFLIGHT.inc(priority=priority.name.lower())
+
+    def return_slot(self, priority: Priority):
+        """Returns the slot of a call that was never sent, without feeding the AIMD controller."""
+        self.inflight -= 1
+        OPENAI_INFLIGHT.dec(priority=priority.name.lower())
+        self._notify()
+
+    def release(self, priority: Priority, status_code: Optional[int], latency: float,
+                retry_after: Optional[float] = None):
+        """Returns the slot and feeds the outcome into the AIMD controller."""
+        self.inflight -= 1
+        OPENAI_INFLIGHT.dec(priority=priority.name.lower())
+        now = time.monotonic()
+        if status_code == 429:
+            RATE_LIMITED.inc(priority=priority.name.lower())
+            self.paused_until = max(self.paused_until, now + (retry_after or 1.0))
+            self._decrease(now)
+        elif status_code is None or status_code >= 500 or latency > self.latency_target:
+            self._decrease(now)
+        else:
+            # Additive increase: roughly one extra slot per `limit` successful calls
+            self.limit = min(self.max_concurrency, self.limit + 1.0 / self.limit)
+        CONCURRENCY_LIMIT.set(self.limit)
+        self._notify()
+
+    def _decrease(self, now: float):
+        # Only back off once per latency window, not once per failed in-flight call
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(self.min_concurrency, self.limit / 2)
+
+
+def estimate_request_tokens(body: bytes) -> int:
+    """Rough prompt + completion token estimate of an OpenAI JSON request, used for the TPM bucket."""
+    try:
+        payload = json.loads(body or b"{}")
+    except ValueError:
+        return max(1, len(body) // 4)
+    chars, images = 0, 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "image_url":
+                    images += 1
+                else:
+                    chars += len(part.get("text", ""))
+    chars += len(payload.get("input", "") if isinstance(payload.get("input"), str) else "")
+    chars += len(payload.get("instructions", "") or "")
+    completion = payload.get("max_completion_tokens") or payload.get("max_tokens") or 256
+    return chars // 4 + images * 765 + completion
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    for header in ("retry-after-ms", "retry-after"):
+        value = response.headers.get(header)
+        if value:
+            try:
+                seconds = float(value)
+            except ValueError:
+                continue
+            return seconds / 1000 if header == "retry-after-ms" else seconds
+    return None
+
+
+def _is_streaming(body: bytes) -> bool:
+    try:
+        return bool(json.loads(body or b"{}").get("stream"))
+    except (ValueError, AttributeError):
+        return False
+
+
+def _latency_key(request: httpx.Request, body: bytes) -> str:
+    try:
+        model = json.loads(body or b"{}").get("model", "")
+    except (ValueError, AttributeError):
+        model = ""
+    return f"openai:{request.url.path}:{model}"
+
+
+def _is_server_error(response: httpx.Response) -> bool:
+    return response.status_code >= 500
+
+
+async def _close_response(response: httpx.Response):
+    """Closes a response nobody reads (a 429 to retry, the losing attempt of a hedged call), returning its scheduler slot."""
+    await response.aclose()
+
+
+class _ReleasingStream(httpx.AsyncByteStream):
+    """Keeps the scheduler slot until the response body has been consumed or closed."""
+
+    def __init__(self, stream: httpx.AsyncByteStream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            await self._stream.aclose()
+        finally:
+            self._on_close()
+
+
+class SchedulingTransport(httpx.AsyncBaseTransport):
+    """httpx transport admitting every request through the OpenAIScheduler."""
+
+    def __init__(self, scheduler: OpenAIScheduler, max_retries: int = 3,
+                 transport: Optional[httpx.AsyncBaseTransport] = None, queue_timeout: Optional[float] = None):
+        self.scheduler = scheduler
+        self.max_retries = max_retries
+        self.queue_timeout = queue_timeout
+        self._transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        priority = current_priority()
+        body = await request.aread()
+        tokens = estimate_request_tokens(body)
+        latency_key = _latency_key(request, body)
+        # Someone is waiting on this answer: hedge it against the endpoint's tail latency
+        hedge = priority == Priority.INTERACTIVE and not _is_streaming(body) and not inside_hedged_call()
+        attempt = 0
+        while True:
+            await self._admit(priority, tokens)
+            if hedge:
+                response = await self._send_hedged(request, priority, tokens, latency_key)
+            else:
+                response = await self._send(request, priority, latency_key)
+            if response.status_code == 429 and attempt < self.max_retries:
+                # Closing it returns the slot and pauses admission for the Retry-After
+                await _close_response(response)
+                attempt += 1
+                continue
+            return response
+
+    async def _admit(self, priority: Priority, tokens: int):
+        try:
+            await asyncio.wait_for(self.scheduler.acquire(priority, tokens), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            QUEUE_TIMEOUTS.inc(priority=priority.name.lower())
+            raise QueueTimeoutError(f"OpenAI call was not admitted within {self.queue_timeout:.0f}s")
+
+    async def _send(self, request: httpx.Request, priority: Priority, latency_key: str) -> httpx.Response:
+        """
+        Sends an admitted request under the provider's timeout and breaker. Its slot is
+        returned once the response has been closed.
+        """
+        start = time.monotonic()
+        try:
+            response = await call_provider("openai", lambda: self._transport.handle_async_request(request),
+                                           is_failure=_is_server_error, record_latency=False)
+        except (CircuitOpenError, asyncio.CancelledError):
+            # Not sent, or a hedge that lost: nothing to learn about OpenAI's load
+            self.scheduler.return_slot(priority)
+            raise
+        except BaseException:
+            self.scheduler.release(priority, None, time.monotonic() - start)
+            raise
+        latency = time.monotonic() - start
+        if response.status_code < 400:
+            get_latency_window(latency_key).add(latency)
+
+        released = False
+
+        def release():
+            nonlocal released
+            if not released:
+                released = True
+                self.scheduler.release(priority, response.status_code, latency, _retry_after(response))
+
+        response.stream = _ReleasingStream(response.stream, release)
+        if response.is_closed:
+            # Read completely by the transport already: there is no stream left to close
+            release()
+        return response
+
+    async def _send_hedged(self, request: httpx.Request, priority: Priority, tokens: int,
+                           latency_key: str) -> httpx.Response:
+        """Sends an admitted request and, if it is slow and a second slot is free right away, a hedge."""
+        # Attempts holding a slot they have not started using yet
+        unused = {0: True, 1: False}
+
+        def attempt(index: int):
+            async def send():
+                unused[index] = False
+                return await self._send(request, priority, latency_key)
+            return send
+
+        def may_hedge() -> bool:
+            unused[1] = self.scheduler.try_acquire(priority, tokens)
+            return unused[1]
+
+        try:
+            return await hedged([("openai", attempt(0)), ("openai", attempt(1))], discard=_close_response,
+                                latency_key=latency_key, may_hedge=may_hedge, guarded=False)
+        except HedgedCallError as e:
+            raise next(iter(e.errors.values()))
+        finally:
+            # An attempt cancelled before it ran never used its slot
+            for index, holds_slot in unused.items():
+                if holds_slot:
+                    self.scheduler.return_slot(priority)
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
+_scheduler: Optional[OpenAIScheduler] = None
+_clients: dict = {}
+
+
+def get_openai_scheduler() -> OpenAIScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = OpenAIScheduler(
+            requests_per_minute=float(os.getenv("OPENAI_RPM", "500")),
+            tokens_per_minute=float(os.getenv("OPENAI_TPM", "200000")),
+            min_concurrency=int(os.getenv("OPENAI_MIN_CONCURRENCY", "2")),
+            max_concurrency=int(os.getenv("OPENAI_MAX_CONCURRENCY", "32")),
+            interactive_reserved=int(os.getenv("OPENAI_INTERACTIVE_RESERVED", "2")),
+            latency_target=float(os.getenv("OPENAI_LATENCY_TARGET_SECONDS", "20")),
+        )
+    return _scheduler
+
+
+def get_openai_http_client() -> httpx.AsyncClient:
+    """
+    Returns the shared httpx client for OpenAI calls of the running event loop.
+    Pass it to ChatOpenAI(http_async_client=...), AsyncOpenAI(http_client=...) or use it
+    directly for raw REST calls so they are all scheduled together.
+    """
+    loop = asyncio.get_running_loop()
+    client = _clients.get(loop)
+    if client is None or client.is_closed:
+        _clients.clear()
+        client = httpx.AsyncClient(
+            transport=SchedulingTransport(
+                get_openai_scheduler(), queue_timeout=float(os.getenv("OPENAI_QUEUE_TIMEOUT_SECONDS", "300"))),
+            timeout=httpx.Timeout(60.0, connect=10.0))
+        _clients[loop] = client
+    return client
@@ -0,0 +1,103 @@
+import asyncio
+import importlib
+import os
+import sys
+import threading
+
+from utils.metrics import timed
+
+
+# Imported lazily by the handlers that call OpenAI
+LLM_SDK_MODULES = ("openai", "langchain_openai", "langchain_core.prompts", "langchain_core.output_parsers")
+
+
+def _import_sdks():
+    for module in LLM_SDK_MODULES:
+        importlib.import_module(module)
+
+
+def _imported(module: str) -> bool:
+    loaded = sys.modules.get(module)
+    return loaded is not None and not getattr(loaded.__spec__, "_initializing", False)
+
+
+# Concurrent first requests load the tokenizer (and possibly download its encoding) once
+_load_lock = threading.Lock()
+
+
+def _load_llm_sdks(modules: list[str]):
+    with _load_lock:
+        for module in modules:
+            importlib.import_module(module)
+        _load_tokenizer()
+
+
+async def ensure_llm_sdks():
+    """
+    Loads the LLM SDKs and the tokenizer in a worker thread unless they are loaded already.
+    Handlers call this before their lazy SDK imports: importing the OpenAI SDK takes about
+    a second and the tokenizer may download its encoding, so a request arriving before
+    pre-warming has finished would otherwise block the event loop on them (or on the
+    pre-warm thread holding the import lock).
+    """
+    from utils.token_budget import tokenizer_loaded
+
+    missing = [module for module in LLM_SDK_MODULES if not _imported(module)]
+    if missing or not tokenizer_loaded():
+        await asyncio.to_thread(_load_llm_sdks, missing)
+
+
+def _build_vision_client():
+    from utils.google_vision import get_vision_client
+    get_vision_client()
+
+
+def _open_storage():
+    from database.supabase_client import get_storage, get_supabase_client
+    # The embedded backend opens its database here; the Supabase one builds the client
+    if get_storage().remote:
+        get_supabase_client()
+
+
+def _start_derivative_pool():
+    from utils.image_derivatives import warm_derivative_pool
+    warm_derivative_pool()
+
+
+def _load_tokenizer():
+    from utils.token_budget import prewarm_tokenizer
+    prewarm_tokenizer()
+
+
+def _open_llm_cache():
+    from utils.llm_cache import get_llm_cache
+    get_llm_cache()
+
+
+PREWARM_STEPS = [
+    ("sdk_imports", _import_sdks),
+    ("llm_cache", _open_llm_cache),
+    ("tokenizer", _load_tokenizer),
+    ("vision_client", _build_vision_client),
+    ("storage", _open_storage),
+    ("derivative_pool", _start_derivative_pool),
+]
+
+
+async def prewarm_clients():
+    """
+    Imports the provider SDKs and builds the shared clients in a worker thread once the
+    server is up, so the first real request does not pay for them. Failures (e.g. a
+    missing Google key file) are reported and left to surface on the endpoints that
+    actually need the provider.
+    """
+    # Give the server a moment to start accepting connections first
+    await asyncio.sleep(float(os.getenv("PREWARM_DELAY_SECONDS", "0.1")))
+    from utils.openai_scheduler import get_openai_http_client
+    get_openai_http_client()
+    for name, step in PREWARM_STEPS:
+        try:
+            with timed(f"startup.prewarm.{name}"):
+                await asyncio.to_thread(step)
+        except Exception as e:
+            print(f"Pre-warming {name} failed: {str(e)}")
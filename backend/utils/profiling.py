@@ -0,0 +1,323 @@
+"""
+Opt-in per-request profiling.
+
+A request is profiled when it carries `X-Profile: <PROFILING_ADMIN_TOKEN>`, or by chance
+with probability PROFILE_SAMPLE_RATE (default 0) if its path starts with one of
+PROFILE_PATHS (default /upload-image and /trigger-report-generation). The capture
+follows the request and every task it starts, including the background jobs spawned for
+it (document processing, report generation), until all of them have finished or
+PROFILE_MAX_SECONDS (default 300) have passed.
+
+While a capture is active, a sampler thread records the stack of each of its tasks every
+PROFILE_INTERVAL_SECONDS (default 0.01): the running task's real stack, and for
+suspended tasks the chain of coroutines they are awaiting, ending in an `[await ...]`
+frame. The samples are weighted by wall-clock time, so waiting on OpenAI or a worker
+thread shows up as clearly as CPU time. Tasks are discovered through the event loop's
+task factory, which tags every task created in a capture's context.
+
+Each capture is written as a speedscope file (one timeline per task; open it at
+https://www.speedscope.app) to PROFILE_DIR (default backend/.cache/profiles). At most
+PROFILE_MAX_FILES (20) files and PROFILE_MAX_MB (50) MB are kept, oldest removed first.
+GET /admin/profiles lists them (routers/profiles.py).
+"""
+
+import asyncio
+import itertools
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import weakref
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from fastapi import Request
+
+from utils.metrics import REGISTRY
+from utils.tracing import current_trace_id
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-ID"
+ADMIN_TOKEN = os.getenv("PROFILING_ADMIN_TOKEN", "")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_PATHS = tuple(path for path in os.getenv(
+    "PROFILE_PATHS", "/upload-image,/trigger-report-generation").split(",") if path)
+INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.01"))
+MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "300"))
+# Captures running at the same time; further requests are not profiled
+MAX_ACTIVE = int(os.getenv("PROFILE_MAX_ACTIVE", "2"))
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR") or Path(__file__).resolve().parent.parent / ".cache" / "profiles")
+MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "20"))
+MAX_BYTES = int(float(os.getenv("PROFILE_MAX_MB", "50")) * 1024 * 1024)
+PROFILE_SUFFIX = ".speedscope.json"
+
+PROFILE_CAPTURES = REGISTRY.counter(
+    "profile_captures_total", "Profiles captured, by trigger (header or sampled).", ("trigger",))
+
+_capture_var: ContextVar[Optional["Capture"]] = ContextVar("profile_capture", default=None)
+
+
+def profiling_enabled() -> bool:
+    return bool(ADMIN_TOKEN) or SAMPLE_RATE > 0
+
+
+def _frame_key(frame) -> tuple:
+    code = frame.f_code
+    return code.co_qualname, code.co_filename, code.co_firstlineno
+
+
+def _awaited_stack(coro) -> list:
+    """Frame keys of a suspended coroutine and the coroutines it awaits, outermost first."""
+    keys = []
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None) or getattr(coro, "ag_frame", None)
+        if frame is None:
+            break
+        keys.append(_frame_key(frame))
+        awaited = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None) or getattr(coro, "ag_await", None)
+        if awaited is not None and not hasattr(awaited, "cr_frame") and not hasattr(awaited, "gi_frame") \
+                and not hasattr(awaited, "ag_frame"):
+            # A future (or task) is awaited through the iterator of its __await__
+            name = "Future" if type(awaited).__name__ == "FutureIter" else type(awaited).__name__
+            keys.append((f"[await {name}]", "", 0))
+            break
+        coro = awaited
+    return keys
+
+
+class Capture:
+    def __init__(self, name: str, trigger: str, request: Request):
+        self.name = name
+        self.trigger = trigger
+        self.method = request.method
+        self.path = request.url.path
+        self.trace_id = current_trace_id()
+        self.started_at = time.monotonic()
+        self.created = datetime.now(timezone.utc).isoformat()
+        self.tasks: "weakref.WeakSet[asyncio.Task]" = weakref.WeakSet()
+        # Tasks are numbered in order of creation (ids of finished tasks get reused)
+        self._task_numbers: "weakref.WeakKeyDictionary[asyncio.Task, int]" = weakref.WeakKeyDictionary()
+        self._next_number = itertools.count()
+        # Samples per task number: [(time since start, weight, frame keys)]
+        self.samples: dict[int, list] = {}
+        self.task_names: dict[int, str] = {}
+        self.request_done = False
+        self.finished = False
+        self.truncated = False
+
+    def add_task(self, task: asyncio.Task):
+        self._task_numbers[task] = next(self._next_number)
+        self.tasks.add(task)
+        task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        self._check_finished()
+
+    def end_request(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        self.request_done = True
+        self._check_finished()
+
+    def _check_finished(self):
+        if self.request_done and not len(self.tasks):
+            self.finished = True
+
+    def sample(self, loop_stack: list, now: float, weight: float):
+        """Records one sample of every task (called from the sampler thread)."""
+        try:
+            tasks = list(self.tasks)
+        except RuntimeError:
+            # The set changed while being copied; the next sample will see it
+            return
+        for task in tasks:
+            coro = task.get_coro()
+            frame = getattr(coro, "cr_frame", None)
+            if frame is None:
+                continue
+            running = next((index for index, candidate in enumerate(loop_stack) if candidate is frame), None)
+            keys = ([_frame_key(candidate) for candidate in loop_stack[running:]] if running is not None
+                    else _awaited_stack(coro))
+            number = self._task_numbers.get(task)
+            if keys and number is not None:
+                self.task_names.setdefault(number, f"{task.get_name()} {getattr(coro, '__qualname__', '')}")
+                self.samples.setdefault(number, []).append((now - self.started_at, weight, keys))
+
+    def to_speedscope(self) -> dict:
+        frames, index = [], {}
+        profiles = []
+        for task_id, samples in self.samples.items():
+            stacks, weights = [], []
+            for _, weight, keys in samples:
+                stack = []
+                for key in keys:
+                    if key not in index:
+                        index[key] = len(frames)
+                        name, file, line = key
+                        frames.append({"name": name, "file": file, "line": line} if file else {"name": name})
+                    stack.append(index[key])
+                stacks.append(stack)
+                weights.append(weight)
+            start = samples[0][0] - samples[0][1]
+            profiles.append({
+                "type": "sampled", "name": self.task_names.get(task_id, str(task_id)), "unit": "seconds",
+                "startValue": start, "endValue": start + sum(weights), "samples": stacks, "weights": weights,
+            })
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{self.method} {self.path} ({self.trace_id})",
+            "exporter": "epoch-backend profiler",
+            "activeProfileIndex": 0,
+            "shared": {"frames": frames},
+            "profiles": profiles,
+        }
+
+
+class Profiler:
+    def __init__(self, directory: Path = PROFILE_DIR, interval: float = INTERVAL_SECONDS):
+        self.directory = directory
+        self.interval = interval
+        self.active: list[Capture] = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._loop_thread_id: Optional[int] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def install(self, loop: asyncio.AbstractEventLoop):
+        """Tags the tasks created in a capture's context with it."""
+        self._loop_thread_id = threading.get_ident()
+        previous = loop.get_task_factory()
+
+        def task_factory(loop, coro, context=None):
+            if previous is not None:
+                task = previous(loop, coro) if context is None else previous(loop, coro, context=context)
+            else:
+                task = asyncio.Task(coro, loop=loop, context=context)
+            capture = (context.get(_capture_var) if context is not None else _capture_var.get())
+            if capture is not None and not capture.finished:
+                capture.add_task(task)
+            return task
+
+        loop.set_task_factory(task_factory)
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def start(self, request: Request, trigger: str) -> Optional[Capture]:
+        with self._lock:
+            if self._thread is None or len(self.active) >= MAX_ACTIVE:
+                return None
+            slug = re.sub(r"[^A-Za-z0-9]+", "-", request.url.path).strip("-") or "root"
+            name = f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{slug}-{current_trace_id()[:12]}"
+            capture = Capture(name, trigger, request)
+            self.active.append(capture)
+        capture.add_task(asyncio.current_task())
+        PROFILE_CAPTURES.inc(trigger=trigger)
+        self._wakeup.set()
+        return capture
+
+    def _run(self):
+        last = time.monotonic()
+        while True:
+            if not self.active:
+                self._wakeup.wait()
+                self._wakeup.clear()
+                last = time.monotonic()
+                continue
+            time.sleep(self.interval)
+            now = time.monotonic()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            loop_stack = []
+            while frame is not None:
+                loop_stack.append(frame)
+                frame = frame.f_back
+            loop_stack.reverse()
+            for capture in list(self.active):
+                if now - capture.started_at > MAX_SECONDS:
+                    capture.truncated = capture.finished = True
+                if capture.finished:
+                    with self._lock:
+                        self.active.remove(capture)
+                    self._write(capture)
+                else:
+                    capture.sample(loop_stack, now, now - last)
+            last = now
+
+    def _write(self, capture: Capture):
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            data = capture.to_speedscope()
+            data["name"] += " (truncated)" if capture.truncated else ""
+            path = self.directory / f"{capture.name}{PROFILE_SUFFIX}"
+            path.write_text(json.dumps(data))
+            path.with_suffix(".meta").write_text(json.dumps({
+                "method": capture.method, "path": capture.path, "trace_id": capture.trace_id,
+                "trigger": capture.trigger, "created": capture.created, "truncated": capture.truncated,
+                "duration_seconds": round(time.monotonic() - capture.started_at, 3),
+                "tasks": len(capture.samples)}))
+            self._evict()
+            print(f"Profile of {capture.method} {capture.path} written to {path}")
+        except Exception as e:
+            print(f"Could not write profile {capture.name}: {str(e)}")
+
+    def _evict(self):
+        profiles = sorted(self.directory.glob(f"*{PROFILE_SUFFIX}"), key=lambda path: path.stat().st_mtime)
+        total = sum(path.stat().st_size for path in profiles)
+        while profiles and (len(profiles) > MAX_FILES or total > MAX_BYTES):
+            oldest = profiles.pop(0)
+            total -= oldest.stat().st_size
+            oldest.unlink(missing_ok=True)
+            oldest.with_suffix(".meta").unlink(missing_ok=True)
+
+
+_profiler = Profiler()
+
+
+def install_profiler():
+    """Starts the profiler for the running loop if profiling is configured (called in the app lifespan)."""
+    if profiling_enabled():
+        _profiler.install(asyncio.get_running_loop())
+
+
+def list_profiles() -> list[dict]:
+    """The stored captures, newest first."""
+    profiles = []
+    for path in sorted(PROFILE_DIR.glob(f"*{PROFILE_SUFFIX}"), key=lambda path: path.stat().st_mtime, reverse=True):
+        try:
+            meta = json.loads(path.with_suffix(".meta").read_text())
+        except (OSError, ValueError):
+            meta = {}
+        profiles.append({"id": path.name[:-len(PROFILE_SUFFIX)], "size_bytes": path.stat().st_size, **meta})
+    return profiles
+
+
+def profile_path(profile_id: str) -> Optional[Path]:
+    path = PROFILE_DIR / f"{profile_id}{PROFILE_SUFFIX}"
+    # Captures are named by the profiler; anything else (e.g. "../") is not one of them
+    if not re.fullmatch(r"[A-Za-z0-9-]+", profile_id) or not path.exists():
+        return None
+    return path
+
+
+async def profile_middleware(request: Request, call_next):
+    """Profiles the request (and the tasks it starts) when asked to by header or sampling."""
+    trigger = None
+    if ADMIN_TOKEN and request.headers.get(PROFILE_HEADER) == ADMIN_TOKEN:
+        trigger = "header"
+    elif SAMPLE_RATE > 0 and request.url.path.startswith(PROFILE_PATHS) and random.random() < SAMPLE_RATE:
+        trigger = "sampled"
+    capture = _profiler.start(request, trigger) if trigger else None
+    if capture is None:
+        return await call_next(request)
+    token = _capture_var.set(capture)
+    try:
+        response = await call_next(request)
+        response.headers[PROFILE_ID_HEADER] = capture.name
+        return response
+    finally:
+        _capture_var.reset(token)
+        capture.end_request(asyncio.current_task())
@@ -0,0 +1,127 @@
+"""
+Coalesces report generation per patient.
+
+Report generation is one expensive gpt-4o call over all of a patient's documents, so
+running it more than once for the same set of documents is pure waste. The scheduler
+keeps at most one run in flight per patient:
+
+- a trigger while a run for the current documents is in flight joins that run,
+- a trigger after newer documents arrived supersedes it: the stale run is cancelled,
+  and the new one starts once the stale run has finalized its report version (marked
+  its draft failed),
+- a trigger while documents of the patient are still being processed is deferred until
+  the last of them finished,
+- with auto-triggering, a run starts by itself once the patient's pending document jobs
+  have finished and no new upload arrived for `debounce_seconds`.
+
+State is per worker process; with several workers each one coalesces its own triggers.
+"""
+
+import asyncio
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Hashable, Optional
+
+from utils.metrics import REGISTRY
+from utils.tracing import spawn_background
+
+REPORT_TRIGGERS = REGISTRY.counter(
+    "report_triggers_total",
+    "Report generation triggers by outcome (started/joined/superseded/deferred/auto).",
+    ("outcome",))
+
+
+@dataclass
+class _PatientReportState:
+    pending_jobs: int = 0        # document jobs of the patient still in flight
+    documents_version: int = 0   # bumped whenever a document job changed the patient's documents
+    run: Optional[asyncio.Task] = None
+    run_version: int = -1        # documents_version the current/last run started from
+    timer: Optional[asyncio.Task] = None
+    requested: bool = False      # a trigger is waiting for the pending jobs
+
+
+class ReportScheduler:
+    def __init__(self, generate: Callable[[Hashable], Awaitable[None]],
+                 debounce_seconds: float = 5.0, auto_trigger: bool = True):
+        self._generate = generate
+        self.debounce_seconds = debounce_seconds
+        self.auto_trigger = auto_trigger
+        self._patients: dict[Hashable, _PatientReportState] = {}
+
+    def _state(self, key: Hashable) -> _PatientReportState:
+        return self._patients.setdefault(key, _PatientReportState())
+
+    def trigger(self, key: Hashable) -> str:
+        """
+        Requests a report for the patient. Returns what happened: "started", "joined",
+        "superseded" or "deferred".
+        """
+        state = self._state(key)
+        if state.pending_jobs:
+            state.requested = True
+            outcome = "deferred"
+        else:
+            outcome = self._start_or_join(key, state)
+        REPORT_TRIGGERS.inc(outcome=outcome)
+        return outcome
+
+    def document_job_started(self, key: Hashable):
+        state = self._state(key)
+        state.pending_jobs += 1
+        self._cancel_timer(state)
+
+    def document_job_finished(self, key: Hashable, changed: bool = True):
+        state = self._state(key)
+        state.pending_jobs = max(0, state.pending_jobs - 1)
+        if changed:
+            state.documents_version += 1
+        if state.pending_jobs == 0 and (state.requested or (changed and self.auto_trigger)):
+            self._cancel_timer(state)
+            state.timer = spawn_background(self._debounced(key, state), job="report_debounce")
+
+    def _start_or_join(self, key: Hashable, state: _PatientReportState) -> str:
+        self._cancel_timer(state)
+        state.requested = False
+        superseded = None
+        if state.run is not None and not state.run.done():
+            if state.run_version == state.documents_version:
+                return "joined"
+            superseded = state.run
+            superseded.cancel()
+            outcome = "superseded"
+        else:
+            outcome = "started"
+        state.run_version = state.documents_version
+        state.run = spawn_background(self._run(key, state, superseded), job="generate_report")
+        return outcome
+
+    async def _debounced(self, key: Hashable, state: _PatientReportState):
+        await asyncio.sleep(self.debounce_seconds)
+        state.timer = None
+        if state.pending_jobs:
+            return
+        # Nothing new since the last run: an auto trigger has nothing to do
+        if not state.requested and state.run_version == state.documents_version:
+            return
+        REPORT_TRIGGERS.inc(outcome="auto")
+        self._start_or_join(key, state)
+
+    async def _run(self, key: Hashable, state: _PatientReportState, superseded: Optional[asyncio.Task] = None):
+        try:
+            if superseded is not None:
+                # Let the cancelled run clean up its version before this one saves a new one
+                await asyncio.wait({superseded})
+            await self._generate(key)
+        finally:
+            if state.run is asyncio.current_task():
+                state.run = None
+            # Forget idle patients; the next trigger simply starts a new run
+            if (state.run is None and state.timer is None and not state.pending_jobs
+                    and not state.requested and self._patients.get(key) is state):
+                del self._patients[key]
+
+    @staticmethod
+    def _cancel_timer(state: _PatientReportState):
+        if state.timer is not None:
+            state.timer.cancel()
+            state.timer = None
@@ -0,0 +1,83 @@
+"""
+Incremental cleanup of the streamed markdown report.
+
+The report model streams its markdown in small deltas and sometimes wraps the whole
+report in a code fence (```markdown ... ```). ReportStream strips the fence while the
+text arrives and tracks the section boundaries (`#`/`##` headings), so a draft made of
+the sections completed so far can be saved while later sections are still being written.
+"""
+
+from typing import Optional
+
+FENCE = "```"
+
+
+def _is_heading(line: str) -> bool:
+    return line.startswith("# ") or line.startswith("## ")
+
+
+class ReportStream:
+    def __init__(self):
+        self._pending = ""        # received text after the last complete line
+        self._opened = False      # leading fence (if any) handled
+        self._held: list[str] = []  # a fence line (and blank lines after it) that may close the report
+        self._lines: list[str] = []
+        self._completed = 0       # lines belonging to completed sections
+        self._section_first: Optional[str] = None  # first line of the section being written
+        self.sections = 0         # completed `##` sections
+
+    def feed(self, delta: str) -> Optional[str]:
+        """
+        Adds a streamed delta. Returns the draft (all completed sections) when the delta
+        completed another section, otherwise None.
+        """
+        self._pending += delta
+        if not self._opened and not self._open():
+            return None
+        *lines, self._pending = self._pending.split("\n")
+        before = self.sections
+        for line in lines:
+            self._add(line)
+        return self.draft() if self.sections > before else None
+
+    def _open(self) -> bool:
+        stripped = self._pending.lstrip()
+        if not stripped or (len(stripped) < len(FENCE) and FENCE.startswith(stripped)):
+            return False
+        if stripped.startswith(FENCE):
+            if "\n" not in stripped:
+                return False
+            # Drop the opening fence line (```markdown, ```md or ```)
+            stripped = stripped.split("\n", 1)[1]
+        self._pending = stripped
+        self._opened = True
+        return True
+
+    def _add(self, line: str):
+        if line.strip() == FENCE or (self._held and not line.strip()):
+            # Emitted only if the report goes on, otherwise it was the closing fence
+            self._held.append(line)
+            return
+        for held in self._held + [line]:
+            if _is_heading(held) and self._section_first is not None:
+                self._completed = len(self._lines)
+                # The title alone does not make a draft worth saving
+                self.sections += self._section_first.startswith("## ")
+                self._section_first = None
+            if self._section_first is None and held.strip():
+                self._section_first = held
+            self._lines.append(held)
+        self._held = []
+
+    def draft(self) -> str:
+        return "\n".join(self._lines[:self._completed]).strip()
+
+    def finish(self) -> str:
+        """The complete report, without a closing fence."""
+        if not self._opened:
+            self._open()
+        tail = self._pending
+        self._pending = ""
+        if tail.strip() and tail.strip() != FENCE:
+            self._add(tail)
+        return "\n".join(self._lines).strip()
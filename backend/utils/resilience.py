@@ -0,0 +1,284 @@
+"""
+Timeouts, hedging and circuit breakers around provider calls (OCR backends, OpenAI).
+
+- Every provider call has a timeout (PROVIDER_TIMEOUT_<PROVIDER> seconds, defaults below).
+- Each provider has a circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive
+  failures (errors, timeouts, 5xx) it opens and calls fail fast with CircuitOpenError, so
+  callers fail over to another provider instead of waiting on a broken one. After
+  CIRCUIT_RESET_SECONDS one trial call is let through (half-open); its outcome closes or
+  re-opens the breaker.
+- `hedged()` starts a second attempt (the same or an alternate provider) once the first
+  one has taken longer than the provider's recent p95 latency, and returns whichever
+  answer arrives first. The tail latency of a call is then bounded by roughly the p95 plus
+  one normal call instead of by the slowest response. Calls are hedged at one layer only:
+  provider calls made inside an attempt of a hedged call are not hedged again.
+
+Breaker state, hedges and timeouts are exported on /metrics.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional
+
+from utils.metrics import REGISTRY
+
+CIRCUIT_STATE = REGISTRY.gauge(
+    "circuit_breaker_state", "Circuit breaker state per provider (0 closed, 1 half-open, 2 open).", ("provider",))
+CIRCUIT_OPENED = REGISTRY.counter(
+    "circuit_breaker_opened_total", "Times a provider's circuit breaker opened.", ("provider",))
+CIRCUIT_REJECTED = REGISTRY.counter(
+    "circuit_breaker_rejected_total", "Calls failed fast because the provider's breaker was open.", ("provider",))
+PROVIDER_TIMEOUTS = REGISTRY.counter(
+    "provider_timeouts_total", "Provider calls that exceeded their timeout.", ("provider",))
+HEDGES = REGISTRY.counter(
+    "hedged_requests_total",
+    "Hedged calls by the provider of the hedge and outcome (fired: a second attempt was started, "
+    "won: the hedge answered first, skipped: the hedge was due but the provider was busy).",
+    ("provider", "outcome"))
+
+# Seconds; for OpenAI this is the time until the response headers (a long report may stream for longer)
+DEFAULT_TIMEOUTS = {"google_vision": 15.0, "openai_vision": 45.0, "tesseract": 30.0, "openai": 120.0}
+FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "1") == "1"
+HEDGE_QUANTILE = float(os.getenv("HEDGE_QUANTILE", "0.95"))
+# Hedging waits at least this long and needs this many observed latencies of the provider
+HEDGE_MIN_DELAY_SECONDS = float(os.getenv("HEDGE_MIN_DELAY_SECONDS", "0.2"))
+HEDGE_MIN_SAMPLES = 20
+
+_inside_hedge: ContextVar[bool] = ContextVar("inside_hedged_call", default=False)
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class HedgedCallError(Exception):
+    """All attempts of a hedged call failed; `errors` maps each attempted provider to its error."""
+
+    def __init__(self, errors: dict):
+        super().__init__("; ".join(f"{name}: {str(error) or type(error).__name__}" for name, error in errors.items()))
+        self.errors = errors
+
+
+class CircuitBreaker:
+    CLOSED, HALF_OPEN, OPEN = 0, 1, 2
+
+    def __init__(self, provider: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_seconds: float = RESET_SECONDS):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_inflight = False
+        CIRCUIT_STATE.set(self.state, provider=provider)
+
+    def _set_state(self, state: int):
+        if state == self.OPEN and self.state != self.OPEN:
+            CIRCUIT_OPENED.inc(provider=self.provider)
+            print(f"Circuit breaker for {self.provider} opened after {self.failures} failures.")
+        self.state = state
+        CIRCUIT_STATE.set(state, provider=self.provider)
+
+    def available(self) -> bool:
+        """Whether a call would currently be let through (does not claim the half-open trial)."""
+        if self.state == self.OPEN:
+            return time.monotonic() - self.opened_at >= self.reset_seconds
+        return not (self.state == self.HALF_OPEN and self._trial_inflight)
+
+    def allow(self) -> bool:
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_seconds:
+            self._set_state(self.HALF_OPEN)
+            self._trial_inflight = False
+        if self.state == self.OPEN:
+            return False
+        if self.state == self.HALF_OPEN:
+            if self._trial_inflight:
+                return False
+            self._trial_inflight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._trial_inflight = False
+        if self.state != self.CLOSED:
+            self._set_state(self.CLOSED)
+
+    def record_failure(self):
+        self.failures += 1
+        self._trial_inflight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+            self._set_state(self.OPEN)
+
+
+class LatencyWindow:
+    """Latencies of the most recent successful calls of a provider."""
+
+    def __init__(self, size: int = 200):
+        self._samples: deque = deque(maxlen=size)
+
+    def add(self, seconds: float):
+        self._samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if len(self._samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+_breakers: dict[str, CircuitBreaker] = {}
+_latencies: dict[str, LatencyWindow] = {}
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        breaker = _breakers[provider] = CircuitBreaker(provider)
+    return breaker
+
+
+def get_latency_window(provider: str) -> LatencyWindow:
+    window = _latencies.get(provider)
+    if window is None:
+        window = _latencies[provider] = LatencyWindow()
+    return window
+
+
+def provider_timeout(provider: str) -> float:
+    return float(os.getenv(f"PROVIDER_TIMEOUT_{provider.upper()}", DEFAULT_TIMEOUTS.get(provider, 30.0)))
+
+
+def inside_hedged_call() -> bool:
+    """Whether the running code is an attempt of a hedged call (which must not hedge again)."""
+    return _inside_hedge.get()
+
+
+def hedge_delay(latency_key: str) -> Optional[float]:
+    """Seconds after which a call is hedged, None while too few latencies are known (or hedging is off)."""
+    if not HEDGING_ENABLED:
+        return None
+    p95 = get_latency_window(latency_key).quantile(HEDGE_QUANTILE)
+    return None if p95 is None else max(HEDGE_MIN_DELAY_SECONDS, p95)
+
+
+async def call_provider(provider: str, call: Callable[[], Awaitable[Any]],
+                        is_failure: Optional[Callable[[Any], bool]] = None,
+                        latency_key: Optional[str] = None, record_latency: bool = True) -> Any:
+    """
+    Runs one provider call under the provider's breaker and timeout. `is_failure` marks
+    results that count as failures for the breaker without raising (e.g. HTTP 5xx).
+    Latencies are tracked per `latency_key` (default: the provider), so calls of very
+    different size (a chat answer, a report) do not share one p95. Callers that only count
+    some results as samples pass `record_latency=False` and add them to get_latency_window
+    themselves. `call` must be the provider call alone: time spent waiting before it (e.g.
+    for a rate limiter) would count toward the timeout and the breaker's failures.
+    """
+    breaker = get_breaker(provider)
+    if not breaker.allow():
+        CIRCUIT_REJECTED.inc(provider=provider)
+        raise CircuitOpenError(f"{provider} circuit breaker is open")
+    start = time.monotonic()
+    try:
+        result = await asyncio.wait_for(call(), timeout=provider_timeout(provider))
+    except asyncio.TimeoutError:
+        PROVIDER_TIMEOUTS.inc(provider=provider)
+        breaker.record_failure()
+        raise TimeoutError(f"{provider} did not answer within {provider_timeout(provider):.0f}s")
+    except asyncio.CancelledError:
+        # A cancelled hedge says nothing about the provider's health
+        breaker._trial_inflight = False
+        raise
+    except Exception:
+        breaker.record_failure()
+        raise
+    if is_failure is not None and is_failure(result):
+        breaker.record_failure()
+    else:
+        breaker.record_success()
+        if record_latency:
+            get_latency_window(latency_key or provider).add(time.monotonic() - start)
+    return result
+
+
+async def hedged(attempts: list[tuple[str, Callable[[], Awaitable[Any]]]],
+                 discard: Optional[Callable[[Any], Awaitable[None]]] = None,
+                 is_failure: Optional[Callable[[Any], bool]] = None,
+                 latency_key: Optional[str] = None, may_hedge: Optional[Callable[[], bool]] = None,
+                 guarded: bool = True) -> Any:
+    """
+    Runs attempts[0] and, once it has been slower than its provider's p95 latency, also
+    attempts[1] (same or alternate provider); returns the first successful result. If the
+    first attempt fails before the hedge is due, the second one starts right away. The
+    slower attempt is cancelled, or passed to `discard` if it already finished.
+    `may_hedge` is asked before the second attempt starts; if it returns False (e.g. the
+    provider is overloaded), the call waits for the first attempt instead. Attempts run
+    under their provider's breaker and timeout (call_provider) unless `guarded` is False,
+    for attempts that apply them to the provider call themselves.
+    Raises HedgedCallError with the error of every attempt when all of them fail.
+    """
+    attempts = attempts[:2]
+    errors: dict[str, BaseException] = {}
+    tasks: dict[asyncio.Task, int] = {}
+    hedge_fired = False
+
+    def start(index: int):
+        provider, call = attempts[index]
+        key = latency_key if provider == attempts[0][0] else None
+        # The attempt's task copies the context: calls inside it are not hedged again
+        token = _inside_hedge.set(True)
+        try:
+            coroutine = call_provider(provider, call, is_failure, key) if guarded else call()
+            tasks[asyncio.create_task(coroutine)] = index
+        finally:
+            _inside_hedge.reset(token)
+
+    start(0)
+    next_attempt = 1
+    delay = hedge_delay(latency_key or attempts[0][0]) if len(attempts) > 1 else None
+    try:
+        while tasks:
+            done, _ = await asyncio.wait(
+                tasks, timeout=delay if next_attempt < len(attempts) else None,
+                return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                if may_hedge is not None and not may_hedge():
+                    HEDGES.inc(provider=attempts[next_attempt][0], outcome="skipped")
+                    delay = None
+                    continue
+                # The first attempt is slower than usual: hedge
+                HEDGES.inc(provider=attempts[next_attempt][0], outcome="fired")
+                hedge_fired = True
+                start(next_attempt)
+                next_attempt += 1
+                continue
+            for task in done:
+                index = tasks.pop(task)
+                provider = attempts[index][0]
+                if task.exception() is not None:
+                    errors[provider if provider not in errors else f"{provider}#{index + 1}"] = task.exception()
+                    continue
+                if hedge_fired and index == 1:
+                    HEDGES.inc(provider=provider, outcome="won")
+                return task.result()
+            if next_attempt < len(attempts) and not tasks and (may_hedge is None or may_hedge()):
+                # The first attempt failed before the hedge was due: fail over now
+                start(next_attempt)
+                next_attempt += 1
+        raise HedgedCallError(errors)
+    finally:
+        for task in tasks:
+            task.cancel()
+            if discard is not None:
+                task.add_done_callback(lambda t: _discard_result(t, discard))
+
+
+def _discard_result(task: asyncio.Task, discard: Callable[[Any], Awaitable[None]]):
+    if not task.cancelled() and task.exception() is None:
+        asyncio.ensure_future(discard(task.result()))
@@ -0,0 +1,263 @@
+"""
+Token accounting and budgets for the OpenAI calls.
+
+Every HTTP request and every background job runs with a TokenAccount: the endpoint (or
+job) it belongs to, the patient it works for and the tokens it has spent so far. Usage
+reported by the API is added to the account and to the per-endpoint, per-patient and
+per-stage token counters on /metrics, next to the per-stage latency histograms.
+
+Before a call, its prompt is counted locally (tiktoken when its encoding is available,
+otherwise about four characters per token) and checked against two budgets:
+
+    per call     TOKEN_BUDGET_<STAGE>, e.g. TOKEN_BUDGET_LLM_REPORT (CALL_BUDGETS below,
+                 otherwise TOKEN_BUDGET_PER_CALL, default 16000)
+    per request  TOKEN_BUDGET_PER_REQUEST (default 250000) for everything one request or
+                 background job has spent so far
+
+A prompt over budget is handled by the stage's policy (TOKEN_POLICY_<STAGE>):
+truncate (keeps the beginning and the end of the text), summarize (condenses the text
+with a cheaper model, for stages that provide a summarizer) or reject (raises
+TokenBudgetExceeded).
+"""
+
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Awaitable, Callable, Optional
+
+from utils.metrics import REGISTRY, current_stage, record_token_usage
+
+TOKENS_BY_ENDPOINT = REGISTRY.counter(
+    "llm_endpoint_tokens_total",
+    "Tokens reported by the OpenAI API, by endpoint (or background job) and kind.",
+    ("endpoint", "kind"))
+TOKENS_BY_PATIENT = REGISTRY.counter(
+    "llm_patient_tokens_total",
+    "Tokens reported by the OpenAI API, by patient and kind.",
+    ("tenant_id", "patient_id", "kind"))
+TOKENS_BY_STAGE = REGISTRY.counter(
+    "llm_stage_tokens_total",
+    "Tokens reported by the OpenAI API, by pipeline stage and kind.",
+    ("stage", "kind"))
+TOKENS_COUNTED = REGISTRY.counter(
+    "llm_counted_prompt_tokens_total",
+    "Prompt tokens counted locally before the call, by stage.",
+    ("stage",))
+BUDGET_ACTIONS = REGISTRY.counter(
+    "token_budget_actions_total",
+    "Prompts over a token budget, by stage, budget (call/request) and action (truncate/summarize/reject).",
+    ("stage", "budget", "action"))
+
+TRUNCATE, SUMMARIZE, REJECT = "truncate", "summarize", "reject"
+
+DEFAULT_CALL_BUDGET = int(os.getenv("TOKEN_BUDGET_PER_CALL", "16000"))
+REQUEST_BUDGET = int(os.getenv("TOKEN_BUDGET_PER_REQUEST", "250000"))
+
+# Stages whose prompts are expected to be larger than one document, with their policy.
+# Everything else (the classifier chains over one OCR text) is truncated at the default.
+CALL_BUDGETS = {
+    "llm.report": (100000, SUMMARIZE),
+    "llm.chat": (100000, REJECT),
+    "llm.realtime_session": (100000, REJECT),
+}
+
+# Tokens of the prompt templates around the text that is fitted into the budget
+PROMPT_OVERHEAD_TOKENS = 400
+# Approximate prompt tokens of one image at the default detail level
+IMAGE_TOKENS = 765
+
+
+class TokenBudgetExceeded(Exception):
+    pass
+
+
+@dataclass
+class TokenAccount:
+    """Tokens spent on behalf of one HTTP request or background job."""
+    job: Optional[str] = None           # background job name; None for HTTP requests
+    http_scope: Optional[dict] = None   # ASGI scope of the request, routed after the account is created
+    tenant_id: str = "-"
+    patient_id: str = "-"
+    budget: int = REQUEST_BUDGET
+    used: int = 0
+
+    @property
+    def endpoint(self) -> str:
+        if self.job is not None:
+            return f"job:{self.job}"
+        if self.http_scope is not None:
+            return getattr(self.http_scope.get("route"), "path", "unmatched")
+        return "unattributed"
+
+    def remaining(self) -> int:
+        return self.budget - self.used
+
+
+_account_var: ContextVar[Optional[TokenAccount]] = ContextVar("token_account", default=None)
+
+
+def current_account() -> TokenAccount:
+    account = _account_var.get()
+    return account if account is not None else TokenAccount()
+
+
+@contextmanager
+def token_account(job: Optional[str] = None, http_scope: Optional[dict] = None):
+    """
+    Runs the block with a fresh account. A job started by a request keeps the request's
+    patient but gets its own budget.
+    """
+    parent = _account_var.get()
+    account = TokenAccount(job=job, http_scope=http_scope)
+    if parent is not None:
+        account.tenant_id, account.patient_id = parent.tenant_id, parent.patient_id
+    token = _account_var.set(account)
+    try:
+        yield account
+    finally:
+        _account_var.reset(token)
+
+
+def attribute_patient(tenant_id: str, patient_id: str):
+    """Attributes the current request's token usage to the patient it operates on."""
+    account = _account_var.get()
+    if account is not None:
+        account.tenant_id, account.patient_id = tenant_id, patient_id
+
+
+def record_usage(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int],
+                 stage: Optional[str] = None):
+    """
+    Adds the usage reported by an OpenAI response to the token counters and the current
+    account. The stage defaults to the innermost stage being timed.
+    """
+    record_token_usage(model, prompt_tokens, completion_tokens)
+    account = current_account()
+    stage = stage or current_stage()
+    for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+        if not tokens:
+            continue
+        account.used += tokens
+        TOKENS_BY_ENDPOINT.inc(tokens, endpoint=account.endpoint, kind=kind)
+        TOKENS_BY_PATIENT.inc(tokens, tenant_id=account.tenant_id, patient_id=account.patient_id, kind=kind)
+        TOKENS_BY_STAGE.inc(tokens, stage=stage, kind=kind)
+
+
+@lru_cache(maxsize=8)
+def _encoding(model: str):
+    """The model's tiktoken encoding, or None if tiktoken or its encoding file is unavailable."""
+    try:
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"tiktoken encoding for {model} unavailable, estimating tokens from length: {str(e)}")
+        return None
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    encoding = _encoding(model)
+    if encoding is None:
+        return (len(text) + 3) // 4
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> str:
+    """Keeps the beginning and the end (dates and signatures are often at the bottom) of the text."""
+    marker = "\n[... text truncated ...]\n"
+    keep = max(0, max_tokens - count_tokens(marker, model))
+    head, tail = keep * 4 // 5, keep - keep * 4 // 5
+    encoding = _encoding(model)
+    if encoding is None:
+        head_chars, tail_chars = head * 4, tail * 4
+        return text[:head_chars] + marker + (text[-tail_chars:] if tail_chars else "")
+    tokens = encoding.encode(text, disallowed_special=())
+    return encoding.decode(tokens[:head]) + marker + (encoding.decode(tokens[-tail:]) if tail else "")
+
+
+def call_budget(stage: str) -> tuple[int, str]:
+    """(max prompt tokens, policy) of one call of the stage."""
+    budget, policy = CALL_BUDGETS.get(stage, (DEFAULT_CALL_BUDGET, TRUNCATE))
+    env_name = stage.upper().replace(".", "_")
+    return (int(os.getenv(f"TOKEN_BUDGET_{env_name}", budget)),
+            os.getenv(f"TOKEN_POLICY_{env_name}", policy))
+
+
+def _limit(stage: str) -> tuple[int, str, str]:
+    budget, policy = call_budget(stage)
+    remaining = current_account().remaining()
+    if remaining < budget:
+        return remaining, policy, "request"
+    return budget, policy, "call"
+
+
+def ensure_budget(stage: str, prompt_tokens: int):
+    """Counts a prompt that cannot be shortened (e.g. an image) and rejects it if it is over budget."""
+    TOKENS_COUNTED.inc(prompt_tokens, stage=stage)
+    limit, _, budget_name = _limit(stage)
+    if prompt_tokens > limit:
+        BUDGET_ACTIONS.inc(stage=stage, budget=budget_name, action=REJECT)
+        raise TokenBudgetExceeded(
+            f"{stage} prompt of {prompt_tokens} tokens exceeds the {budget_name} token budget ({limit})")
+
+
+async def fit_prompt(stage: str, text: str, overhead_tokens: int = PROMPT_OVERHEAD_TOKENS,
+                     summarize: Optional[Callable[[str, int], Awaitable[str]]] = None,
+                     model: str = "gpt-4o-mini") -> str:
+    """
+    Counts a prompt made of `text` plus `overhead_tokens` of template and returns the text,
+    shortened according to the stage's policy if the prompt is over budget.
+    Stages without a summarizer truncate instead of summarizing.
+    """
+    tokens = count_tokens(text, model)
+    TOKENS_COUNTED.inc(tokens + overhead_tokens, stage=stage)
+    limit, policy, budget_name = _limit(stage)
+    if tokens + overhead_tokens <= limit:
+        return text
+    allowed = limit - overhead_tokens
+    if policy == REJECT or allowed <= 0:
+        BUDGET_ACTIONS.inc(stage=stage, budget=budget_name, action=REJECT)
+        raise TokenBudgetExceeded(
+            f"{stage} prompt of {tokens + overhead_tokens} tokens exceeds the {budget_name} token budget ({limit})")
+    if policy == SUMMARIZE and summarize is not None:
+        BUDGET_ACTIONS.inc(stage=stage, budget=budget_name, action=SUMMARIZE)
+        print(f"Condensing {stage} prompt from {tokens} to {allowed} tokens.")
+        text = await summarize(text, allowed)
+        if count_tokens(text, model) <= allowed:
+            return text
+    BUDGET_ACTIONS.inc(stage=stage, budget=budget_name, action=TRUNCATE)
+    print(f"Truncating {stage} prompt from {tokens} to {allowed} tokens.")
+    return truncate_to_tokens(text, allowed, model)
+
+
+def split_by_tokens(text: str, max_tokens: int, model: str = "gpt-4o-mini") -> list[str]:
+    """Splits the text on paragraph boundaries into chunks of at most `max_tokens` (longer paragraphs are truncated)."""
+    chunks, current, current_tokens = [], [], 0
+    for paragraph in text.split("\n\n"):
+        tokens = count_tokens(paragraph, model)
+        if tokens > max_tokens:
+            paragraph, tokens = truncate_to_tokens(paragraph, max_tokens, model), max_tokens
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+def prewarm_tokenizer():
+    """Loads the tokenizer (which may download its encoding file) ahead of the first call."""
+    _encoding("gpt-4o-mini")
+    _encoding("gpt-4o")
+
+
+def tokenizer_loaded() -> bool:
+    """Whether prewarm_tokenizer has run (successfully or not)."""
+    return _encoding.cache_info().currsize >= 2
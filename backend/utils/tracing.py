@@ -0,0 +1,71 @@
+import asyncio
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Coroutine
+
+from fastapi import Request
+
+from utils.metrics import BACKGROUND_JOBS_INFLIGHT, HTTP_INFLIGHT, HTTP_REQUEST_DURATION
+from utils.token_budget import token_account
+
+TRACE_HEADER = "X-Trace-ID"
+
+# Trace ID of the request being handled. Background jobs started with spawn_background
+# run in a copy of the request's context, so they log under the same trace ID.
+trace_id_var: ContextVar[str] = ContextVar("trace_id", default="-")
+
+# Strong references to running background jobs; the event loop only keeps weak ones.
+_background_tasks: set[asyncio.Task] = set()
+
+
+def current_trace_id() -> str:
+    return trace_id_var.get()
+
+
+def spawn_background(coro: Coroutine, job: str) -> asyncio.Task:
+    """
+    Starts a background job that outlives the request, inheriting its trace ID.
+    The job is counted in the background_jobs_inflight gauge while it runs, and its
+    OpenAI tokens are accounted to the job (with the request's patient).
+    """
+    async def _run():
+        BACKGROUND_JOBS_INFLIGHT.inc(job=job)
+        try:
+            with token_account(job=job):
+                return await coro
+        finally:
+            BACKGROUND_JOBS_INFLIGHT.dec(job=job)
+
+    task = asyncio.create_task(_run(), name=f"background:{job}")
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+async def trace_middleware(request: Request, call_next):
+    """
+    Assigns every request a trace ID (taken from the X-Trace-ID header when the caller
+    sends one), echoes it in the response and records the request latency. The request
+    gets its own token account (see utils/token_budget.py).
+    """
+    trace_id = request.headers.get(TRACE_HEADER) or uuid.uuid4().hex
+    token = trace_id_var.set(trace_id)
+    HTTP_INFLIGHT.inc()
+    start = time.perf_counter()
+    status_code = 500
+    try:
+        with token_account(http_scope=request.scope):
+            response = await call_next(request)
+        status_code = response.status_code
+        response.headers[TRACE_HEADER] = trace_id
+        return response
+    finally:
+        route = request.scope.get("route")
+        HTTP_REQUEST_DURATION.observe(
+            time.perf_counter() - start,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status_code)
+        HTTP_INFLIGHT.dec()
+        trace_id_var.reset(token)
@@ -1,6 +1,7 @@
 import { useState, useEffect } from "react";
 import { toast } from "@/components/ui/use-toast";
 import { supabase } from "@/integrations/supabase/client";
+import { PATIENT_ID, TENANT_ID } from "@/lib/patientScope";
 import { DocumentCard } from "./document/DocumentCard"; // Assuming DocumentCard is in a 'document' subfolder
 import { DocumentPreview } from "./document/DocumentPreview"; // Assuming DocumentPreview is in a 'document' subfolder
 import { GrandmaFile } from "./document/utils"; // Assuming GrandmaFile is in a 'document' subfolder
@@ -18,6 +19,8 @@ const DoctorDocumentList = () => {
       const { data, error } = await supabase
         .from('grandma_files')
         .select('*')
+        .eq('tenant_id', TENANT_ID)
+        .eq('patient_id', PATIENT_ID)
         .order('upload_date', { ascending: false });
         
       if (error) {
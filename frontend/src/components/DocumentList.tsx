@@ -1,6 +1,7 @@
 import { useState, useEffect } from "react";
 import { toast } from "@/components/ui/use-toast";
 import { supabase } from "@/integrations/supabase/client";
+import { PATIENT_ID, TENANT_ID } from "@/lib/patientScope";
 import { DocumentCard } from "./document/DocumentCard";
 import { DocumentPreview } from "./document/DocumentPreview";
 import { GrandmaFile } from "./document/utils";
@@ -21,6 +22,8 @@ const DocumentList = () => {
       const { data, error } = await supabase
         .from('grandma_files')
         .select('*')
+        .eq('tenant_id', TENANT_ID)
+        .eq('patient_id', PATIENT_ID)
         .order('upload_date', { ascending: false });
         
       if (error) {
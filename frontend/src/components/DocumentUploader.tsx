@@ -5,6 +5,7 @@ import { toast } from "@/components/ui/use-toast";
 import { Upload } from "lucide-react";
 import { v4 as uuidv4 } from 'uuid';
 import { supabase } from "@/integrations/supabase/client";
+import { scopedUrl } from "@/lib/patientScope";
 
 const DocumentUploader = () => {
   const [isProcessing, setIsProcessing] = useState(false);
@@ -44,12 +45,8 @@ const DocumentUploader = () => {
         const formData = new FormData();
         formData.append('file', file);
 
-        const apiBaseUrl = window.location.hostname === 'localhost' 
-        ? 'http://localhost:8000' 
-        : 'https://epoch-cdtm-hacks-186667666313.europe-west3.run.app';
-
         // Send to backend API
-        const response = await fetch(`${apiBaseUrl}/upload-image`, {
+        const response = await fetch(scopedUrl('/upload-image'), {
           method: 'POST',
           body: formData
         });
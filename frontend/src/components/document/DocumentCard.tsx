@@ -13,13 +13,25 @@ interface DocumentCardProps {
 export const DocumentCard = ({ file, onPreview, onDelete }: DocumentCardProps) => {
   const fileTypeDisplay = getFileTypeDisplay(file.file_type);
   const iconColorClass = getFileIconColor(file.file_type) || 'text-blue-action';
+  // 256px WebP rendered at ingest; documents stored before derivatives existed show the icon
+  const thumbnailSrc = file.file_type.startsWith('image/') ? file.thumbnail_url : null;
 
   return (
     <Card className="p-4 flex justify-between items-center bg-background border border-border rounded-lg shadow-sm hover:shadow-md dark:hover:shadow-blue-action/20 transition-shadow duration-150">
       <div className="flex items-center space-x-4">
-        <div className="bg-blue-action/10 rounded-lg p-2.5">
-          <FileText className={`h-6 w-6 ${iconColorClass}`} />
-        </div>
+        {thumbnailSrc ? (
+          <img
+            src={thumbnailSrc}
+            alt=""
+            loading="lazy"
+            decoding="async"
+            className="h-11 w-11 rounded-lg object-cover bg-blue-action/10"
+          />
+        ) : (
+          <div className="bg-blue-action/10 rounded-lg p-2.5">
+            <FileText className={`h-6 w-6 ${iconColorClass}`} />
+          </div>
+        )}
         <div>
           <div className="flex items-center space-x-2 mb-0.5">
             <h4 className="font-semibold text-foreground text-base">
@@ -15,6 +15,8 @@ export const DocumentPreview = ({ file, isOpen, onOpenChange }: DocumentPreviewP
   }
   
   const isImage = file.file_type.startsWith('image/');
+  // Screen-size WebP rendered at ingest; older documents only have the original
+  const previewSrc = file.screen_url || file.preview_url;
   
   return (
     <Dialog open={isOpen} onOpenChange={onOpenChange}>
@@ -26,12 +28,12 @@ export const DocumentPreview = ({ file, isOpen, onOpenChange }: DocumentPreviewP
           </DialogDescription>
         </DialogHeader>
         <div className="p-2">
-          {file.preview_url ? (
+          {previewSrc ? (
             <div className="flex flex-col items-center">
               <div className="border rounded overflow-hidden mb-4">
                 {isImage ? (
                   <img 
-                    src={file.preview_url} 
+                    src={previewSrc} 
                     alt="File preview" 
                     className="max-w-full h-auto max-h-[60vh] object-contain"
                   />
@@ -9,6 +9,8 @@ export interface GrandmaFile {
   file_size: number;
   upload_date: string;
   preview_url?: string;
+  screen_url?: string | null;
+  thumbnail_url?: string | null;
 }
 
 // Sort files based on provided sort settings
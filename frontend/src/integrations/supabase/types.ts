@@ -31,9 +31,13 @@ export type Database = {
           file_size: number
           file_type: string
           id: string
-          keypoints: string | null
+          keypoints: Json | null
+          patient_id: string
           preview_url: string | null
+          screen_url: string | null
+          tenant_id: string
           text: string | null
+          thumbnail_url: string | null
           upload_date: string
         }
         Insert: {
@@ -42,9 +46,13 @@ export type Database = {
           file_size: number
           file_type: string
           id?: string
-          keypoints?: string | null
+          keypoints?: Json | null
+          patient_id?: string
           preview_url?: string | null
+          screen_url?: string | null
+          tenant_id?: string
           text?: string | null
+          thumbnail_url?: string | null
           upload_date?: string
         }
         Update: {
@@ -53,9 +61,13 @@ export type Database = {
           file_size?: number
           file_type?: string
           id?: string
-          keypoints?: string | null
+          keypoints?: Json | null
+          patient_id?: string
           preview_url?: string | null
+          screen_url?: string | null
+          tenant_id?: string
           text?: string | null
+          thumbnail_url?: string | null
           upload_date?: string
         }
         Relationships: []
@@ -0,0 +1,13 @@
+// The patient (and clinic) this client works on. The backend reads the same scope from
+// the patient_id / tenant_id query parameters (backend/routers/patient_scope.py), and the
+// Supabase tables are partitioned by the same two columns.
+export const PATIENT_ID: string = import.meta.env.VITE_PATIENT_ID ?? "grandma";
+export const TENANT_ID: string = import.meta.env.VITE_TENANT_ID ?? "default";
+
+export const API_BASE_URL = window.location.hostname === 'localhost'
+  ? 'http://localhost:8000'
+  : 'https://epoch-cdtm-hacks-186667666313.europe-west3.run.app';
+
+// Backend URL of a patient-scoped endpoint, e.g. scopedUrl('/get-report')
+export const scopedUrl = (path: string) =>
+  `${API_BASE_URL}${path}?${new URLSearchParams({ patient_id: PATIENT_ID, tenant_id: TENANT_ID })}`;
@@ -7,7 +7,7 @@ import { FileText, Printer, Mic, MicOff, ChevronDown, ChevronUp } from "lucide-r
 import { toast } from "@/components/ui/use-toast";
 import ReactMarkdown from "react-markdown";
 import remarkGfm from "remark-gfm";
-import { supabase } from "@/integrations/supabase/client";
+import { scopedUrl } from "@/lib/patientScope";
 import DoctorVoiceAssistant from "@/components/DoctorVoiceAssistant";
 
 interface ReportSection {
@@ -32,34 +32,38 @@ const DoctorDashboard = () => {
   const [reportSectionsArray, setReportSectionsArray] = useState<ReportSection[]>([]);
   const [referencesSection, setReferencesSection] = useState<ReportSection | null>(null);
   const [reportSectionOpenStates, setReportSectionOpenStates] = useState<Record<string, boolean>>({});
+  const [isReportPartial, setIsReportPartial] = useState(false);
   const [statusMessage, setStatusMessage] = useState<string | null>(null);
   const [showStatus, setShowStatus] = useState(false);
   const statusTimeout = useRef<NodeJS.Timeout | null>(null);
 
   useEffect(() => {
+    let refreshTimeout: NodeJS.Timeout | undefined;
+    let events: EventSource | undefined;
+    // Version of the report on screen; /get-report answers 304 while it is current
+    let etag: string | null = null;
+    // Only without the event stream is a report that is still being written polled
+    let pollWhilePartial = false;
+    let partial = false;
+
     const fetchAndParseReport = async () => {
+      clearTimeout(refreshTimeout);
       try {
-        const { data, error } = await supabase
-          .from('grandma_reports' as any)
-          .select('text')
-          .order('created_at', { ascending: false })
-          .limit(1)
-          .single();
-
-        if (error && error.code === 'PGRST116') {
-          setReportMainTitle("No documents have been uploaded by the patient yet.");
-          setReportSectionsArray([]);
-          setReferencesSection(null);
-          setReportSectionOpenStates({});
+        // The patient's latest report; one that is still being generated is shown section by section
+        const response = await fetch(scopedUrl('/get-report'), { headers: etag ? { 'If-None-Match': etag } : {} });
+        if (response.status === 304) {
+          if (partial && pollWhilePartial) {
+            refreshTimeout = setTimeout(fetchAndParseReport, 3000);
+          }
           return;
         }
-
-        if (error) {
-          toast({ title: "Error Loading Report", description: error.message, variant: "destructive" });
+        if (!response.ok) {
+          toast({ title: "Error Loading Report", description: `${response.status} ${response.statusText}`, variant: "destructive" });
           return;
         }
+        const data = await response.json();
 
-        if (!data || !(data as any).text) {
+        if (!data.success || !data.report) {
           setReportMainTitle("No documents have been uploaded by the patient yet.");
           setReportSectionsArray([]);
           setReferencesSection(null);
@@ -67,7 +71,14 @@ const DoctorDashboard = () => {
           return;
         }
 
-        const rawMarkdown = (data as any).text as string;
+        etag = response.headers.get('ETag');
+        partial = data.partial === true;
+        setIsReportPartial(partial);
+        if (partial && pollWhilePartial) {
+          refreshTimeout = setTimeout(fetchAndParseReport, 3000);
+        }
+
+        const rawMarkdown = data.report as string;
         let mainTitle = "Comprehensive Medical Report";
         let contentToParse = rawMarkdown;
 
@@ -137,7 +148,8 @@ const DoctorDashboard = () => {
           setReferencesSection(tempReferencesSection);
           initialOpenStates[tempReferencesSection.id] = false; // Ensure references also start collapsed
         }
-        setReportSectionOpenStates(initialOpenStates);
+        // Keep sections the doctor opened while the report was still being written
+        setReportSectionOpenStates(prevStates => ({ ...initialOpenStates, ...prevStates }));
 
       } catch (err) {
         console.error("Unexpected error processing report:", err);
@@ -145,7 +157,32 @@ const DoctorDashboard = () => {
       }
     };
 
+    // The backend announces new drafts (report.progress "section") and new versions
+    // (report.version) over /events; polling is only a fallback if the stream fails.
+    if (typeof EventSource === "undefined") {
+      pollWhilePartial = true;
+    } else {
+      events = new EventSource(scopedUrl('/events'));
+      // Also sent on connect for the current report, which catches up on anything missed
+      events.addEventListener("report.version", () => fetchAndParseReport());
+      events.addEventListener("report.progress", (event) => {
+        const { stage } = JSON.parse((event as MessageEvent).data);
+        // A failed run's draft is withdrawn: /get-report goes back to the previous report
+        if (stage === "section" || stage === "failed") {
+          fetchAndParseReport();
+        }
+      });
+      events.onerror = () => {
+        events?.close();
+        pollWhilePartial = true;
+        fetchAndParseReport();
+      };
+    }
     fetchAndParseReport();
+    return () => {
+      events?.close();
+      clearTimeout(refreshTimeout);
+    };
   }, []);
 
   // Effect for recording timer
@@ -227,6 +264,9 @@ const DoctorDashboard = () => {
           {reportMainTitle && (
             <div className="border-t border-border pt-10 mt-12">
               <h2 className="text-3xl lg:text-4xl font-bold text-blue-heading mb-8">{reportMainTitle}</h2>
+              {isReportPartial && (
+                <p className="text-muted-foreground -mt-6 mb-8">The remaining sections are still being written…</p>
+              )}
             </div>
           )}
           {reportSectionsArray.map((section) => {
@@ -6,6 +6,7 @@ import { useState, useEffect, useRef } from "react";
 import { useNavigate } from "react-router-dom";
 import { supabase } from "@/integrations/supabase/client";
 import { Avatar, AvatarFallback, AvatarImage } from "@/components/ui/avatar";
+import { PATIENT_ID, TENANT_ID, scopedUrl } from "@/lib/patientScope";
 
 // Custom header without navigation
 const CustomHeader = () => {
@@ -45,6 +46,9 @@ const PatientUpload = () => {
       const { data, error } = await supabase
         .from('grandma_reports' as any)
         .select('created_at')
+        .eq('tenant_id', TENANT_ID)
+        .eq('patient_id', PATIENT_ID)
+        .eq('status', 'complete')
         .order('created_at', { ascending: false })
         .limit(1)
         .single();
@@ -75,24 +79,58 @@ const PatientUpload = () => {
     }
   };
 
-  // Set up polling for new reports when generation is started
+  // Wait for the new report when generation is started: the backend pushes a
+  // report.version event over /events; polling is only a fallback if the stream fails.
   useEffect(() => {
     let intervalId: number | undefined;
-    
-    if (isGenerating) {
+    let events: EventSource | undefined;
+
+    const onReportReady = () => {
+      setIsGenerating(false);
+      toast({ title: "Success!", description: "Report successfully generated." });
+      navigate('/doctor');
+    };
+
+    const startPolling = () => {
+      if (intervalId) return;
       // Poll every 2 seconds to check for new reports
       intervalId = window.setInterval(async () => {
         const newReportFound = await checkForNewReport();
         if (newReportFound) {
-          setIsGenerating(false);
-          toast({ title: "Success!", description: "Report successfully generated." });
-          navigate('/doctor');
+          onReportReady();
         }
       }, 2000);
+    };
+
+    if (isGenerating) {
+      if (typeof EventSource === "undefined") {
+        startPolling();
+      } else {
+        events = new EventSource(scopedUrl('/events'));
+        events.addEventListener("report.version", (event) => {
+          // On connect the stream also announces the current report; only a newer one counts
+          const { created_at } = JSON.parse((event as MessageEvent).data);
+          if (!lastCheckTimestamp.current || created_at > lastCheckTimestamp.current) {
+            onReportReady();
+          }
+        });
+        events.addEventListener("report.progress", (event) => {
+          const { stage, error } = JSON.parse((event as MessageEvent).data);
+          if (stage === "failed") {
+            setIsGenerating(false);
+            toast({ title: "Error Generating Report", description: error, variant: "destructive" });
+          }
+        });
+        events.onerror = () => {
+          events?.close();
+          startPolling();
+        };
+      }
     }
 
-    // Clean up the interval when component unmounts or generation stops
+    // Clean up the stream and interval when component unmounts or generation stops
     return () => {
+      events?.close();
       if (intervalId) {
         window.clearInterval(intervalId);
       }
@@ -106,6 +144,9 @@ const PatientUpload = () => {
         const { data } = await supabase
           .from('grandma_reports' as any)
           .select('created_at')
+          .eq('tenant_id', TENANT_ID)
+          .eq('patient_id', PATIENT_ID)
+          .eq('status', 'complete')
           .order('created_at', { ascending: false })
           .limit(1)
           .single();
@@ -126,11 +167,7 @@ const PatientUpload = () => {
     if (isGenerating) return;
 
     setIsGenerating(true);
-    // Placeholder URL - update this with your actual backend endpoint
-    const apiBaseUrl = window.location.hostname === 'localhost'
-      ? 'http://localhost:8000'
-      : 'https://epoch-cdtm-hacks-186667666313.europe-west3.run.app';
-    const reportGenerationUrl = `${apiBaseUrl}/trigger-report-generation`; 
+    const reportGenerationUrl = scopedUrl('/trigger-report-generation');
     
     toast({ title: "Processing...", description: "Requesting report generation." });
 